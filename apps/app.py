@@ -1,5 +1,5 @@
 import streamlit as st
-import leafmap.foliumap as leafmap
+from thinkgreen import streamlit_utils as stu
 
 st.set_page_config(layout="wide")
 
@@ -36,18 +36,14 @@ with row1_col2:
     empty = st.empty()
 
     if keyword:
-        options = leafmap.search_xyz_services(keyword=keyword)
+        options = stu.search_basemaps(keyword, free_only=True)
         if checkbox:
-            options = options + leafmap.search_qms(keyword=keyword)
+            options = options + stu.search_qms(keyword)
 
         tiles = empty.multiselect("Select XYZ tiles to add to the map:", options)
 
     with row1_col1:
-        m = leafmap.Map()
-
-        if tiles is not None:
-            for tile in tiles:
-                m.add_xyz_service(tile)
-
+        # The map lives in the session state; only newly selected tiles are built.
+        m = stu.get_map()
+        m.set_layers({tile: stu.basemap_layer(tile) for tile in tiles or []})
         m.to_streamlit(width, height)
-
@@ -0,0 +1,73 @@
+"""Compares CSV-to-vector conversion throughput against the row-by-row implementation.
+
+Usage:
+    python benchmarks/bench_add_csv.py [n_rows]
+"""
+
+import csv
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def write_csv(path, n, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(path, "w") as f:
+        f.write("id,longitude,latitude,value\n")
+        for start in range(0, n, 100000):
+            size = min(100000, n - start)
+            block = np.column_stack(
+                (
+                    np.arange(start, start + size),
+                    rng.uniform(-180, 180, size),
+                    rng.uniform(-85, 85, size),
+                    rng.normal(size=size),
+                )
+            )
+            np.savetxt(f, block, fmt=["%d", "%.6f", "%.6f", "%.4f"], delimiter=",")
+
+
+def legacy_add_csv(in_csv, out_file, out_format, x="longitude", y="latitude"):
+    """The DictReader + shapely.Point implementation that add_csv replaced."""
+    import geopandas as gpd
+    from shapely.geometry import Point
+
+    points = []
+    with open(in_csv, "r") as csv_file:
+        reader = csv.DictReader(csv_file)
+        for row in reader:
+            points.append(Point(float(row[x]), float(row[y])))
+
+    gdf = gpd.GeoDataFrame(geometry=points)
+    if out_format == "geojson":
+        gdf.to_file(out_file, driver="GeoJSON")
+    else:
+        gdf.to_file(out_file, driver="ESRI Shapefile")
+
+
+def main(n):
+    from thinkgreen.common import csv_to_vector
+
+    with tempfile.TemporaryDirectory() as tmp:
+        in_csv = os.path.join(tmp, "points.csv")
+        write_csv(in_csv, n)
+
+        runs = [
+            ("legacy geojson", lambda: legacy_add_csv(in_csv, os.path.join(tmp, "a.geojson"), "geojson")),
+            ("streaming geojson", lambda: csv_to_vector(in_csv, os.path.join(tmp, "b.geojson"), "geojson")),
+            ("streaming shapefile", lambda: csv_to_vector(in_csv, os.path.join(tmp, "c.shp"), "shapefile")),
+            ("streaming geoparquet", lambda: csv_to_vector(in_csv, os.path.join(tmp, "d.parquet"), "geoparquet")),
+        ]
+        print(f"{n} rows")
+        for label, run in runs:
+            start = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - start
+            print(f"{label:<22} {elapsed:8.2f} s {n / elapsed:12,.0f} rows/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
@@ -0,0 +1,64 @@
+"""Counts the widget messages and wall time of building a map with and without Map.batch().
+
+Usage:
+    python benchmarks/bench_batch.py [n_layers]
+"""
+
+import sys
+import time
+import warnings
+
+import ipyleaflet
+import ipywidgets
+
+warnings.simplefilter("ignore", DeprecationWarning)
+
+_messages = []
+_send = ipywidgets.Widget._send
+
+
+def _counting_send(self, msg, buffers=None):
+    _messages.append(msg.get("method"))
+    return _send(self, msg, buffers)
+
+
+def build(n, batch):
+    import thinkgreen
+
+    m = thinkgreen.Map()
+    layers = [
+        ipyleaflet.TileLayer(url=f"https://tiles.example.com/{i}/{{z}}/{{x}}/{{y}}.png", name=f"Layer {i}")
+        for i in range(n)
+    ]
+
+    _messages.clear()
+    start = time.perf_counter()
+    if batch:
+        with m.batch():
+            _populate(m, layers)
+    else:
+        _populate(m, layers)
+    elapsed = time.perf_counter() - start
+    assert len(m.layers) == n + 1
+    return len(_messages), elapsed
+
+
+def _populate(m, layers):
+    for layer in layers:
+        m.add(layer)
+    m.add_layers_control()
+    m.add_search_control()
+    m.center = (40, -100)
+    m.zoom = 4
+
+
+def main(n):
+    ipywidgets.Widget._send = _counting_send
+    print(f"{n} layers")
+    for label, batch in [("unbatched", False), ("m.batch()", True)]:
+        count, elapsed = build(n, batch)
+        print(f"{label:<10} {count:6d} messages {elapsed * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -0,0 +1,47 @@
+"""Times chart downsampling and rendering for long series.
+
+Raw, non-downsampled renders are only timed for line plots up to 1e6
+points; a raw bar chart of 1e5 points already takes minutes.
+
+Usage:
+    python benchmarks/bench_downsample.py [n_points ...]
+"""
+
+import sys
+import time
+
+import numpy as np
+
+
+def series(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.arange(n, dtype="float64"), np.cumsum(rng.normal(size=n))
+
+
+def timed(run):
+    start = time.perf_counter()
+    result = run()
+    return result, time.perf_counter() - start
+
+
+def main(sizes):
+    from thinkgreen import charts
+
+    charts.render_chart("plot", [0, 1], [0, 1])  # warm up matplotlib
+    for n in sizes:
+        x, y = series(n)
+        print(f"{n:,} points")
+        for method in ("lttb", "minmax", "mean"):
+            (xs, _), elapsed = timed(lambda: charts.downsample_series(x, y, 300, method=method))
+            print(f"  {method:<16} {elapsed * 1000:9.1f} ms -> {len(xs)} points")
+
+        for kind in ("plot", "bar"):
+            _, elapsed = timed(lambda: charts.render_chart(kind, x, y))
+            print(f"  render {kind:<9} {elapsed * 1000:9.1f} ms")
+            if kind == "plot" and n <= 1000000:
+                _, elapsed = timed(lambda: charts.render_chart(kind, x, y, downsample=None))
+                print(f"  render {kind} raw {elapsed * 1000:9.1f} ms")
+
+
+if __name__ == "__main__":
+    main([int(float(n)) for n in sys.argv[1:]] or [100000, 1000000, 10000000])
@@ -0,0 +1,53 @@
+"""Times exporting folium maps of many points, one Marker per point vs add_points.
+
+Usage:
+    python benchmarks/bench_folium_points.py [n_points]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+
+def legacy_points(lon, lat):
+    """One folium.Marker per point, as the folium path used to do."""
+    import folium
+
+    m = folium.Map()
+    for x, y in zip(lon, lat):
+        folium.Marker([y, x]).add_to(m)
+    return m
+
+
+def main(n):
+    from thinkgreen import foliumap
+
+    rng = np.random.default_rng(0)
+    lon = rng.uniform(-180, 180, n)
+    lat = rng.uniform(-85, 85, n)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_n = min(n, 10000)
+        start = time.perf_counter()
+        path = os.path.join(tmp, "legacy.html")
+        legacy_points(lon[:legacy_n], lat[:legacy_n]).save(path)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(path)
+        print(f"folium.Marker x {legacy_n:,}: {elapsed:7.2f} s {size / 1e6:8.1f} MB ({size / legacy_n:.0f} B/point)")
+
+        for mode in ("canvas", "cluster"):
+            start = time.perf_counter()
+            path = os.path.join(tmp, f"{mode}.html")
+            m = foliumap.Map()
+            m.add_points(lon, lat, mode=mode)
+            m.save(path)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(path)
+            print(f"add_points {mode:<7} x {n:,}: {elapsed:7.2f} s {size / 1e6:8.1f} MB ({size / n:.1f} B/point)")
+
+
+if __name__ == "__main__":
+    main(int(float(sys.argv[1])) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,84 @@
+"""Measures the build time, size and search latency of a thinkgreen.geocoder gazetteer.
+
+Usage:
+    python benchmarks/bench_geocoder.py [places]
+
+Builds an index of ``places`` random names (default 2,000,000) made of
+syllables, with Zipf-distributed importance, then times searches for
+prefixes of 1 to 8 characters of random names, and for misspelled names.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+
+def random_names(n, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    syllables = np.array(
+        ["ka", "lo", "mi", "san", "to", "ber", "ri", "no", "va", "el", "port", "ville", "ton", "burg", "sa", "de"]
+    )
+    words = []
+    for length in (2, 3, 4):
+        parts = syllables[rng.integers(0, len(syllables), size=(n, length))]
+        words.append(["".join(row).capitalize() for row in parts])
+    shape = rng.integers(0, 3, n)
+    return [
+        words[0][i] if s == 0 else f"{words[1][i]} {words[2][i]}" if s == 1 else f"{words[2][i]} {words[0][i]}"
+        for i, s in enumerate(shape)
+    ], rng
+
+
+def percentiles(times):
+    import numpy as np
+
+    ms = np.asarray(times) * 1000
+    return f"p50 {np.percentile(ms, 50):.3f} ms, p99 {np.percentile(ms, 99):.3f} ms, max {ms.max():.3f} ms"
+
+
+def main(n=2_000_000):
+    import pandas as pd
+
+    from thinkgreen.geocoder import Gazetteer, build_gazetteer
+
+    names, rng = random_names(n)
+    df = pd.DataFrame(
+        {
+            "name": names,
+            "longitude": rng.uniform(-180, 180, n),
+            "latitude": rng.uniform(-85, 85, n),
+            "population": rng.zipf(1.5, n).clip(max=10**8),
+        }
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "places.gaz")
+        start = time.perf_counter()
+        build_gazetteer(df, path, importance="population").close()
+        print(f"{n:,} places indexed in {time.perf_counter() - start:.1f} s, {os.path.getsize(path) / 2**20:.0f} MiB")
+
+        start = time.perf_counter()
+        gazetteer = Gazetteer(path)
+        print(f"opened in {(time.perf_counter() - start) * 1000:.2f} ms")
+        samples = rng.choice(names, 2000)
+        for length in (1, 2, 3, 4, 6, 8):
+            times = []
+            for name in samples:
+                start = time.perf_counter()
+                gazetteer.search(name[:length])
+                times.append(time.perf_counter() - start)
+            print(f"prefix of {length}: {percentiles(times)}")
+        times = []
+        for name in samples[:500]:
+            typo = name[:2] + name[3:]
+            start = time.perf_counter()
+            gazetteer.search(typo)
+            times.append(time.perf_counter() - start)
+        print(f"misspelled: {percentiles(times)}")
+        gazetteer.close()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000)
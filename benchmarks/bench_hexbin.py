@@ -0,0 +1,53 @@
+"""Measures binning time and payload of thinkgreen.hexbin for millions of points.
+
+Usage:
+    python benchmarks/bench_hexbin.py [points]
+
+Builds a BinPyramid of ``points`` random points (default 10,000,000)
+clustered around a few cities, then times the cells of a 1024x512 pixel
+view at several zoom levels, the first time (binned per tile below
+pyramid_zoom) and after a small pan, and reports the GeoJSON payload,
+which follows the view size rather than the number of points.
+"""
+
+import json
+import sys
+import time
+
+
+def clustered_points(n, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    cities = np.array([(-74.0, 40.7), (2.35, 48.86), (139.7, 35.7), (-46.6, -23.5), (77.2, 28.6)])
+    which = rng.integers(0, len(cities), n)
+    spread = rng.exponential(0.5, n)
+    lon = cities[which, 0] + rng.normal(0, 1, n) * spread
+    lat = cities[which, 1] + rng.normal(0, 1, n) * spread
+    return lon, lat, rng.lognormal(12, 1, n)
+
+
+def main(n=10_000_000):
+    from thinkgreen.hexbin import BinPyramid, to_geojson, view_bounds
+
+    lon, lat, values = clustered_points(n)
+    start = time.perf_counter()
+    pyramid = BinPyramid(lon, lat, values, agg="mean")
+    print(f"{n:,} points binned for zoom 0-{pyramid.pyramid_zoom} in {time.perf_counter() - start:.2f} s")
+
+    for zoom in (2, 6, 9, 12, 15):
+        for label, center in (("view", (40.7, -74.0)), ("pan", (40.72, -73.95))):
+            bounds = view_bounds(center, zoom)
+            start = time.perf_counter()
+            cells = pyramid.cells(zoom, bounds)
+            data = to_geojson(pyramid, zoom, cells, pyramid.aggregate(cells), 0, 1e6)
+            elapsed = time.perf_counter() - start
+            size = len(json.dumps(data, separators=(",", ":")))
+            print(
+                f"zoom {zoom:2} {label:4}: {len(cells[0]):5,} cells, {size / 1024:6.0f} KiB "
+                f"in {elapsed * 1000:6.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000)
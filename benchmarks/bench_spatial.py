@@ -0,0 +1,94 @@
+"""Measures spatial index build, query and clip times of Map.query and Map.clip_layers on synthetic polygon layers.
+
+Usage:
+    python benchmarks/bench_spatial.py [n_features ...]
+"""
+
+import sys
+import time
+import warnings
+
+warnings.simplefilter("ignore", DeprecationWarning)
+
+
+def squares(n, seed=0):
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    origins = rng.uniform([-180, -85], [179.99, 84.99], size=(n, 2)).tolist()
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {"id": i},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[x, y], [x + 0.01, y], [x + 0.01, y + 0.01], [x, y + 0.01], [x, y]]],
+                },
+            }
+            for i, (x, y) in enumerate(origins)
+        ],
+    }
+
+
+def main(sizes):
+    import numpy as np
+
+    from thinkgreen import spatial, thinkgreen
+
+    rng = np.random.default_rng(1)
+    print(
+        f"{'features':>10} {'build s':>9} {'point ms':>9} {'bbox ms':>9} {'scan ms':>9}"
+        f" {'clipped':>9} {'clip s':>9} {'first ms':>9}"
+    )
+    for n in sizes:
+        data = squares(n)
+        m = thinkgreen.Map()
+        m.add_geojson(data, name="squares")
+
+        start = time.perf_counter()
+        m.query((0, 0))
+        build = time.perf_counter() - start
+
+        points = rng.uniform([-180, -85], [180, 85], size=(1000, 2)).tolist()
+        start = time.perf_counter()
+        for lon, lat in points:
+            m.query((lon, lat))
+        point = (time.perf_counter() - start) / len(points) * 1000
+
+        start = time.perf_counter()
+        for lon, lat in points:
+            m.query((lon, lat, lon + 0.1, lat + 0.1))
+        bbox = (time.perf_counter() - start) / len(points) * 1000
+
+        # The linear scan a query replaces, over bounding boxes only.
+        start = time.perf_counter()
+        lon, lat = points[0]
+        [
+            f
+            for f in data["features"]
+            if f["geometry"]["coordinates"][0][0][0] <= lon <= f["geometry"]["coordinates"][0][2][0]
+            and f["geometry"]["coordinates"][0][0][1] <= lat <= f["geometry"]["coordinates"][0][2][1]
+        ]
+        scan = (time.perf_counter() - start) * 1000
+
+        # A clip over a quarter of the world, and the delay until its first summary update.
+        index = next(iter(m._spatial_indexes.values()))[1]
+        first = []
+        start = time.perf_counter()
+        future = spatial.submit_clip(
+            {"squares": index},
+            (-180, 0, 0, 85),
+            on_progress=lambda *args: first or first.append(time.perf_counter() - start),
+        )
+        clipped = len(future.result()["squares"])
+        clip = time.perf_counter() - start
+        print(
+            f"{n:>10} {build:>9.2f} {point:>9.3f} {bbox:>9.3f} {scan:>9.1f}"
+            f" {clipped:>9} {clip:>9.2f} {first[0] * 1000:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
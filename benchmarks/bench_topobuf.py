@@ -0,0 +1,51 @@
+"""Compares GeoJSON and binary (thinkgreen.topobuf) payloads of shapefiles added with add_shp.
+
+Usage:
+    python benchmarks/bench_topobuf.py [path.shp ...]
+"""
+
+import json
+import os
+import sys
+import time
+import warnings
+
+warnings.simplefilter("ignore", DeprecationWarning)
+
+SAMPLE_SHP = os.path.join(
+    os.path.dirname(__file__), os.pardir, "docs", "examples", "sample_data", "countries.shp"
+)
+
+
+def main(paths):
+    import thinkgreen.foliumap as foliumap
+    from thinkgreen import thinkgreen, topobuf
+
+    for path in paths:
+        m = thinkgreen.Map()
+        layer = m.add_shp(path)
+        geojson = json.dumps(layer.data, separators=(",", ":")).encode("utf-8")
+
+        start = time.perf_counter()
+        encoded = topobuf.encode(layer.data)
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        topobuf.decode(encoded)
+        decode_time = time.perf_counter() - start
+
+        html = {}
+        for encoding in ("json", "binary"):
+            fm = foliumap.Map()
+            fm.add_shp(path, encoding=encoding)
+            html[encoding] = len(fm.get_root().render().encode("utf-8"))
+
+        print(os.path.basename(path), f"({len(layer.data['features'])} features)")
+        print(f"  ipyleaflet GeoJSON {len(geojson):>12,} bytes")
+        print(f"  topobuf            {len(encoded):>12,} bytes  {len(geojson) / len(encoded):5.1f}x smaller")
+        print(f"  encode {encode_time * 1000:.1f} ms, decode (Python) {decode_time * 1000:.1f} ms")
+        print(f"  folium HTML json   {html['json']:>12,} bytes")
+        print(f"  folium HTML binary {html['binary']:>12,} bytes  {html['json'] / html['binary']:5.1f}x smaller")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:] or [SAMPLE_SHP])
@@ -0,0 +1,45 @@
+"""Measures how thinkgreen.common.read_vector_files scales with the number of processes.
+
+Usage:
+    python benchmarks/bench_vector_dir.py [files] [features]
+
+Writes ``files`` shapefiles of ``features`` random polygons each in a
+projected CRS (defaults 64 and 2000), then reads, reprojects and
+simplifies them with 1, 2, 4... processes up to the number of CPUs.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+
+def main(files=64, features=2000):
+    import geopandas as gpd
+
+    import generators
+    from thinkgreen.common import find_vector_files, read_vector_files
+
+    with tempfile.TemporaryDirectory() as tmp:
+        start = time.perf_counter()
+        for i in range(files):
+            gdf = gpd.GeoDataFrame.from_features(generators.polygon_features(features, seed=i), crs="EPSG:4326")
+            gdf.to_crs(epsg=3857).to_file(os.path.join(tmp, f"layer_{i}.shp"))
+        print(f"{files} shapefiles of {features} polygons written in {time.perf_counter() - start:.1f} s")
+
+        paths = find_vector_files(tmp)
+        processes, serial = 1, None
+        while processes <= (os.cpu_count() or 1):
+            start = time.perf_counter()
+            read_vector_files(paths, simplify=True, processes=processes)
+            elapsed = time.perf_counter() - start
+            serial = serial or elapsed
+            print(f"{processes} processes: {elapsed:.2f} s, speedup {serial / elapsed:.2f}x")
+            processes *= 2
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 64, int(args[1]) if len(args) > 1 else 2000)
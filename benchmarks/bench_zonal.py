@@ -0,0 +1,72 @@
+"""Measures the time and peak memory of thinkgreen.raster.zonal_stats on a generated GeoTIFF.
+
+Usage:
+    python benchmarks/bench_zonal.py [size] [processes]
+
+The raster is size x size float32 pixels (default 16000, 1 GiB uncompressed),
+written block by block so generating it does not need the memory either.
+"""
+
+import os
+import resource
+import sys
+import tempfile
+import time
+
+
+def make_raster(path, size, block=512):
+    import numpy as np
+    import rasterio
+    from rasterio.transform import from_bounds
+    from rasterio.windows import Window
+
+    profile = dict(
+        driver="GTiff", width=size, height=size, count=1, dtype="float32", crs="EPSG:4326",
+        transform=from_bounds(-90, 30, -80, 40, size, size), tiled=True,
+        blockxsize=block, blockysize=block, compress="deflate", nodata=-9999,
+    )
+    with rasterio.open(path, "w", **profile) as dst:
+        for row in range(0, size, block):
+            for col in range(0, size, block):
+                h, w = min(block, size - row), min(block, size - col)
+                yy, xx = np.mgrid[row : row + h, col : col + w].astype("float32")
+                dst.write(np.sin(xx / 500) * np.cos(yy / 700) * 100, 1, window=Window(col, row, w, h))
+
+
+def peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main(size=16000, processes=None):
+    import numpy as np
+    import shapely
+
+    from thinkgreen import raster
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.tif")
+        start = time.perf_counter()
+        make_raster(path, size)
+        print(f"raster {size}x{size}: {os.path.getsize(path) / 2**20:.0f} MiB on disk, "
+              f"written in {time.perf_counter() - start:.1f} s")
+
+        rng = np.random.default_rng(0)
+        centers = rng.uniform([-89, 31], [-81, 39], size=(200, 2))
+        small = [shapely.Point(x, y).buffer(0.2) for x, y in centers]
+        cases = {
+            "200 small polygons": small,
+            "1 polygon over the whole raster": [shapely.box(-90, 30, -80, 40).buffer(-0.01)],
+        }
+        before = peak_mb()
+        for name, polygons in cases.items():
+            start = time.perf_counter()
+            stats = raster.zonal_stats(path, polygons, hist_range=(-100, 100), processes=processes)
+            elapsed = time.perf_counter() - start
+            pixels = sum(item["count"] for item in stats)
+            print(f"{name}: {pixels:,} pixels in {elapsed:.2f} s, peak RSS {peak_mb():.0f} MiB "
+                  f"(before: {before:.0f} MiB)")
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    main(int(args[0]) if args else 16000, int(args[1]) if len(args) > 1 else None)
@@ -0,0 +1,122 @@
+"""Seeded generators of synthetic geodata for the benchmark suite.
+
+Every generator is deterministic for a given size and seed, and writes in
+blocks so large inputs do not need to fit in memory. Files are cached in
+the given directory, so a suite run generates each input once.
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+def _cached(directory, name, write):
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        tmp = path + ".tmp"
+        write(tmp)
+        os.replace(tmp, path)
+    return path
+
+
+def points_csv(directory, n, seed=0):
+    """Writes n random points with an id, a category and a value column to a CSV file.
+
+    Args:
+        directory (str): The output directory.
+        n (int): The number of rows.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        str: The path to the CSV file.
+    """
+
+    def write(path):
+        rng = np.random.default_rng(seed)
+        categories = np.array(["forest", "water", "urban", "crop", "grass"])
+        with open(path, "w") as f:
+            f.write("id,name,longitude,latitude,category,value\n")
+            for start in range(0, n, 100000):
+                size = min(100000, n - start)
+                ids = np.arange(start, start + size)
+                lon = rng.uniform(-180, 180, size)
+                lat = rng.uniform(-85, 85, size)
+                category = categories[rng.integers(0, len(categories), size)]
+                value = rng.normal(size=size)
+                f.writelines(
+                    f"{i},p{i},{x:.6f},{y:.6f},{c},{v:.4f}\n"
+                    for i, x, y, c, v in zip(ids, lon, lat, category, value)
+                )
+
+    return _cached(directory, f"points_{n}_{seed}.csv", write)
+
+
+def polygon_features(n, seed=0, vertices=16):
+    """Returns n random star-shaped polygons with properties as GeoJSON features.
+
+    Args:
+        n (int): The number of polygons.
+        seed (int, optional): The random seed. Defaults to 0.
+        vertices (int, optional): The number of vertices of each polygon. Defaults to 16.
+
+    Returns:
+        list: The GeoJSON features.
+    """
+    rng = np.random.default_rng(seed)
+    centers = rng.uniform([-170, -75], [170, 75], size=(n, 2))
+    angles = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radii = rng.uniform(0.05, 0.5, size=(n, vertices))
+    xs = centers[:, :1] + radii * np.cos(angles)
+    ys = centers[:, 1:] + radii * np.sin(angles)
+    rings = np.round(np.stack([xs, ys], axis=-1), 6)
+    rings = np.concatenate([rings, rings[:, :1]], axis=1).tolist()
+    areas = rng.uniform(1, 1000, n).round(2).tolist()
+    return [
+        {
+            "type": "Feature",
+            "properties": {"id": i, "name": f"zone {i}", "area": areas[i]},
+            "geometry": {"type": "Polygon", "coordinates": [ring]},
+        }
+        for i, ring in enumerate(rings)
+    ]
+
+
+def polygons_geojson(directory, n, seed=0):
+    """Writes n random polygons to a GeoJSON file.
+
+    Args:
+        directory (str): The output directory.
+        n (int): The number of polygons.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        str: The path to the GeoJSON file.
+    """
+
+    def write(path):
+        with open(path, "w") as f:
+            json.dump({"type": "FeatureCollection", "features": polygon_features(n, seed)}, f)
+
+    return _cached(directory, f"polygons_{n}_{seed}.geojson", write)
+
+
+def polygons_shapefile(directory, n, seed=0):
+    """Writes n random polygons to a shapefile.
+
+    Args:
+        directory (str): The output directory.
+        n (int): The number of polygons.
+        seed (int, optional): The random seed. Defaults to 0.
+
+    Returns:
+        str: The path to the .shp file.
+    """
+    import geopandas as gpd
+
+    # A shapefile is several files, so it is written in place rather than renamed.
+    path = os.path.join(directory, f"polygons_{n}_{seed}.shp")
+    if not os.path.exists(path):
+        gdf = gpd.GeoDataFrame.from_features(polygon_features(n, seed), crs="EPSG:4326")
+        gdf.to_file(path, driver="ESRI Shapefile")
+    return path
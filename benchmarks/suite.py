@@ -0,0 +1,373 @@
+"""Benchmark suite of the Map loaders, compared against stored baselines.
+
+Each benchmark loads seeded synthetic data (see generators.py) at several
+sizes and records the best time of a few repeats, and for loaders that
+send data to the browser, the size of the widget payload. Results are
+compared with benchmarks/baselines.json: a metric more than ``tolerance``
+percent above its baseline is a regression, and fails the run.
+
+Shared and virtual machines change speed from run to run, so every run
+also times a fixed calibration workload, and timings are compared with
+their baselines scaled by the calibration ratio. A case that still looks
+slower is calibrated and run again, and only fails if the second run
+confirms it.
+
+The suite runs offline. Tiler requests go to a local stand-in, the cache
+directory is temporary, and connections to other hosts are refused.
+
+Usage:
+    python benchmarks/suite.py [--filter NAME] [--tolerance PERCENT] [--repeat N] [--save]
+
+``--save`` writes the results of the run as the new baselines. Baselines
+are machine-specific; record them on the machine that runs the comparison.
+The same checks run under pytest with ``python -m pytest benchmarks``.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generators  # noqa: E402
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines.json")
+TOLERANCE = 25.0
+REPEAT = 5
+# Short cases are repeated until their runs add up to this many seconds, as timeit.autorange does.
+MIN_TOTAL_TIME = 0.5
+MAX_REPEAT = 50
+# Timing differences below this many seconds are noise, whatever the percentage: cases of a
+# few tens of milliseconds vary by 50% or more from run to run on shared machines.
+NOISE_FLOOR = 0.02
+
+BENCHMARKS = {}
+
+
+def benchmark(name, sizes=(None,)):
+    """Registers a benchmark run once per size.
+
+    The function is called with the data directory and the size, and returns
+    a dict of metrics. A "time" metric is measured with best_time().
+    """
+
+    def register(function):
+        BENCHMARKS[name] = (function, sizes)
+        return function
+
+    return register
+
+
+def best_time(function, repeat=None):
+    """Returns the best of at least ``repeat`` wall-clock times of a call, in seconds.
+
+    Calls are repeated until they add up to MIN_TOTAL_TIME (at most
+    MAX_REPEAT calls), so short cases get more samples. As in timeit,
+    garbage collection is disabled while timing, so the collections
+    triggered by earlier allocations do not add noise.
+    """
+    import gc
+
+    times = []
+    while len(times) < (repeat or REPEAT) or (sum(times) < MIN_TOTAL_TIME and len(times) < MAX_REPEAT):
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            function()
+            times.append(time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return min(times)
+
+
+def calibrate():
+    """Returns the best time of a fixed workload, to scale the baselines to the speed of this run."""
+    import numpy as np
+
+    features = generators.polygon_features(2000)
+
+    def run():
+        data = json.loads(json.dumps(features))
+        np.sort(np.random.default_rng(0).random(1_000_000))
+        return data
+
+    return best_time(run, repeat=max(REPEAT, 5))
+
+
+def cases(pattern=None):
+    """Returns the (name, size) pairs of the registered benchmarks matching a substring."""
+    return [
+        (name, size)
+        for name, (_, sizes) in BENCHMARKS.items()
+        for size in sizes
+        if pattern is None or pattern in name
+    ]
+
+
+def case_id(name, size):
+    return name if size is None else f"{name}[{size}]"
+
+
+class OfflineEnvironment:
+    """A temporary cache directory, a stand-in tiler, and no connections to other hosts."""
+
+    def __enter__(self):
+        from thinkgreen.tileserver import TileServer
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.data_dir = os.path.join(self.tmpdir.name, "data")
+        os.makedirs(self.data_dir)
+        self.environ = {key: os.environ.get(key) for key in ("THINKGREEN_CACHE_DIR", "TITILER_ENDPOINT")}
+        os.environ["THINKGREEN_CACHE_DIR"] = os.path.join(self.tmpdir.name, "cache")
+
+        self.tiler = TileServer()
+        self.tiler.register("cog", self._cog)
+        os.environ["TITILER_ENDPOINT"] = self.tiler.url
+
+        self._connect = socket.socket.connect
+
+        def connect(sock, address):
+            host = address[0] if isinstance(address, tuple) else address
+            if sock.family in (socket.AF_INET, socket.AF_INET6) and host not in ("127.0.0.1", "::1", "localhost"):
+                raise ConnectionRefusedError(f"The benchmark suite runs offline: {host}")
+            return self._connect(sock, address)
+
+        socket.socket.connect = connect
+        return self
+
+    def _cog(self, segments, query):
+        i = int(query["url"].rsplit("/", 1)[-1].split(".")[0])
+        if segments == ["info"]:
+            body = {"bounds": [i, i, i + 1, i + 1]}
+        else:
+            body = {"tiles": [f"{self.tiler.url}/tiles/{i}/{{z}}/{{x}}/{{y}}.png"]}
+        return json.dumps(body).encode("utf-8"), "application/json"
+
+    def __exit__(self, *exc):
+        socket.socket.connect = self._connect
+        self.tiler.shutdown()
+        for key, value in self.environ.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+        self.tmpdir.cleanup()
+
+
+def _reset_metadata_cache():
+    import shutil
+
+    from thinkgreen import raster
+    from thinkgreen.cache import get_cache_dir
+
+    raster._metadata_cache = None
+    shutil.rmtree(get_cache_dir("cog"), ignore_errors=True)
+
+
+@benchmark("import")
+def bench_import(data_dir, size):
+    def run(module):
+        code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+        times = [
+            float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout)
+            for _ in range(REPEAT)
+        ]
+        return min(times)
+
+    return {"time": run("thinkgreen"), "backend_time": run("thinkgreen.thinkgreen")}
+
+
+@benchmark("add_geojson", sizes=(1000, 10000))
+def bench_add_geojson(data_dir, size):
+    from thinkgreen import thinkgreen
+    from thinkgreen.common import geojson_size
+
+    path = generators.polygons_geojson(data_dir, size)
+    layers = []
+    elapsed = best_time(lambda: layers.append(thinkgreen.Map().add_geojson(path)))
+    simplified = []
+    simplify_time = best_time(lambda: simplified.append(thinkgreen.Map(zoom=2).add_geojson(path, simplify=True)))
+    return {
+        "time": elapsed,
+        "simplify_time": simplify_time,
+        "payload_bytes": geojson_size(layers[-1].data),
+        "simplified_payload_bytes": geojson_size(simplified[-1].data),
+    }
+
+
+@benchmark("add_shp", sizes=(1000, 10000))
+def bench_add_shp(data_dir, size):
+    from thinkgreen import thinkgreen
+    from thinkgreen.common import geojson_size
+
+    path = generators.polygons_shapefile(data_dir, size)
+    layers = []
+    elapsed = best_time(lambda: layers.append(thinkgreen.Map().add_shp(path)))
+    return {"time": elapsed, "payload_bytes": geojson_size(layers[-1].data)}
+
+
+@benchmark("add_csv", sizes=(10000, 100000))
+def bench_add_csv(data_dir, size):
+    from thinkgreen import thinkgreen
+
+    path = generators.points_csv(data_dir, size)
+    out_dir = tempfile.mkdtemp(dir=data_dir)
+    results = {}
+    for out_format, name in (("geojson", "points.geojson"), ("geoparquet", "points.parquet")):
+        out_file = os.path.join(out_dir, name)
+        results[f"{out_format}_time"] = best_time(
+            lambda: thinkgreen.Map().add_csv(path, out_file, out_format, columns=["id", "category", "value"])
+        )
+    results["time"] = results.pop("geojson_time")
+    return results
+
+
+@benchmark("add_points_from_csv", sizes=(10000, 100000))
+def bench_add_points_from_csv(data_dir, size):
+    from thinkgreen import thinkgreen
+    from thinkgreen.common import geojson_size
+
+    path = generators.points_csv(data_dir, size)
+    layers = []
+    elapsed = best_time(lambda: layers.append(thinkgreen.Map().add_points_from_csv(path, label="name")))
+    return {"time": elapsed, "payload_bytes": geojson_size(layers[-1].data)}
+
+
+@benchmark("add_rasters", sizes=(20,))
+def bench_add_rasters(data_dir, size):
+    from thinkgreen import thinkgreen
+
+    urls = [f"https://example.com/{i}.tif" for i in range(size)]
+
+    def run():
+        _reset_metadata_cache()
+        thinkgreen.Map().add_rasters(urls, fit_bounds=False)
+
+    try:
+        return {"time": best_time(run)}
+    finally:
+        _reset_metadata_cache()
+
+
+def run_case(data_dir, name, size):
+    """Runs one benchmark and returns its metrics, keyed by "case.metric"."""
+    function, _ = BENCHMARKS[name]
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        metrics = function(data_dir, size)
+    return {f"{case_id(name, size)}.{metric}": value for metric, value in metrics.items()}
+
+
+def load_baselines(path=BASELINES):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(results, baselines, tolerance=TOLERANCE, scale=1.0):
+    """Compares metrics with their baselines.
+
+    Args:
+        results (dict): The metrics of a run.
+        baselines (dict): The baseline metrics.
+        tolerance (float, optional): The allowed increase in percent. Defaults to TOLERANCE.
+        scale (float, optional): The factor applied to timing baselines, see speed_scale. Defaults to 1.0.
+
+    Returns:
+        list: The (key, value, baseline, change in percent, status) rows, where
+            the status is "ok", "REGRESSION" or "new" for metrics without a baseline.
+    """
+    rows = []
+    for key, value in results.items():
+        baseline = baselines.get(key)
+        if baseline is None:
+            rows.append((key, value, None, None, "new"))
+            continue
+        if key.endswith("bytes"):
+            noise = 0
+        else:
+            baseline *= scale
+            noise = NOISE_FLOOR
+        change = (value - baseline) / baseline * 100 if baseline else 0.0
+        regressed = change > tolerance and value - baseline > noise
+        rows.append((key, value, baseline, change, "REGRESSION" if regressed else "ok"))
+    return rows
+
+
+def speed_scale(calibration, baselines):
+    """Returns the ratio of the calibration time of this run to the one of the baselines."""
+    baseline = baselines.get("calibration.time")
+    return calibration / baseline if baseline and calibration else 1.0
+
+
+def measure(data_dir, name, size, baselines, tolerance=TOLERANCE, scale=1.0):
+    """Runs a benchmark, and runs it again if it looks like a regression.
+
+    Returns:
+        tuple: The metrics, keeping the best value of each metric over the runs,
+            and the scale to compare them with.
+    """
+    results = run_case(data_dir, name, size)
+    if any(row[4] == "REGRESSION" for row in compare(results, baselines, tolerance, scale)):
+        # The speed of shared machines drifts during a run, so the confirmation is compared
+        # with the slower of the run's calibration and one taken right before it.
+        scale = max(scale, speed_scale(calibrate(), baselines))
+        again = run_case(data_dir, name, size)
+        results = {key: min(value, again[key]) for key, value in results.items()}
+    return results, scale
+
+
+def _format(key, value):
+    if value is None:
+        return "-"
+    return f"{value:,.0f} B" if key.endswith("bytes") else f"{value * 1000:,.1f} ms"
+
+
+def main(argv=None):
+    global REPEAT
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--filter", help="Only run benchmarks whose name contains this string.")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="The allowed slowdown in percent.")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="The number of timed repeats.")
+    parser.add_argument("--save", action="store_true", help="Store the results as the new baselines.")
+    args = parser.parse_args(argv)
+    REPEAT = args.repeat
+
+    baselines = load_baselines()
+    results = {"calibration.time": calibrate()}
+    scale = speed_scale(results["calibration.time"], baselines)
+    rows = []
+    with OfflineEnvironment() as env:
+        for name, size in cases(args.filter):
+            print(f"running {case_id(name, size)}...", file=sys.stderr)
+            case_results, case_scale = measure(env.data_dir, name, size, baselines, args.tolerance, scale)
+            results.update(case_results)
+            rows.extend(compare(case_results, baselines, args.tolerance, case_scale))
+
+    print(f"speed relative to the baselines: {1 / scale:.2f}x", file=sys.stderr)
+    width = max(len(row[0]) for row in rows) if rows else 0
+    print(f"{'metric':<{width}}  {'value':>14}  {'baseline':>14}  {'change':>8}  status")
+    for key, value, baseline, change, status in rows:
+        change = "-" if change is None else f"{change:+.1f}%"
+        print(f"{key:<{width}}  {_format(key, value):>14}  {_format(key, baseline):>14}  {change:>8}  {status}")
+
+    if args.save:
+        baselines.update(results)
+        with open(BASELINES, "w") as f:
+            json.dump(dict(sorted(baselines.items())), f, indent=2)
+            f.write("\n")
+        return 0
+    return 1 if any(row[4] == "REGRESSION" for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,38 @@
+"""Runs the benchmark suite under pytest, failing on regressions against the baselines.
+
+Usage:
+    python -m pytest benchmarks
+
+The suite is kept out of the default test run (see ``testpaths`` in
+setup.cfg), as its baselines are machine-specific.
+"""
+
+import pytest
+
+import suite
+
+
+@pytest.fixture(scope="module")
+def environment():
+    with suite.OfflineEnvironment() as env:
+        yield env
+
+
+@pytest.fixture(scope="module")
+def reference():
+    """The baselines, and the speed of this machine relative to them."""
+    baselines = suite.load_baselines()
+    return baselines, suite.speed_scale(suite.calibrate(), baselines)
+
+
+@pytest.mark.parametrize("name,size", suite.cases(), ids=[suite.case_id(*case) for case in suite.cases()])
+def test_benchmark(environment, reference, name, size):
+    baselines, scale = reference
+    results, scale = suite.measure(environment.data_dir, name, size, baselines, scale=scale)
+    rows = suite.compare(results, baselines, scale=scale)
+    regressions = [
+        f"{key}: {value:.4g} vs {baseline:.4g} ({change:+.1f}%)"
+        for key, value, baseline, change, status in rows
+        if status == "REGRESSION"
+    ]
+    assert not regressions, "; ".join(regressions)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""Tests for the chart rendering of `thinkgreen`."""
+
+
+import time
+import unittest
+from unittest import mock
+
+import ipyleaflet
+
+from thinkgreen import charts, thinkgreen
+
+
+class TestCharts(unittest.TestCase):
+    """Tests for `thinkgreen.charts`."""
+
+    def setUp(self):
+        charts.clear_cache()
+
+    def test_000_render_chart(self):
+        """Charts render to image bytes without creating pyplot figures."""
+        import matplotlib.pyplot as plt
+
+        before = plt.get_fignums()
+        png = charts.render_chart("plot", [1, 2, 3], [3, 1, 2])
+        svg = charts.render_chart("pie", [1, 2, 3], fmt="svg")
+        self.assertTrue(png.startswith(b"\x89PNG"))
+        self.assertIn(b"<svg", svg)
+        self.assertEqual(plt.get_fignums(), before)
+
+        with self.assertRaises(ValueError):
+            charts.render_chart("bar", [1, 2, 3])
+        with self.assertRaises(ValueError):
+            charts.render_chart("scatter", [1, 2, 3], [1, 2, 3])
+
+    def test_001_chart_cache(self):
+        """Renders are cached by a hash of the data and options."""
+        self.assertEqual(charts.chart_key("bar", [1, 2], [3, 4]), charts.chart_key("bar", (1, 2), (3, 4)))
+        self.assertNotEqual(charts.chart_key("bar", [1, 2], [3, 4]), charts.chart_key("bar", [1, 2], [3, 5]))
+        self.assertNotEqual(
+            charts.chart_key("bar", [1, 2], [3, 4]), charts.chart_key("bar", [1, 2], [3, 4], title="A")
+        )
+
+        with mock.patch.object(charts, "render_chart", wraps=charts.render_chart) as render:
+            first = charts.get_chart("bar", [1, 2], [3, 4])
+            second = charts.get_chart("bar", [1, 2], [3, 4])
+        self.assertEqual(first, second)
+        self.assertEqual(render.call_count, 1)
+
+    def test_002_downsample(self):
+        """Long series are reduced to a size set by the output, not the input."""
+        import numpy as np
+
+        x = np.arange(10.0)
+        y = np.array([0, 1, 0, 9, 0, 1, 0, 1, 0, 1.0])
+        self.assertEqual(charts.lttb_indices(x, y, 4).tolist(), [0, 3, 5, 9])
+        self.assertEqual(charts.minmax_indices(y, 2).tolist(), [0, 3, 5, 6, 9])
+        bx, by = charts.bin_aggregate(x, y, 2, agg="sum")
+        self.assertEqual(bx.tolist(), [2.0, 7.0])
+        self.assertEqual(by.tolist(), [10.0, 3.0])
+
+        rng = np.random.default_rng(0)
+        for n in (10000, 100000):
+            x = np.arange(n, dtype="float64")
+            y = rng.normal(size=n)
+            y[n // 3] = 100
+            for method in ("lttb", "minmax", "mean"):
+                xs, ys = charts.downsample_series(x, y, 200, method=method)
+                self.assertLessEqual(len(xs), 200)
+                self.assertEqual(len(xs), len(ys))
+            xs, ys = charts.downsample_series(x, y, 200, method="minmax")
+            self.assertEqual(ys.max(), 100)
+            self.assertEqual((xs[0], xs[-1]), (0, n - 1))
+
+        with mock.patch.object(charts, "downsample_series", wraps=charts.downsample_series) as reduce:
+            charts.render_chart("plot", x, y, max_points=500)
+            charts.render_chart("plot", x[:100], y[:100], max_points=500)
+        self.assertEqual(reduce.call_count, 1)
+        self.assertEqual(reduce.call_args.args[2], 500)
+
+    def test_003_map_charts(self):
+        """Charts are embedded in widget controls and the dropdown swaps cached renders."""
+        m = thinkgreen.Map()
+        control = m.add_bar([1, 2, 3], [4, 5, 6], position="topright")
+        self.assertIn(control, m.controls)
+        charts.get_chart("bar", [1, 2, 3], [4, 5, 6])
+        for _ in range(100):
+            if control.widget.value:
+                break
+            time.sleep(0.01)
+        self.assertTrue(bytes(control.widget.value).startswith(b"\x89PNG"))
+
+        with mock.patch.object(charts, "render_chart", wraps=charts.render_chart) as render:
+            chart_ctrl = m.add_chart(x=[1, 2, 3], y=[2, 4, 1])
+            expected = {
+                "PLOT": charts.get_chart("plot", [1, 2, 3], [2, 4, 1]),
+                "BAR": charts.get_chart("bar", [1, 2, 3], [2, 4, 1]),
+                "PIE": charts.get_chart("pie", [2, 4, 1]),
+            }
+            self.assertEqual(render.call_count, 3)
+
+            dropdown, image = chart_ctrl.widget.children
+            for option in ["PIE", "PLOT", "BAR", "PIE"]:
+                dropdown.value = option
+                self.assertEqual(bytes(image.value), expected[option])
+            self.assertEqual(render.call_count, 3)
+        self.assertIsInstance(chart_ctrl, ipyleaflet.WidgetControl)
+
+    def test_004_chart_errors(self):
+        """Invalid charts raise before a control is added, and render errors are logged."""
+        m = thinkgreen.Map()
+        controls = len(m.controls)
+        with self.assertRaises(ValueError):
+            m.add_plot([1, 2, 3], [1, 2])
+        with self.assertRaises(ValueError):
+            m.add_bar([1, 2, 3], None)
+        with self.assertRaises(ValueError):
+            m.add_plot([1, 2], [1, 2], fmt="gif")
+        self.assertEqual(len(m.controls), controls)
+
+        with mock.patch.object(charts, "render_chart", side_effect=RuntimeError("boom")):
+            with self.assertLogs("thinkgreen.thinkgreen", level="ERROR") as logs:
+                control = m.add_plot([1, 2, 3], [3, 2, 1])
+                charts._get_executor().submit(lambda: None).result()
+        self.assertIn("boom", logs.output[0])
+        self.assertFalse(control.widget.value)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+
+"""Tests for the folium backend of `thinkgreen`."""
+
+
+import base64
+import io
+import os
+import re
+import tempfile
+import unittest
+
+import numpy as np
+
+from thinkgreen import foliumap
+
+
+def embedded_points(html):
+    """Returns the points embedded in the first fast point layer of a page."""
+    data = re.search(r'atob\("([A-Za-z0-9+/=]*)"\)', html).group(1)
+    return np.frombuffer(base64.b64decode(data), dtype="<f4").reshape(-1, 2)
+
+
+class TestFoliumap(unittest.TestCase):
+    """Tests for `thinkgreen.foliumap`."""
+
+    def test_000_add_points(self):
+        """Points are embedded as one Float32 array sorted by longitude."""
+        m = foliumap.Map()
+        layer = m.add_points([30, -10, 20, np.nan], [1, 2, 3, 4], labels=["a", "b", "c", "d"])
+        self.assertEqual(layer.labels, ["b", "c", "a"])
+
+        out = io.BytesIO()
+        m.save(out, close_file=False, chunk_size=4)
+        html = out.getvalue().decode("utf-8")
+        self.assertEqual(embedded_points(html).tolist(), [[-10, 2], [20, 3], [30, 1]])
+        self.assertNotIn("__thinkgreen_", html)
+        self.assertIsNone(layer._placeholder)
+
+        with self.assertRaises(ValueError):
+            m.add_points([1, 2], [1])
+        with self.assertRaises(ValueError):
+            m.add_points([1], [1], mode="heatmap")
+
+    def test_001_add_points_from_csv(self):
+        """CSV points are read in chunks and saved to disk."""
+        with tempfile.TemporaryDirectory() as tmp:
+            in_csv = os.path.join(tmp, "points.csv")
+            with open(in_csv, "w") as f:
+                f.write("name,longitude,latitude\n")
+                for i in range(25):
+                    f.write(f"p{i},{i - 12},{i / 2}\n")
+                f.write("bad,,\n")
+
+            m = foliumap.Map()
+            layer = m.add_points_from_csv(in_csv, label="name", chunksize=7, mode="cluster")
+            self.assertEqual(len(layer.labels), 25)
+
+            out_html = os.path.join(tmp, "map.html")
+            m.save(out_html)
+            with open(out_html) as f:
+                html = f.read()
+        self.assertEqual(len(embedded_points(html)), 25)
+        self.assertIn("leaflet.markercluster", html)
+        self.assertIn("L.markerClusterGroup", html)
+
+    def test_002_set_layers(self):
+        """Layers are kept across calls and the page is only rendered again when they change."""
+        import folium
+
+        built = []
+
+        def tiles(name):
+            def build():
+                built.append(name)
+                return folium.TileLayer(tiles=f"https://{name}/{{z}}/{{x}}/{{y}}.png", name=name, attr=name)
+
+            return build
+
+        m = foliumap.Map()
+        m.set_layers({"a": tiles("a.example"), "b": tiles("b.example")})
+        html = m.to_html()
+        self.assertIn("a.example", html)
+        self.assertIn("b.example", html)
+
+        layers = m.set_layers({"a": tiles("a.example"), "b": tiles("b.example")})
+        self.assertEqual(built, ["a.example", "b.example"])
+        self.assertIs(m.to_html(), html)
+
+        m.set_layers({"b": layers["b"], "c": tiles("c.example")})
+        self.assertEqual(built, ["a.example", "b.example", "c.example"])
+        html = m.to_html()
+        self.assertNotIn("a.example", html)
+        self.assertIn("b.example", html)
+        self.assertIn("c.example", html)
+        self.assertEqual(html.count("b.example/"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
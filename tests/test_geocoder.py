@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+"""Tests for the offline geocoder of `thinkgreen`."""
+
+
+import json
+import os
+import tempfile
+import unittest
+
+from thinkgreen import geocoder, thinkgreen
+
+
+class TestGeocoder(unittest.TestCase):
+    """Tests for `thinkgreen.geocoder`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.csv = os.path.join(self.tmpdir.name, "places.csv")
+        rows = [
+            ("New York", "US", 8000000, -74.0, 40.7),
+            ("Newark", "US", 300000, -74.2, 40.7),
+            ("York", "GB", 200000, -1.1, 54.0),
+            ("São Paulo", "BR", 12000000, -46.6, -23.6),
+            ("Saint-Étienne", "FR", 170000, 4.4, 45.4),
+            ("London", "GB", 9000000, -0.1, 51.5),
+            ("Londonderry", "", 80000, -7.3, 55.0),
+            ("New Orleans", "US", 400000, -90.1, 30.0),
+            ("", "US", 1, 0, 0),
+        ]
+        with open(self.csv, "w", encoding="utf-8") as f:
+            f.write("name,country,population,longitude,latitude\n")
+            for row in rows:
+                f.write(",".join(str(value) for value in row) + "\n")
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.tmpdir.cleanup()
+
+    def test_000_normalize(self):
+        """Names match regardless of case, accents and punctuation."""
+        self.assertEqual(geocoder.normalize("  Saint-Étienne (Loire) "), "saint etienne loire")
+        self.assertEqual(geocoder.normalize("SÃO PAULO"), "sao paulo")
+
+    def test_001_search(self):
+        """Prefixes of any word match, ranked by importance, with a fuzzy fallback for typos."""
+        path = os.path.join(self.tmpdir.name, "places.gaz")
+        with geocoder.build_gazetteer(self.csv, path, importance="population", details=["country"]) as gazetteer:
+            self.assertEqual(len(gazetteer), 8)
+            names = lambda query, **kwargs: [p["display_name"] for p in gazetteer.search(query, **kwargs)]
+            self.assertEqual(names("new"), ["New York, US", "New Orleans, US", "Newark, US"])
+            self.assertEqual(names("new", limit=1), ["New York, US"])
+            self.assertEqual(names("YORK"), ["New York, US", "York, GB"])
+            self.assertEqual(names("sao p"), ["São Paulo, BR"])
+            self.assertEqual(names("saint et"), ["Saint-Étienne, FR"])
+            self.assertEqual(names("Londonderry"), ["Londonderry"])
+            self.assertEqual(names("lndon"), ["London, GB", "Londonderry"])
+            self.assertEqual(names("lndon", fuzzy=False), [])
+            self.assertEqual(names("zzz"), [])
+            self.assertEqual(names(" - "), [])
+
+            place = gazetteer.search("london")[0]
+            self.assertEqual((float(place["lat"]), float(place["lon"])), (51.5, -0.1))
+
+        with self.assertRaises(ValueError):
+            geocoder.Gazetteer(self.csv)
+
+    def test_002_top_places(self):
+        """Short prefixes matching many names list the most important places."""
+        import pandas as pd
+
+        n = geocoder.LARGE_RANGE + 100
+        df = pd.DataFrame(
+            {
+                "name": [f"Place {i}" for i in range(n)],
+                "rank": list(range(n)),
+                "longitude": 0.0,
+                "latitude": 0.0,
+            }
+        )
+        path = os.path.join(self.tmpdir.name, "many.gaz")
+        with geocoder.build_gazetteer(df, path, importance="rank") as gazetteer:
+            expected = [f"Place {i}" for i in range(n - 1, n - 6, -1)]
+            for query in ("p", "pla", "place", "place "):
+                self.assertEqual([p["display_name"] for p in gazetteer.search(query, limit=5)], expected)
+
+            # Large limits rank every match rather than only the precomputed top places.
+            for limit in (100, n):
+                names = [p["display_name"] for p in gazetteer.search("place", limit=limit)]
+                self.assertEqual(names, [f"Place {i}" for i in range(n - 1, n - 1 - limit, -1)])
+
+    def test_003_search_control(self):
+        """The search control queries the gazetteer through the local server, as Nominatim."""
+        from thinkgreen.common import get_client
+
+        path = os.path.join(self.tmpdir.name, "places.gaz")
+        geocoder.build_gazetteer(self.csv, path, importance="population").close()
+
+        m = thinkgreen.Map()
+        control = m.add_search_control(gazetteer=path)
+        self.assertIn(control, m.controls)
+        self.assertTrue(control.url.startswith("http://127.0.0.1:"))
+
+        url = control.url.replace("{s}", "lon")
+        results = get_client().get(url).json()
+        self.assertEqual([p["display_name"] for p in results], ["London", "Londonderry"])
+        response = get_client().get(url + "&json_callback=L.Control.Search.callJsonp&limit=1")
+        self.assertTrue(response.text.startswith("L.Control.Search.callJsonp(["))
+        self.assertEqual(len(json.loads(response.text[len("L.Control.Search.callJsonp(") : -2])), 1)
+        self.assertEqual(get_client().get(url + "&json_callback=alert(1)").headers["content-type"], "application/json")
+
+
+if __name__ == "__main__":
+    unittest.main()
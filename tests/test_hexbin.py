@@ -0,0 +1,163 @@
+#!/usr/bin/env python
+
+"""Tests for the hexbin aggregation of `thinkgreen`."""
+
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from thinkgreen import hexbin, thinkgreen
+
+
+def brute_force(pyramid, zoom, lon, lat, values, bounds):
+    """Bins all the points at once and keeps the cells centered in bounds, by (q, r)."""
+    x, y = hexbin.lnglat_to_mercator(lon, lat)
+    q, r = pyramid._cells(zoom, x, y)
+    cells = hexbin._reduce(q, r, None, values, values, values)
+    cx, cy = pyramid.centers(zoom, cells[0], cells[1])
+    (south, west), (north, east) = bounds
+    lons, lats = hexbin.mercator_to_lnglat(cx, cy)
+    inside = (lons >= west) & (lons <= east) & (lats >= south) & (lats <= north)
+    return {(a, b): (c, d, e, f) for a, b, c, d, e, f in zip(*(part[inside] for part in cells))}
+
+
+class TestHexbin(unittest.TestCase):
+    """Tests for `thinkgreen.hexbin`."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        rng = np.random.default_rng(0)
+        self.lon = rng.normal(-74, 0.2, 50000)
+        self.lat = rng.normal(40.7, 0.2, 50000)
+        self.values = rng.random(50000)
+
+    def test_000_cells(self):
+        """Points fall in the cell with the nearest center."""
+        pyramid = hexbin.BinPyramid(self.lon[:10], self.lat[:10])
+        x, y = hexbin.lnglat_to_mercator(self.lon, self.lat)
+        for kind, radius in (("hex", 1 / np.sqrt(3)), ("square", np.sqrt(0.5))):
+            pyramid.kind = kind
+            q, r = pyramid._cells(10, x, y)
+            cx, cy = pyramid.centers(10, q, r)
+            self.assertLessEqual(np.hypot(x - cx, y - cy).max(), pyramid.cell_meters(10) * radius + 1e-6)
+            rings = pyramid.polygons(10, q[:5], r[:5])
+            self.assertEqual(rings.shape, (5, 7 if kind == "hex" else 5, 2))
+
+    def test_001_pyramid(self):
+        """Cells in view match binning all the points, at precomputed and per-tile levels."""
+        for agg in ("count", "mean", "min", "max"):
+            pyramid = hexbin.BinPyramid(self.lon, self.lat, self.values, agg=agg, pyramid_zoom=9)
+            self.assertEqual(sorted(pyramid.levels), list(range(10)))
+            for zoom in (9, 12, 17):
+                bounds = hexbin.view_bounds((40.75, -73.95), zoom)
+                cells = pyramid.cells(zoom, bounds)
+                expected = brute_force(pyramid, zoom, self.lon, self.lat, self.values, bounds)
+                self.assertGreater(len(expected), 0)
+                self.assertEqual(set(zip(cells[0].tolist(), cells[1].tolist())), set(expected))
+                result = dict(zip(zip(cells[0].tolist(), cells[1].tolist()), pyramid.aggregate(cells)))
+                for key, (count, total, low, high) in expected.items():
+                    want = {"count": count, "mean": total / count, "min": low, "max": high}[agg]
+                    self.assertAlmostEqual(result[key], want)
+        self.assertLessEqual(len(pyramid._tiles), pyramid.max_tiles)
+
+        with self.assertRaises(ValueError):
+            hexbin.BinPyramid(self.lon, self.lat, agg="mean")
+        with self.assertRaises(ValueError):
+            hexbin.BinPyramid(self.lon, self.lat, kind="triangle")
+
+    def test_002_payload(self):
+        """The number of cells in view depends on the view, not on the number of points."""
+        rng = np.random.default_rng(1)
+        bounds = hexbin.view_bounds((40.7, -74), 11)
+        sizes = []
+        for n in (20000, 200000):
+            pyramid = hexbin.BinPyramid(rng.normal(-74, 0.2, n), rng.normal(40.7, 0.2, n))
+            sizes.append(len(pyramid.cells(11, bounds)[0]))
+        self.assertLess(sizes[1], 1024 * 512 / 24**2 * 1.5)
+        self.assertLess(sizes[1], sizes[0] * 1.5)
+
+    def test_003_add_hexbin(self):
+        """The layer shows the cells in view and follows the map view."""
+        import time
+
+        import pandas as pd
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "points.csv")
+            df = pd.DataFrame({"longitude": self.lon, "latitude": self.lat, "price": self.values})
+            df.to_csv(path, index=False)
+
+            m = thinkgreen.Map(center=[40.7, -74], zoom=7)
+            layer = m.add_hexbin(path, value="price", agg="mean", name="Prices")
+        self.assertIn(layer, m.layers)
+        self.assertEqual(layer.name, "Prices")
+        features = layer.data["features"]
+        self.assertGreater(len(features), 0)
+        self.assertEqual(features[0]["geometry"]["type"], "Polygon")
+        self.assertTrue(features[0]["properties"]["style"]["fillColor"].startswith("#"))
+        self.assertEqual(sum(f["properties"]["count"] for f in features), len(df))
+        self.assertIn("mean of price", m.controls[-1].widget.value)
+
+        # The cells of the new view are binned off the kernel thread.
+        m.zoom = 12
+        m.set_trait("bounds", ((40.7, -74.05), (40.75, -73.95)))
+        for _ in range(100):
+            if layer.data["features"] is not features:
+                break
+            time.sleep(0.05)
+        zoomed = layer.data["features"]
+        self.assertGreater(len(zoomed), 0)
+        self.assertLess(sum(f["properties"]["count"] for f in zoomed), len(df))
+
+        count = m.add_hexbin(df, kind="square", legend=False)
+        self.assertEqual(len(count.data["features"][0]["geometry"]["coordinates"][0]), 5)
+
+    def test_004_remove_hexbin(self):
+        """Removing the layer stops following the map view and removes its legend."""
+        import time
+        from unittest import mock
+
+        import pandas as pd
+
+        df = pd.DataFrame({"longitude": self.lon, "latitude": self.lat})
+        m = thinkgreen.Map(center=[40.7, -74], zoom=7)
+        observers = len(m._trait_notifiers["bounds"]["change"])
+        controls = len(m.controls)
+        layer = m.add_hexbin(df)
+        self.assertEqual(len(m.controls), controls + 1)
+        self.assertEqual(len(m._trait_notifiers["bounds"]["change"]), observers + 1)
+
+        m.remove(layer)
+        self.assertEqual(len(m.controls), controls)
+        self.assertEqual(len(m._trait_notifiers["bounds"]["change"]), observers)
+        self.assertEqual(m._cleanups, {})
+
+        # Pans return at once, and a burst of them bins at most one more view.
+        to_geojson = hexbin.to_geojson
+
+        def slow(*args, **kwargs):
+            time.sleep(0.1)
+            return to_geojson(*args, **kwargs)
+
+        with mock.patch.object(hexbin, "to_geojson", side_effect=slow) as render:
+            layer = m.add_hexbin(df)
+            start = time.perf_counter()
+            for west in (-74.4, -74.3, -74.2, -74.1, -74.0):
+                m.set_trait("bounds", ((40.5, west), (40.9, west + 0.5)))
+            self.assertLess(time.perf_counter() - start, 0.1)
+            for _ in range(100):
+                if render.call_count >= 2:
+                    break
+                time.sleep(0.05)
+            time.sleep(0.3)
+        self.assertLessEqual(render.call_count, 3)
+        m.clear()
+        self.assertEqual(len(m._trait_notifiers["bounds"]["change"]), observers)
+        self.assertEqual(m._cleanups, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""Tests for the map construction profiler of `thinkgreen`."""
+
+
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from thinkgreen import profiler, thinkgreen
+
+
+def squares(n):
+    """Returns a FeatureCollection of n unit squares along the x axis."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {"name": f"sq{i}"},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[i, 0], [i + 0.5, 0], [i + 0.5, 0.5], [i, 0.5], [i, 0]]],
+                },
+            }
+            for i in range(n)
+        ],
+    }
+
+
+class TestProfiler(unittest.TestCase):
+    """Tests for `thinkgreen.profiler`."""
+
+    def test_000_profile(self):
+        """Calls, nested calls, memory and widget bytes are recorded while profiling."""
+        import geopandas as gpd
+
+        m = thinkgreen.Map()
+        gdf = gpd.GeoDataFrame.from_features(squares(50)["features"], crs="EPSG:4326")
+        with m.profile() as p:
+            m.add_geojson(squares(100), name="A")
+            m.add_gdf(gdf, name="B")
+            with self.assertRaises(ValueError):
+                m.add_basemap("No.Such.Basemap")
+        m.add_geojson(squares(5), name="C")
+
+        report = p.report()
+        self.assertEqual(report["call"].tolist(), ["add_geojson", "add_gdf", "add_geojson", "add_basemap"])
+        self.assertEqual(report["depth"].tolist(), [0, 0, 1, 0])
+        self.assertEqual(report["target"].tolist()[:2], ["dict", "GeoDataFrame"])
+        self.assertEqual(report["layers"].tolist()[:2], [2, 3])
+        self.assertEqual(report["error"].tolist()[3], "ValueError")
+        self.assertTrue((report["time"] > 0).all())
+        self.assertGreater(report["peak_memory"][0], 0)
+        self.assertGreater(report["comm_bytes"][0], len(json.dumps(squares(100), separators=(",", ":"))))
+        self.assertGreaterEqual(report["comm_bytes"][1], report["comm_bytes"][2])
+        self.assertEqual(p.report(nested=False)["call"].tolist(), ["add_geojson", "add_gdf", "add_basemap"])
+
+        layers = p.layer_report().set_index("name")
+        self.assertGreater(layers.loc["A", "comm_bytes"], 0)
+        self.assertEqual(layers.loc["C", "comm_bytes"], 0)
+
+        self.assertNotIn("add_geojson", vars(m))
+        self.assertEqual(len(p.records), 4)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "profile.json")
+            p.to_json(path)
+            with open(path) as f:
+                result = json.load(f)
+        self.assertEqual(len(result["calls"]), 4)
+        self.assertEqual(result["total_comm_bytes"], p.total_bytes)
+
+    def test_001_no_peak_memory(self):
+        """Without tracemalloc.reset_peak (Python < 3.9), calls are profiled without peak memory."""
+        m = thinkgreen.Map()
+        with mock.patch.object(profiler, "_can_trace_peak", return_value=False):
+            with m.profile() as p:
+                m.add_geojson(squares(10), name="A")
+        report = p.report()
+        self.assertEqual(report["call"].tolist(), ["add_geojson"])
+        self.assertIsNone(p.records[0]["peak_memory"])
+        self.assertGreater(report["comm_bytes"][0], 0)
+
+    def test_002_environment(self):
+        """The THINKGREEN_PROFILE environment variable profiles new maps, and profilers do not nest."""
+        with mock.patch.dict(os.environ, {"THINKGREEN_PROFILE": "1"}):
+            m = thinkgreen.Map()
+        try:
+            self.assertTrue(m.profiler.running)
+            self.assertEqual(m.profiler.report(nested=False)["call"].tolist(), ["add_fullscreen_control"])
+            self.assertGreater(m.profiler.layer_report()["comm_bytes"][0], 0)
+            with self.assertRaises(ValueError):
+                m.profile().start()
+        finally:
+            m.profiler.stop()
+        self.assertEqual(profiler._active, [])
+        self.assertIsNone(thinkgreen.Map().profiler)
+
+
+if __name__ == "__main__":
+    unittest.main()
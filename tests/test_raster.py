@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+"""Tests for the raster functions of `thinkgreen`."""
+
+
+import json
+import os
+import tempfile
+import unittest
+
+from thinkgreen import raster, thinkgreen
+from thinkgreen.tileserver import TileServer
+
+
+class TestRaster(unittest.TestCase):
+    """Tests for `thinkgreen.raster`."""
+
+    def setUp(self):
+        """Start a local stand-in for titiler."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        os.environ["THINKGREEN_CACHE_DIR"] = self.tmpdir.name
+        raster._metadata_cache = None
+
+        self.requests = []
+        self.tiler = TileServer()
+
+        def cog(segments, query):
+            self.requests.append((segments[0], query["url"]))
+            i = int(query["url"].rsplit("/", 1)[-1].split(".")[0])
+            if segments == ["info"]:
+                body = {"bounds": [i, i, i + 1, i + 1]}
+            else:
+                body = {"tiles": [f"{self.tiler.url}/tiles/{i}/{{z}}/{{x}}/{{y}}.png"]}
+            return json.dumps(body).encode("utf-8"), "application/json"
+
+        self.tiler.register("cog", cog)
+
+    def tearDown(self):
+        """Stop the stand-in tiler."""
+        self.tiler.shutdown()
+        del os.environ["THINKGREEN_CACHE_DIR"]
+        raster._metadata_cache = None
+        self.tmpdir.cleanup()
+
+    def test_000_add_rasters(self):
+        """Raster metadata is fetched in parallel and cached."""
+        urls = [f"https://example.com/{i}.tif" for i in range(20)]
+        m = thinkgreen.Map()
+        layers = m.add_rasters(urls, fit_bounds=False, titiler_endpoint=self.tiler.url)
+        self.assertEqual(len(m.layers), 21)
+        self.assertEqual(list(m.layers[1:]), layers)
+        self.assertEqual(m.layers[-1].url, f"{self.tiler.url}/tiles/19/{{z}}/{{x}}/{{y}}.png")
+        self.assertEqual(len(self.requests), 40)
+
+        layer = m.add_raster(urls[3], fit_bounds=False, titiler_endpoint=self.tiler.url)
+        self.assertIs(layer, m.layers[-1])
+        self.assertEqual(len(self.requests), 40)
+
+        # A fresh process only has the disk cache.
+        raster._metadata_cache = None
+        meta = raster.cog_metadata(urls[5], titiler_endpoint=self.tiler.url)
+        self.assertEqual(meta["bounds"], [5, 5, 6, 6])
+        self.assertEqual(len(self.requests), 40)
+
+    def test_001_add_local_raster(self):
+        """Local GeoTIFF tiles are rendered in-process, cached and prefetched."""
+        import io
+        import time
+        import urllib.request
+
+        import numpy as np
+        import rasterio
+        from PIL import Image
+        from rasterio.transform import from_bounds
+
+        from thinkgreen.tileserver import lnglat_to_tile
+
+        path = os.path.join(self.tmpdir.name, "dem.tif")
+        data = np.arange(200 * 200, dtype="float32").reshape(200, 200)
+        data[:20, :20] = -9999
+        with rasterio.open(
+            path, "w", driver="GTiff", width=200, height=200, count=1, dtype="float32",
+            crs="EPSG:4326", transform=from_bounds(-85, 35, -83, 37, 200, 200), nodata=-9999,
+        ) as dst:
+            dst.write(data, 1)
+
+        m = thinkgreen.Map()
+        layer = m.add_raster(path, colormap="terrain", fit_bounds=False)
+        renderer = layer.tile_renderer
+        self.assertEqual([round(b) for b in renderer.bounds], [-85, 35, -83, 37])
+
+        x, y = lnglat_to_tile(-84, 36, 8)
+        with urllib.request.urlopen(layer.url.format(z=8, x=x, y=y)) as r:
+            image = np.asarray(Image.open(io.BytesIO(r.read())))
+        self.assertEqual(image.shape, (256, 256, 4))
+        self.assertTrue((image[..., 3] == 255).any())
+
+        # Neighbours are rendered in the background.
+        for _ in range(50):
+            if len(renderer.cache) == 9:
+                break
+            time.sleep(0.1)
+        self.assertEqual(len(renderer.cache), 9)
+
+        x, y = lnglat_to_tile(10, 10, 8)
+        image = np.asarray(Image.open(io.BytesIO(renderer.tile(8, x, y))))
+        self.assertFalse(image[..., 3].any())
+
+    def test_002_zonal_stats(self):
+        """Zonal statistics match a full read, in this process and across a process pool."""
+        import geopandas as gpd
+        import numpy as np
+        import rasterio
+        import shapely
+        from rasterio.features import geometry_mask
+        from rasterio.transform import from_bounds
+
+        path = os.path.join(self.tmpdir.name, "zones.tif")
+        data = np.arange(160 * 160, dtype="float32").reshape(160, 160) % 997
+        data[:10, :] = -9999
+        transform = from_bounds(-85, 35, -83, 37, 160, 160)
+        with rasterio.open(
+            path, "w", driver="GTiff", width=160, height=160, count=1, dtype="float32",
+            crs="EPSG:4326", transform=transform, nodata=-9999, tiled=True, blockxsize=32, blockysize=32,
+        ) as dst:
+            dst.write(data, 1)
+
+        polygons = [
+            shapely.box(-84.9, 35.1, -84.2, 36.95),
+            shapely.Point(-83.5, 35.5).buffer(0.3),
+            shapely.MultiPolygon([shapely.box(-84.9, 35.1, -84.8, 35.2), shapely.box(-83.2, 36.8, -83.1, 36.9)]),
+            shapely.box(10, 10, 11, 11),
+        ]
+        expected = []
+        for polygon in polygons:
+            inside = geometry_mask([polygon], data.shape, transform, invert=True)
+            expected.append(data[inside & (data != -9999)])
+
+        serial = raster.zonal_stats(path, polygons, bins=5, hist_range=(0, 1000), processes=1)
+        pooled = raster.zonal_stats(path, polygons, bins=5, hist_range=(0, 1000), processes=2, max_pixels=32 * 32)
+        self.assertEqual(serial, pooled)
+        for stats, values in zip(serial[:3], expected):
+            self.assertEqual(stats["count"], values.size)
+            self.assertAlmostEqual(stats["mean"], values.mean(), places=3)
+            self.assertEqual(stats["min"], values.min())
+            self.assertEqual(stats["max"], values.max())
+            self.assertEqual(stats["histogram"], np.histogram(values, bins=5, range=(0, 1000))[0].tolist())
+        self.assertEqual(serial[3]["count"], 0)
+        self.assertIsNone(serial[3]["mean"])
+
+        # Block-aligned windows of at most max_pixels, skipping the gap between parts.
+        with rasterio.open(path) as ds:
+            windows = list(raster._block_windows(ds, 1, polygons[2], 32 * 32))
+        self.assertEqual(len(windows), 2)
+        for window in windows:
+            self.assertEqual((window.col_off % 32, window.row_off % 32), (0, 0))
+            self.assertLessEqual(window.width * window.height, 32 * 32)
+
+        m = thinkgreen.Map()
+        m.add_gdf(gpd.GeoDataFrame({"zone": ["a", "b"]}, geometry=polygons[:2], crs="EPSG:4326"), name="Zones")
+        gdf = m.zonal_stats(path, "Zones", bins=5, hist_range=(0, 1000), processes=1)
+        self.assertEqual(gdf["zone"].tolist(), ["a", "b"])
+        self.assertEqual(gdf["count"].tolist(), [serial[0]["count"], serial[1]["count"]])
+
+        draw_control = m.add_draw_control()
+        draw_control.data = [
+            {
+                "type": "Feature",
+                "properties": {"style": {"radius": 0.3 * 111320}},
+                "geometry": {"type": "Point", "coordinates": [-83.5, 35.5]},
+            }
+        ]
+        gdf = m.zonal_stats(path, bins=5, processes=1)
+        self.assertGreater(gdf["count"][0], 0)
+        self.assertEqual(len(gdf.attrs["bin_edges"]), 6)
+
+    def test_003_prefetch_priority(self):
+        """Requested tiles are rendered before the neighbours queued for prefetching."""
+        import time
+
+        import numpy as np
+        import rasterio
+        from rasterio.transform import from_bounds
+
+        path = os.path.join(self.tmpdir.name, "small.tif")
+        with rasterio.open(
+            path, "w", driver="GTiff", width=64, height=64, count=1, dtype="float32",
+            crs="EPSG:4326", transform=from_bounds(-85, 35, -83, 37, 64, 64),
+        ) as dst:
+            dst.write(np.ones((64, 64), dtype="float32"), 1)
+
+        renderer = raster.LocalTileRenderer(path, vmin=0, vmax=2, max_workers=1)
+        rendered = []
+
+        def render(z, x, y):
+            rendered.append((z, x, y))
+            time.sleep(0.05)
+            return b"tile"
+
+        renderer.render = render
+        try:
+            renderer.tile(8, 10, 10)
+            time.sleep(0.01)
+            renderer.tile(8, 100, 100)
+            # At most the neighbour being rendered went ahead of the second request.
+            self.assertLessEqual(rendered.index((8, 100, 100)), 2)
+
+            # Prefetching resumes once no request is waiting.
+            for _ in range(100):
+                if len(renderer.cache) == 18:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(len(renderer.cache), 18)
+
+            renderer._requested = 1
+            renderer._queue_prefetch([(9, x, 0) for x in range(200)])
+            self.assertEqual(len(renderer._prefetch_keys), renderer.prefetch_queue_size)
+            time.sleep(0.1)
+            self.assertNotIn((9, 199, 0), renderer.cache)
+            self.assertFalse(renderer._prefetching)
+        finally:
+            renderer.close()
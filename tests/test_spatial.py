@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+
+"""Tests for the spatial indexes of `thinkgreen`."""
+
+
+import unittest
+from unittest import mock
+
+from thinkgreen import spatial, thinkgreen
+
+
+def squares(n, name="sq"):
+    """Returns a FeatureCollection of n unit squares along the x axis."""
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {"name": f"{name}{i}"},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[i, 0], [i + 0.5, 0], [i + 0.5, 0.5], [i, 0.5], [i, 0]]],
+                },
+            }
+            for i in range(n)
+        ],
+    }
+
+
+class TestSpatial(unittest.TestCase):
+    """Tests for `thinkgreen.spatial`."""
+
+    def test_000_feature_bounds(self):
+        """Bounds are reduced from all coordinates, and are NaN for empty geometries."""
+        features = squares(2)["features"] + [
+            {"type": "Feature", "properties": {}, "geometry": None},
+            {"type": "Feature", "properties": {}, "geometry": {"type": "Point", "coordinates": [3, 4]}},
+        ]
+        bounds = spatial.feature_bounds(features)
+        self.assertEqual(bounds[0].tolist(), [0, 0, 0.5, 0.5])
+        self.assertEqual(bounds[1].tolist(), [1, 0, 1.5, 0.5])
+        self.assertTrue(all(value != value for value in bounds[2]))
+        self.assertEqual(bounds[3].tolist(), [3, 4, 3, 4])
+
+    def test_001_query(self):
+        """Queries are exact, and the index is built lazily and dropped with new data."""
+        import geopandas as gpd
+        import shapely
+
+        data = squares(10)
+        data["features"].append({"type": "Feature", "properties": {}, "geometry": None})
+        index = spatial.SpatialIndex(data)
+        self.assertFalse(index.built)
+        self.assertEqual(index.query((2.25, 0.25)).tolist(), [2])
+        self.assertTrue(index.built)
+        self.assertEqual(index.query((2.75, 0.25)).tolist(), [])
+        self.assertEqual(index.query((1.2, 0.1, 3.2, 0.2)).tolist(), [1, 2, 3])
+        self.assertEqual(index.query((1.2, -1, 3.8, 1), predicate="contains").tolist(), [2, 3])
+        self.assertEqual(index.query(shapely.LineString([(2, 2), (4.2, 0.1)])).tolist(), [4])
+        with self.assertRaises(ValueError):
+            index.query((0, 0), predicate="near")
+
+        index.data = squares(3)
+        self.assertFalse(index.built)
+        self.assertEqual(index.query((0, 0, 10, 1)).tolist(), [0, 1, 2])
+
+        gdf = gpd.GeoDataFrame.from_features(squares(10)["features"], crs="EPSG:4326")
+        index = spatial.SpatialIndex(gdf)
+        self.assertEqual(index.query((1.2, 0.1, 3.2, 0.2)).tolist(), [1, 2, 3])
+        feature = index.features([2])[0]
+        self.assertEqual(feature["properties"]["name"], "sq2")
+
+    def test_002_map_query(self):
+        """Map.query covers vector layers and follows their data."""
+        import geopandas as gpd
+
+        m = thinkgreen.Map()
+        a = m.add_geojson(squares(10, "a"), name="A")
+        m.add_gdf(gpd.GeoDataFrame.from_features(squares(5, "b")["features"], crs="EPSG:4326"), name="B")
+
+        results = m.query((2.25, 0.25))
+        self.assertEqual([f["properties"]["name"] for f in results["A"]], ["a2"])
+        self.assertEqual([f["properties"]["name"] for f in results["B"]], ["b2"])
+        self.assertEqual(list(m.query((2.25, 0.25), layers=["A"])), ["A"])
+        self.assertEqual(list(m.query((2.25, 0.25), layers=[a])), ["A"])
+        self.assertEqual(m.query((7.25, 0.25)).keys(), {"A"})
+
+        a.data = squares(2, "c")
+        self.assertEqual(m.query((7.25, 0.25)), {})
+        self.assertEqual(m.query((1.25, 0.25), layers=["A"])["A"][0]["properties"]["name"], "c1")
+
+        m.remove(a)
+        self.assertEqual(m.query((1.25, 0.25)).keys(), {"B"})
+
+    def test_003_simplified_layers(self):
+        """Zoom level swaps of a simplified layer keep the full-resolution index."""
+        m = thinkgreen.Map(zoom=2)
+        layer = m.add_geojson(squares(10), name="A", simplify=True)
+        index = m._spatial_indexes[layer.model_id][1]
+        m.query((2.25, 0.25))
+        m.zoom = 16
+        self.assertTrue(index.built)
+        self.assertEqual(len(m.query((2.25, 0.25))["A"]), 1)
+
+    def test_004_identify(self):
+        """A click shows the properties of the features under it."""
+        m = thinkgreen.Map(zoom=10)
+        m.add_geojson(squares(10), name="A")
+        popup = m.add_identify()
+
+        m._handle_leaflet_event(m, {"event": "interaction", "type": "click", "coordinates": [0.25, 3.25]}, [])
+        self.assertIn(popup, m.layers)
+        self.assertIn("sq3", popup.child.value)
+        self.assertEqual(popup.location, [0.25, 3.25])
+
+        m._handle_leaflet_event(m, {"event": "interaction", "type": "click", "coordinates": [5, 5]}, [])
+        self.assertNotIn(popup, m.layers)
+
+    def test_005_clip(self):
+        """Features are clipped to a geometry in chunks and summarized as they arrive."""
+        import shapely
+
+        data = squares(10)
+        for i, feature in enumerate(data["features"]):
+            feature["properties"].update({"value": i, "kind": "even" if i % 2 == 0 else "odd"})
+        index = spatial.SpatialIndex(data)
+        chunks = list(index.clip((1.25, 0, 5.1, 1), chunk_size=2))
+        self.assertEqual([progress for _, _, progress in chunks], [(2, 5), (4, 5), (5, 5)])
+        indices = [i for chunk, _, _ in chunks for i in chunk.tolist()]
+        self.assertEqual(indices, [1, 2, 3, 4, 5])
+        geometries = [g for _, clipped, _ in chunks for g in clipped]
+        self.assertAlmostEqual(geometries[0].area, 0.125)
+        self.assertAlmostEqual(geometries[1].area, 0.25)
+        self.assertAlmostEqual(geometries[-1].area, 0.05)
+
+        summary = spatial.AttributeSummary()
+        summary.update(index.properties([1, 2, 3]))
+        summary.update(index.properties([4, 5]))
+        result = summary.to_dict()
+        self.assertEqual(result["count"], 5)
+        self.assertEqual(result["attributes"]["value"]["mean"], 3)
+        self.assertEqual(result["attributes"]["value"]["max"], 5)
+        self.assertEqual(result["attributes"]["kind"]["top"], [("odd", 3), ("even", 2)])
+        self.assertIn("odd (3)", summary.to_html())
+
+        circle = spatial.drawn_geometry(
+            {
+                "type": "Feature",
+                "properties": {"style": {"radius": 111320}},
+                "geometry": {"type": "Point", "coordinates": [10, 60]},
+            }
+        )
+        self.assertAlmostEqual(circle.bounds[1], 59, places=3)
+        self.assertAlmostEqual(circle.bounds[2], 12, places=3)
+        self.assertIsInstance(circle, shapely.Polygon)
+
+    def test_006_draw_clip(self):
+        """Drawing a shape clips the visible vector layers on a worker thread."""
+        import time
+
+        m = thinkgreen.Map()
+        layer = m.add_geojson(squares(10, "a"), name="A")
+        hidden = m.add_geojson(squares(10, "b"), name="B")
+        hidden.visible = False
+        draw_control = m.add_draw_control()
+
+        rectangle = {
+            "type": "Feature",
+            "properties": {},
+            "geometry": {"type": "Polygon", "coordinates": [[[1.25, 0], [3.1, 0], [3.1, 1], [1.25, 1], [1.25, 0]]]},
+        }
+        futures = []
+        submit_clip = spatial.submit_clip
+
+        def submit(*args, **kwargs):
+            futures.append(submit_clip(*args, **kwargs))
+            return futures[-1]
+
+        with mock.patch.object(spatial, "submit_clip", side_effect=submit):
+            draw_control._handle_leaflet_event(draw_control, {"event": "draw:created", "geo_json": rectangle}, [])
+        self.assertEqual(len(futures), 1)
+        results = futures[0].result()
+        self.assertEqual(list(results), [layer.model_id])
+        self.assertEqual(results[layer.model_id]["name"].tolist(), ["a1", "a2", "a3"])
+        self.assertAlmostEqual(sum(g.area for g in results[layer.model_id].geometry), 0.125 + 0.25 + 0.05)
+
+        for _ in range(100):
+            if "3 features" in m._clip_control.widget.value:
+                break
+            time.sleep(0.01)
+        self.assertIn(m._clip_control, m.controls)
+        self.assertIn("3 features", m._clip_control.widget.value)
+        self.assertNotIn("scanned", m._clip_control.widget.value)
+
+    def test_007_geojson_geometries(self):
+        """Geometries are converted in bulk by type, matching shapely.geometry.shape."""
+        from shapely.geometry import shape
+
+        geometries = [
+            {"type": "Point", "coordinates": [1, 2]},
+            None,
+            {"type": "MultiLineString", "coordinates": [[[1, 2], [3, 4]], [[0, 0], [1, 1]]]},
+            {
+                "type": "Polygon",
+                "coordinates": [
+                    [[0, 0], [1, 0], [1, 1], [0, 0]],
+                    [[0.1, 0.1], [0.2, 0.1], [0.2, 0.2], [0.1, 0.1]],
+                ],
+            },
+            {
+                "type": "MultiPolygon",
+                "coordinates": [[[[0, 0], [1, 0], [1, 1], [0, 0]]], [[[5, 5], [6, 5], [6, 6], [5, 5]]]],
+            },
+            {"type": "Polygon", "coordinates": [[[0, 0, 9], [1, 0, 9], [1, 1, 9], [0, 0, 9]]]},
+            {"type": "GeometryCollection", "geometries": [{"type": "Point", "coordinates": [1, 2]}]},
+        ]
+        converted = spatial.geojson_geometries(geometries)
+        self.assertIsNone(converted[1])
+        for geometry, result in zip(geometries, converted):
+            if geometry is not None:
+                self.assertTrue(result.equals(shape(geometry)), geometry)
+
+    def test_008_clip_same_names(self):
+        """Layers with the same name are clipped and summarized separately."""
+        m = thinkgreen.Map()
+        first = m.add_geojson(squares(10, "a"), name="Parcels")
+        second = m.add_geojson(squares(10, "b"), name="Parcels")
+        results = m.clip_layers((1.25, 0, 3.1, 1)).result()
+        self.assertEqual(set(results), {first.model_id, second.model_id})
+        self.assertEqual(results[first.model_id]["name"].tolist(), ["a1", "a2", "a3"])
+        self.assertEqual(results[second.model_id]["name"].tolist(), ["b1", "b2", "b3"])
+        self.assertEqual(m._clip_control.widget.value.count("<b>Parcels</b>: 3 features"), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
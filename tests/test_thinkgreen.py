@@ -3,19 +3,411 @@
 """Tests for `thinkgreen` package."""
 
 
+import json
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
 from thinkgreen import thinkgreen
 
+# Cold-import budget for ``import thinkgreen`` in a fresh interpreter (seconds).
+IMPORT_BUDGET = 0.5
+
+
+def wait_until(condition, timeout=10):
+    """Polls a condition until it holds or the timeout expires, and returns its last value."""
+    import time
+
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
 
 class TestThinkgreen(unittest.TestCase):
     """Tests for `thinkgreen` package."""
 
     def setUp(self):
         """Set up test fixtures, if any."""
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.geojson = os.path.join(self.tmpdir.name, "squares.geojson")
+        features = [
+            {
+                "type": "Feature",
+                "properties": {"id": i, "name": f"sq{i}", "note": "x" * 50},
+                "geometry": {
+                    "type": "Polygon",
+                    "coordinates": [[[i, 0], [i + 0.5, 0], [i + 0.5, 0.5], [i, 0.5], [i, 0]]],
+                },
+            }
+            for i in range(20)
+        ]
+        with open(self.geojson, "w") as f:
+            json.dump({"type": "FeatureCollection", "name": "squares", "features": features}, f, indent=1)
+        self.csv = os.path.join(self.tmpdir.name, "points.csv")
+        with open(self.csv, "w") as f:
+            f.write("name,longitude,latitude,value\n")
+            for i in range(25):
+                f.write(f"p{i},{-84 + i * 0.01},{36 + i * 0.01},{i}\n")
+            f.write("bad,,36,0\n")
 
     def tearDown(self):
         """Tear down test fixtures, if any."""
+        self.tmpdir.cleanup()
 
     def test_000_something(self):
         """Test something."""
+
+    def test_001_import_budget(self):
+        """Cold import stays under budget and loads no backend."""
+        code = (
+            "import sys, time; t = time.perf_counter(); import thinkgreen; "
+            "print(time.perf_counter() - t); "
+            "print(any(m in sys.modules for m in ('ipyleaflet', 'folium')))"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout.split()
+        self.assertLess(float(out[0]), IMPORT_BUDGET)
+        self.assertEqual(out[1], "False")
+
+    def test_002_lazy_backend(self):
+        """Accessing a backend does not pull in heavy optional modules."""
+        code = (
+            "import sys, thinkgreen; thinkgreen.Map; "
+            "print(sorted(m for m in ('streamlit', 'matplotlib', 'geopandas', 'folium') "
+            "if m in sys.modules))"
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        self.assertEqual(out, "[]")
+
+    def test_003_add_points_from_csv(self):
+        """Points are read in chunks and attached to the map as one layer."""
+        m = thinkgreen.Map()
+        layer = m.add_points_from_csv(self.csv, chunksize=10)
+        self.assertIn(layer, m.layers)
+        coords = layer.data["features"][0]["geometry"]["coordinates"]
+        self.assertEqual(len(coords), 25)
+        self.assertEqual(coords[0], [-84.0, 36.0])
+
+        layer = m.add_points_from_csv(self.csv, label="name", max_points=12, chunksize=5)
+        self.assertEqual(len(layer.data["features"]), 12)
+        self.assertEqual(layer.data["features"][3]["properties"], {"name": "p3"})
+
+        # Clicks move one popup rather than adding one per click.
+        layers = len(m.layers)
+        for feature in layer.data["features"][:3]:
+            layer._click_callbacks(feature=feature, properties=feature["properties"])
+        self.assertEqual(len(m.layers), layers + 1)
+        popup = m.layers[-1]
+        self.assertEqual(popup.child.value, "p2")
+        self.assertEqual(popup.location, feature["geometry"]["coordinates"][::-1])
+        m.remove(layer)
+        self.assertNotIn(popup, m.layers)
+
+        # Larger files are sampled uniformly, in file order, rather than held whole.
+        with self.assertLogs("thinkgreen.thinkgreen", level="WARNING"):
+            layer = m.add_points_from_csv(self.csv, label="name", chunksize=4, sample_size=10)
+        names = [f["properties"]["name"] for f in layer.data["features"]]
+        self.assertEqual(len(names), 10)
+        self.assertEqual(names, sorted(names, key=lambda name: int(name[1:])))
+        self.assertNotEqual(names, [f"p{i}" for i in range(10)])
+
+    def test_004_add_csv(self):
+        """CSV batches are appended to every output format."""
+        import geopandas as gpd
+
+        m = thinkgreen.Map()
+        for out_format, ext in [("geojson", "geojson"), ("shapefile", "shp"), ("geoparquet", "parquet")]:
+            out_file = os.path.join(self.tmpdir.name, f"points.{ext}")
+            self.assertEqual(m.add_csv(self.csv, out_file, out_format, chunksize=7), 25)
+            gdf = gpd.read_file(out_file) if ext != "parquet" else gpd.read_parquet(out_file)
+            self.assertEqual(len(gdf), 25)
+            self.assertEqual(list(gdf["name"][:2]), ["p0", "p1"])
+
+        gdf = gpd.read_parquet(out_file, columns=["value", "geometry"])
+        self.assertEqual(list(gdf.columns), ["value", "geometry"])
+        self.assertEqual(gdf.crs.to_epsg(), 4326)
+
+        with self.assertRaises(ValueError):
+            m.add_csv(self.csv, out_file, "kml")
+
+    def test_005_iter_geojson_features(self):
+        """GeoJSON features are streamed and filtered."""
+        from unittest import mock
+
+        from thinkgreen.common import iter_geojson_features
+
+        # A feature much larger than the read size is decoded in a few attempts.
+        path = os.path.join(self.tmpdir.name, "line.geojson")
+        coords = [[i / 1000, i / 1000] for i in range(20000)]
+        with open(path, "w") as f:
+            json.dump({"type": "Feature", "properties": {}, "geometry": {"type": "LineString", "coordinates": coords}}, f)
+        raw_decode = json.JSONDecoder.raw_decode
+        with mock.patch.object(json.JSONDecoder, "raw_decode", autospec=True, side_effect=raw_decode) as decode:
+            features = list(iter_geojson_features(path, chunk_size=64))
+        self.assertEqual(features[0]["geometry"]["coordinates"], coords)
+        self.assertLess(decode.call_count, 30)
+
+        features = list(iter_geojson_features(self.geojson, chunk_size=64))
+        self.assertEqual([f["properties"]["id"] for f in features], list(range(20)))
+
+        features = list(
+            iter_geojson_features(
+                self.geojson, bbox=(4.8, -1, 7.2, 1), properties=["id"], chunk_size=100
+            )
+        )
+        self.assertEqual([f["properties"] for f in features], [{"id": 5}, {"id": 6}, {"id": 7}])
+
+        features = list(iter_geojson_features(self.geojson, max_features=3))
+        self.assertEqual(len(features), 3)
+
+        # A 3D bbox has its max corner after the min elevation.
+        path = os.path.join(self.tmpdir.name, "bbox3d.geojson")
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "type": "FeatureCollection",
+                    "features": [
+                        {
+                            "type": "Feature",
+                            "bbox": [x, 0, 100, x + 1, 1, 200],
+                            "properties": {"id": x},
+                            "geometry": {"type": "Point", "coordinates": [x + 0.5, 0.5, 150]},
+                        }
+                        for x in (0, 10, 300)
+                    ],
+                },
+                f,
+            )
+        features = list(iter_geojson_features(path, bbox=(9, -1, 12, 2)))
+        self.assertEqual([f["properties"]["id"] for f in features], [10])
+
+    def test_006_add_geojson_refresh(self):
+        """The loaded subset follows the map viewport."""
+        m = thinkgreen.Map()
+        observers = len(m._trait_notifiers["bounds"]["change"])
+        layer = m.add_geojson(self.geojson, bbox=(0, -1, 2.2, 1), refresh_on_move=True)
+        self.assertEqual(len(layer.data["features"]), 3)
+
+        # The file is read off the kernel thread.
+        ids = lambda: [f["properties"]["id"] for f in layer.data["features"]]
+        m.set_trait("bounds", ((-0.1, 10), (0.1, 11)))
+        self.assertTrue(wait_until(lambda: ids() == []))
+
+        m.remove(layer)
+        layer = m.add_geojson(self.geojson, refresh_on_move=True)
+        self.assertEqual(len(m._trait_notifiers["bounds"]["change"]), observers + 1)
+        for west in (13, 13.5, 14.4):
+            m.set_trait("bounds", ((-0.1, west), (0.1, west + 0.7)))
+        self.assertTrue(wait_until(lambda: ids() == [14, 15]))
+
+        m.remove(layer)
+        self.assertEqual(len(m._trait_notifiers["bounds"]["change"]), observers)
+        self.assertEqual(m._cleanups, {})
+
+    def test_007_simplify_by_zoom(self):
+        """Vector layers swap simplified levels as the map zooms."""
+        m = thinkgreen.Map(zoom=2)
+        layer = m.add_vector(self.geojson, "GeoJson", simplify=True, zoom_levels=(0, 10))
+        coarse = layer.data
+        m.zoom = 11
+        self.assertIsNot(layer.data, coarse)
+        m.zoom = 3
+        self.assertIs(layer.data, coarse)
+
+        import geopandas as gpd
+        from shapely.geometry import Point
+
+        circles = gpd.GeoDataFrame(
+            geometry=[Point(i, 0).buffer(0.4, quad_segs=64) for i in range(5)], crs="EPSG:4326"
+        )
+        m.add_gdf(circles, name="circles", simplify=True, zoom_levels=(0, 10))
+        report = m.payload_report()
+        report = report[report["layer"] == "circles"]
+        self.assertEqual(list(report["zoom"].dropna()), [0, 10])
+        self.assertTrue((report["bytes"].iloc[1:] < report["bytes"].iloc[0]).all())
+
+        # Layers with the same name are reported separately, and forgotten once removed.
+        again = m.add_gdf(circles, name="circles", simplify=True, zoom_levels=(0, 10))
+        self.assertEqual((m.payload_report()["layer"] == "circles").sum(), 6)
+        m.remove(again)
+        m.remove(layer)
+        self.assertNotIn(again.model_id, m._vector_levels)
+        self.assertNotIn(layer.model_id, m._payload_sizes)
+        self.assertEqual((m.payload_report()["layer"] == "circles").sum(), 3)
+
+        with self.assertRaises(ValueError):
+            m.add_vector(self.geojson, "KML")
+
+    def test_013_simplify_coverage(self):
+        """Neighbouring polygons keep sharing their borders once simplified."""
+        import numpy as np
+        import shapely
+        from shapely.geometry import Polygon
+
+        from thinkgreen.common import simplify_by_zoom
+
+        if not hasattr(shapely, "coverage_simplify"):
+            self.skipTest("shapely 2.1 or later is needed")
+        xs = np.linspace(0, 10, 400)
+        border = [(x, 5 + 0.2 * np.sin(4 * x)) for x in xs]
+        polygons = [Polygon([(0, 0), (10, 0)] + border[::-1]), Polygon(border + [(10, 10), (0, 10)])]
+        data = {
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature", "properties": {"id": i}, "geometry": shapely.geometry.mapping(p)}
+                for i, p in enumerate(polygons)
+            ],
+        }
+        for zoom, level in simplify_by_zoom(data, zoom_levels=(6, 8)).items():
+            a, b = [shapely.geometry.shape(f["geometry"]) for f in level["features"]]
+            self.assertLess(len(a.exterior.coords), 400)
+            self.assertAlmostEqual(a.intersection(b).area, 0)
+            self.assertAlmostEqual(a.union(b).area, 100)
+
+    def test_008_search_basemaps(self):
+        """Basemaps are resolved and searched through the provider index."""
+        import thinkgreen as tg
+
+        names = tg.search_basemaps("openstreetmap.")
+        self.assertIn("OpenStreetMap.Mapnik", names)
+        self.assertTrue(all(n.startswith("OpenStreetMap.") for n in names[:5]))
+        self.assertIn("Esri.WorldImagery", tg.search_basemaps("esri", free_only=True))
+        self.assertEqual(tg.search_basemaps("no-such-basemap"), [])
+
+        m = thinkgreen.Map()
+        m.add_basemap("openstreetmap_mapnik")
+        self.assertEqual(m.layers[-1].url, "https://tile.openstreetmap.org/{z}/{x}/{y}.png")
+        m.add_basemap("terrain")
+        self.assertIn("lyrs=p", m.layers[-1].url)
+        with self.assertRaises(ValueError):
+            m.add_basemap("__import__('os')")
+
+    def test_009_set_basemap(self):
+        """Switching basemaps reuses a bounded pool of layers in one slot."""
+        m = thinkgreen.Map()
+        count = len(m.layers)
+        names = ["ROADMAP", "SATELLITE", "TERRAIN", "OpenStreetMap.Mapnik", "Esri.WorldImagery"]
+        created = set()
+        for i in range(50):
+            layer = m.set_basemap(names[i % len(names)])
+            created.add(id(layer))
+            self.assertEqual(len(m.layers), count)
+            self.assertIs(m.layers[0], layer)
+        self.assertLessEqual(len(created), m.basemap_pool_size)
+        self.assertIn("World_Imagery", m.layers[0].url)
+
+        self.assertIs(m.set_basemap("Esri.WorldImagery"), layer)
+        satellite = m.set_basemap("SATELLITE")
+        self.assertIsNot(satellite, layer)
+        self.assertIs(m.set_basemap("Esri.WorldImagery"), layer)
+        self.assertEqual(len(m.layers), count)
+
+    def test_010_batch(self):
+        """Changes made in a batch are queued and sent as one update."""
+        import ipyleaflet
+        import ipywidgets
+
+        m = thinkgreen.Map()
+        count = len(m.layers)
+        sent = []
+        send = ipywidgets.Widget._send
+
+        def counting_send(widget, msg, buffers=None):
+            if widget is m:
+                sent.append(msg)
+            return send(widget, msg, buffers)
+
+        ipywidgets.Widget._send = counting_send
+        try:
+            with m.batch():
+                for i in range(20):
+                    m.add_tile_layer(f"https://tiles.example.com/{i}/{{z}}/{{x}}/{{y}}.png", name=str(i))
+                top = ipyleaflet.TileLayer(url="https://tiles.example.com/top/{z}/{x}/{y}.png")
+                m.add(top, index=0)
+                m.add_layers_control()
+                with m.batch():
+                    m.zoom = 5
+                self.assertEqual(len(m.layers), count)
+                with self.assertRaises(ipyleaflet.LayerException):
+                    m.add(top)
+        finally:
+            ipywidgets.Widget._send = send
+
+        self.assertEqual(len(sent), 1)
+        self.assertEqual(len(m.layers), count + 21)
+        self.assertIs(m.layers[0], top)
+        self.assertEqual(m.zoom, 5)
+        self.assertIsInstance(m.controls[-1], ipyleaflet.LayersControl)
+
+        with m.batch():
+            m.add_tile_layer("https://tiles.example.com/x/{z}/{x}/{y}.png", name="x")
+            m.remove(top)
+        self.assertNotIn(top, m.layers)
+        self.assertEqual(m.layers[-1].name, "x")
+
+    def test_011_add_vector_dir(self):
+        """A directory of vector files is read in a process pool and added as one layer group."""
+        import geopandas as gpd
+        import ipyleaflet
+
+        directory = os.path.join(self.tmpdir.name, "layers")
+        os.makedirs(os.path.join(directory, "nested"))
+        gdf = gpd.read_file(self.geojson)
+        gdf.iloc[:5].to_file(os.path.join(directory, "a.geojson"), driver="GeoJSON")
+        gdf.iloc[5:10].to_crs(epsg=3857).to_file(os.path.join(directory, "b.shp"))
+        gdf.iloc[10:].to_file(os.path.join(directory, "nested", "c.geojson"), driver="GeoJSON")
+        with open(os.path.join(directory, "notes.txt"), "w") as f:
+            f.write("not a vector file")
+
+        m = thinkgreen.Map()
+        count = len(m.layers), len(m.controls)
+        progress = []
+        group = m.add_vector_dir(
+            directory, columns=["name"], processes=2, on_progress=lambda *args: progress.append(args)
+        )
+        self.assertIsInstance(group, ipyleaflet.LayerGroup)
+        self.assertEqual(group.name, "layers")
+        self.assertEqual((len(m.layers), len(m.controls)), (count[0] + 1, count[1]))
+        self.assertEqual([layer.name for layer in group.layers], ["a", "b"])
+        self.assertEqual(sorted(done for done, _, _ in progress), [1, 2])
+        feature = group.layers[1].data["features"][0]
+        self.assertEqual(feature["properties"], {"name": "sq5"})
+        self.assertAlmostEqual(feature["geometry"]["coordinates"][0][0][0], 5)
+        self.assertEqual(m.query((5.25, 0.25))["b"][0]["properties"]["name"], "sq5")
+
+        group = m.add_vector_dir(directory, pattern="*.geojson", recursive=True, simplify=True, processes=1)
+        self.assertEqual([layer.name for layer in group.layers], ["a", os.path.join("nested", "c")])
+        self.assertIn(group.layers[0].model_id, m._vector_levels)
+        m.remove(group)
+        self.assertNotIn(group.layers[0].model_id, m._spatial_indexes)
+
+        with self.assertRaises(ValueError):
+            m.add_vector_dir(directory, pattern="*.gpkg")
+
+    def test_012_add_csv_changing_types(self):
+        """Columns whose type changes after the first batch are written without loss."""
+        import geopandas as gpd
+
+        path = os.path.join(self.tmpdir.name, "mixed.csv")
+        with open(path, "w") as f:
+            f.write("longitude,latitude,code,size,count\n")
+            rows = [(1, 3, 10), (2, 4, 11), ("A7", 7.5, ""), (3, 5, 12)]
+            for i, (code, size, count) in enumerate(rows):
+                f.write(f"{i},{i},{code},{size},{count}\n")
+
+        m = thinkgreen.Map()
+        for out_format, ext in [("geojson", "geojson"), ("shapefile", "shp"), ("geoparquet", "parquet")]:
+            out_file = os.path.join(self.tmpdir.name, f"mixed.{ext}")
+            self.assertEqual(m.add_csv(path, out_file, out_format, chunksize=2), 4)
+            gdf = gpd.read_file(out_file) if ext != "parquet" else gpd.read_parquet(out_file)
+            self.assertEqual([str(v) for v in gdf["code"]], ["1", "2", "A7", "3"])
+            self.assertEqual(list(gdf["size"]), [3.0, 4.0, 7.5, 5.0])
+            self.assertEqual(gdf["count"].tolist()[:2], [10, 11])
+            self.assertTrue(gdf["count"].isna()[2] or ext == "shp")
+
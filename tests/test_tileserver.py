@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+"""Tests for the tile server and the tiles it serves."""
+
+
+import unittest
+import urllib.request
+
+from thinkgreen import thinkgreen
+from thinkgreen.cache import LRUCache
+from thinkgreen.tileserver import lnglat_to_tile
+
+
+class TestTileServer(unittest.TestCase):
+    """Tests for `thinkgreen.tileserver` and the tile sources."""
+
+    def test_000_lru_cache(self):
+        """The cache evicts the least recently used values over its byte limit."""
+        cache = LRUCache(max_bytes=10)
+        cache.put("a", b"1234")
+        cache.put("b", b"1234")
+        cache.get("a")
+        cache.put("c", b"1234")
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertEqual(cache.nbytes, 8)
+        cache.put("d", b"x" * 11)
+        self.assertNotIn("d", cache)
+
+    def test_001_vector_tiles(self):
+        """Vector tiles are cut on demand and served over localhost."""
+        import geopandas as gpd
+        import mapbox_vector_tile
+        from shapely.geometry import box
+
+        gdf = gpd.GeoDataFrame(
+            {"id": list(range(10)), "name": [f"b{i}" for i in range(10)]},
+            geometry=[box(i * 10, 0, i * 10 + 5, 5) for i in range(10)],
+            crs="EPSG:4326",
+        )
+        m = thinkgreen.Map()
+        layer = m.add_vector_tiles(gdf, columns=["id"])
+        self.assertIn(layer, m.layers)
+
+        x, y = lnglat_to_tile(12, 2, 6)
+        url = layer.url.format(z=6, x=x, y=y)
+        with urllib.request.urlopen(url) as r:
+            tile = mapbox_vector_tile.decode(r.read())
+        ids = sorted(f["properties"]["id"] for f in tile["layer"]["features"])
+        self.assertEqual(ids, [1])
+
+        with urllib.request.urlopen(url) as r:
+            r.read()
+        self.assertEqual(layer.source.cache.hits, 1)
+
+        x, y = lnglat_to_tile(-100, -40, 4)
+        with urllib.request.urlopen(layer.url.format(z=4, x=x, y=y)) as r:
+            self.assertEqual(r.read(), b"")
+
+    def test_002_tile_proxy(self):
+        """Basemap tiles are cached on disk, prefetched and served offline."""
+        import os
+        import tempfile
+        import time
+        import urllib.error
+
+        from thinkgreen.tileserver import TileServer
+
+        upstream = TileServer()
+        hits = []
+
+        def tiles(segments, query):
+            hits.append(tuple(segments))
+            # Every tile of row 0 has the same content.
+            body = b"\x89PNG\r\n\x1a\n" + (b"same" if segments[2] == "0.png" else "/".join(segments).encode())
+            return body, "image/png"
+
+        upstream.register("tiles", tiles)
+        tmpdir = tempfile.TemporaryDirectory()
+        try:
+            m = thinkgreen.Map()
+            m.enable_tile_cache(cache_dir=tmpdir.name, prefetch=False)
+            m.add_tile_layer(upstream.url + "/tiles/{z}/{x}/{y}.png", name="Upstream")
+            url = m.layers[-1].url
+            self.assertFalse(url.startswith(upstream.url))
+
+            for _ in range(2):
+                with urllib.request.urlopen(url.format(z=2, x=1, y=0)) as r:
+                    self.assertEqual(r.headers["Content-Type"], "image/png")
+            with urllib.request.urlopen(url.format(z=2, x=2, y=0)) as r:
+                r.read()
+            self.assertEqual(len(hits), 2)
+            self.assertEqual(len(os.listdir(os.path.join(tmpdir.name, "objects"))), 1)
+
+            m.enable_tile_cache(offline=True)
+            with urllib.request.urlopen(url.format(z=2, x=1, y=0)) as r:
+                r.read()
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(url.format(z=2, x=3, y=3))
+            self.assertEqual(len(hits), 2)
+
+            m.enable_tile_cache(prefetch=True)
+            m.set_trait("zoom", 3)
+            m.set_trait("bounds", ((0, 0), (10, 10)))
+            for _ in range(50):
+                if ("3", "3", "3.png") in hits and ("4", "8", "7.png") in hits:
+                    break
+                time.sleep(0.1)
+            self.assertIn(("3", "3", "3.png"), hits)
+            self.assertIn(("4", "8", "7.png"), hits)
+
+            m._tile_cache.max_bytes = 30
+            m._tile_cache.put("extra", b"x" * 20)
+            self.assertLessEqual(m._tile_cache.nbytes, 30)
+        finally:
+            upstream.shutdown()
+            tmpdir.cleanup()
+
+    def test_003_unregister_on_remove(self):
+        """Removing a layer unregisters the tiles it served."""
+        import urllib.error
+
+        import geopandas as gpd
+        from shapely.geometry import box
+
+        from thinkgreen.tileserver import TileServer
+
+        gdf = gpd.GeoDataFrame({"id": [0]}, geometry=[box(0, 0, 5, 5)], crs="EPSG:4326")
+        upstream = TileServer()
+        upstream.register("tiles", lambda segments, query: (b"\x89PNG\r\n\x1a\n", "image/png"))
+        try:
+            m = thinkgreen.Map()
+            m.enable_tile_cache(prefetch=False, offline=True)
+            vector = m.add_vector_tiles(gdf)
+            m.add_tile_layer(upstream.url + "/tiles/{z}/{x}/{y}.png", name="Upstream")
+            m.add_tile_layer(upstream.url + "/tiles/{z}/{x}/{y}.png", name="Again")
+            first, second = m.layers[-2:]
+            self.assertEqual(first.url, second.url)
+            urls = [vector.url.format(z=0, x=0, y=0), first.url.format(z=0, x=0, y=0)]
+
+            m.remove(vector)
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(urls[0])
+            self.assertEqual(error.exception.code, 404)
+
+            m.remove(first)
+            self.assertEqual(len(m._tile_proxies), 1)
+            m.remove(second)
+            self.assertEqual(m._tile_proxies, [])
+            self.assertEqual(m._proxied_urls, {})
+            with self.assertRaises(urllib.error.HTTPError) as error:
+                urllib.request.urlopen(urls[1])
+            self.assertEqual(error.exception.code, 404)
+        finally:
+            upstream.shutdown()
+
+    def test_004_client_url(self):
+        """The browser reaches the server through the proxy of a remote kernel, or fails loudly."""
+        import builtins
+        import os
+        from unittest import mock
+
+        from thinkgreen.tileserver import client_url
+
+        with mock.patch.dict(os.environ, {"THINKGREEN_TILE_PREFIX": "/user/me/proxy/{port}/"}):
+            self.assertEqual(client_url(8888), "/user/me/proxy/8888")
+        environ = {k: v for k, v in os.environ.items() if k != "THINKGREEN_TILE_PREFIX"}
+        with mock.patch.dict(os.environ, environ, clear=True):
+            self.assertIsNone(client_url(8888))
+            os.environ["JUPYTERHUB_SERVICE_PREFIX"] = "/user/me/"
+            import_ = builtins.__import__
+
+            def no_proxy(name, *args, **kwargs):
+                if name == "jupyter_server_proxy":
+                    raise ImportError(name)
+                return import_(name, *args, **kwargs)
+
+            with mock.patch.object(builtins, "__import__", side_effect=no_proxy):
+                with self.assertRaises(ValueError):
+                    client_url(8888)
+            with mock.patch.dict("sys.modules", {"jupyter_server_proxy": mock.Mock()}):
+                self.assertEqual(client_url(8888), "/user/me/proxy/8888")
+
+    def test_005_prefetch_priority(self):
+        """Requested tiles are fetched before prefetches, and a new viewport drops stale prefetches."""
+        import tempfile
+        import time
+
+        from thinkgreen.cache import DiskTileCache
+        from thinkgreen.tileserver import TileProxy, TileServer
+
+        upstream = TileServer()
+        hits = []
+
+        def tiles(segments, query):
+            hits.append(tuple(segments))
+            time.sleep(0.02)
+            return b"\x89PNG\r\n\x1a\n" + "/".join(segments).encode(), "image/png"
+
+        upstream.register("tiles", tiles)
+        tmpdir = tempfile.TemporaryDirectory()
+        proxy = TileProxy(upstream.url + "/tiles/{z}/{x}/{y}.png", cache=DiskTileCache(tmpdir.name))
+        try:
+            self.assertGreater(proxy.prefetch(((-60, -170), (60, 170)), 4), 100)
+            time.sleep(0.05)
+            before = len(hits)
+            proxy.tile(2, 3, 3)
+            # At most the prefetch in flight went ahead of the requested tile.
+            self.assertLessEqual(hits.index(("2", "3", "3.png")) - before, 1)
+
+            for _ in range(100):
+                if not proxy._prefetching and not proxy._pending:
+                    break
+                time.sleep(0.05)
+            start = len(hits)
+            queued = proxy.prefetch(((0, 0), (1, 1)), 10)
+            self.assertEqual(len(proxy._prefetch_keys), queued)
+            for _ in range(100):
+                if not proxy._prefetching:
+                    break
+                time.sleep(0.05)
+            zooms = {z for z, _, _ in hits[start:]}
+            self.assertEqual(zooms, {"10", "11"})
+            self.assertEqual(len(hits) - start, queued)
+        finally:
+            proxy.close()
+            upstream.shutdown()
+            tmpdir.cleanup()
+
+    def test_006_multipoint_tiles(self):
+        """Multipoints within a pixel are kept once per pixel, like points."""
+        import geopandas as gpd
+        import mapbox_vector_tile
+        from shapely.geometry import MultiPoint, Point
+
+        from thinkgreen.vectortiles import VectorTileSource
+
+        gdf = gpd.GeoDataFrame(
+            {"id": [0, 1, 2]},
+            geometry=[Point(1, 1), MultiPoint([(50, 50), (50.001, 50.001)]), MultiPoint([(-100, -40), (100, 40)])],
+            crs="EPSG:4326",
+        )
+        tile = mapbox_vector_tile.decode(VectorTileSource(gdf).tile(0, 0, 0))
+        self.assertEqual(sorted(f["properties"]["id"] for f in tile["layer"]["features"]), [0, 1, 2])
@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""Tests for the binary vector encoding of `thinkgreen`."""
+
+
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from thinkgreen import foliumap, topobuf
+
+SAMPLE_SHP = os.path.join(
+    os.path.dirname(__file__), os.pardir, "docs", "examples", "sample_data", "countries.shp"
+)
+
+
+def square(x0, y0, size=1.0):
+    ring = [[x0, y0], [x0 + size, y0], [x0 + size, y0 + size], [x0, y0 + size], [x0, y0]]
+    return {"type": "Polygon", "coordinates": [ring]}
+
+
+class TestTopobuf(unittest.TestCase):
+    """Tests for `thinkgreen.topobuf`."""
+
+    def setUp(self):
+        self.data = {
+            "type": "FeatureCollection",
+            "features": [
+                {"type": "Feature", "geometry": square(0, 0), "properties": {"name": "a"}},
+                {"type": "Feature", "geometry": square(1, 0), "properties": {"name": "b"}, "id": 7},
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "LineString", "coordinates": [[0, 0], [0.123456, 1.5], [2, 2]]},
+                    "properties": {},
+                },
+                {"type": "Feature", "geometry": {"type": "Point", "coordinates": [-73.98766, 40.7]}, "properties": {}},
+                {
+                    "type": "Feature",
+                    "geometry": {"type": "MultiPoint", "coordinates": [[1, 2], [3, -4]]},
+                    "properties": {},
+                },
+                {"type": "Feature", "geometry": None, "properties": {"empty": True}},
+            ],
+        }
+
+    def test_000_varints(self):
+        """Zigzag varints round-trip across magnitudes."""
+        import numpy as np
+
+        values = np.array([0, 1, -1, 63, -64, 64, 300, -300, 2**40, -(2**40), 2**62], dtype=np.int64)
+        encoded = topobuf.encode_varints(topobuf.zigzag(values))
+        self.assertEqual(topobuf.unzigzag(topobuf.decode_varints(encoded)).tolist(), values.tolist())
+        self.assertEqual(len(topobuf.encode_varints(topobuf.zigzag([1, -1, 63]))), 3)
+        with self.assertRaises(ValueError):
+            topobuf.decode_varints(encoded[:-1])
+
+    def test_001_round_trip(self):
+        """Geometries, properties and ids survive encoding at the given precision."""
+        decoded = topobuf.decode(topobuf.encode(self.data, precision=4))
+        features = decoded["features"]
+        self.assertEqual(len(features), 6)
+        self.assertEqual(features[0]["geometry"], square(0, 0))
+        self.assertEqual(features[1]["id"], 7)
+        self.assertEqual(features[1]["properties"], {"name": "b"})
+        self.assertEqual(features[2]["geometry"]["coordinates"], [[0, 0], [0.1235, 1.5], [2, 2]])
+        self.assertEqual(features[3]["geometry"]["coordinates"], [-73.9877, 40.7])
+        self.assertEqual(features[4]["geometry"]["coordinates"], [[1, 2], [3, -4]])
+        self.assertIsNone(features[5]["geometry"])
+
+    def test_002_shared_arcs(self):
+        """Boundaries shared by adjacent polygons are stored once."""
+        paths = topobuf._Paths(1)
+        a = paths.add(square(0, 0)["coordinates"][0], closed=True)
+        b = paths.add(square(1, 0)["coordinates"][0], closed=True)
+        c = paths.add(square(5, 5)["coordinates"][0][::-1], closed=True)
+        d = paths.add(square(5, 5)["coordinates"][0], closed=True)
+        arcs, refs = paths.arcs()
+        self.assertEqual(len(arcs), 4)
+        shared = set(refs[a]) & {~r for r in refs[b]}
+        self.assertEqual(len(shared), 1)
+        self.assertEqual(refs[c], [~refs[d][0]])
+
+    def test_003_shapefile(self):
+        """Real polygons shrink several-fold and decode within the precision."""
+        import geopandas as gpd
+        import shapely
+
+        gdf = gpd.read_file(SAMPLE_SHP)
+        encoded = topobuf.encode(gdf)
+        self.assertGreater(len(json.dumps(gdf.__geo_interface__)) / len(encoded), 5)
+
+        decoded = gpd.GeoDataFrame.from_features(topobuf.decode(encoded)["features"])
+        distances = shapely.hausdorff_distance(gdf.geometry.values, decoded.geometry.values)
+        self.assertLess(distances.max(), 1e-5)
+
+    @unittest.skipUnless(shutil.which("node"), "node is not installed")
+    def test_004_js_decoder(self):
+        """The JavaScript decoder matches the Python decoder."""
+        encoded = topobuf.encode(self.data)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "data.bin")
+            with open(path, "wb") as f:
+                f.write(encoded)
+            decoder = os.path.join(os.path.dirname(os.path.abspath(topobuf.__file__)), "static", "topobuf.js")
+            script = (
+                f"const t = require({json.dumps(decoder)});"
+                f"const fs = require('fs');"
+                f"process.stdout.write(JSON.stringify(t.decode(fs.readFileSync({json.dumps(path)}))));"
+            )
+            output = subprocess.run(["node", "-e", script], capture_output=True, text=True, check=True)
+        self.assertEqual(json.loads(output.stdout), json.loads(json.dumps(topobuf.decode(encoded))))
+
+    def test_005_folium(self):
+        """The folium backend embeds binary layers with a single decoder."""
+        m = foliumap.Map()
+        m.add_geojson(self.data, name="a", encoding="binary", style={"color": "red"})
+        m.add_geojson(self.data, name="b", encoding="binary")
+        html = m.get_root().render()
+        self.assertEqual(html.count("root.thinkgreenTopobuf = api"), 1)
+        self.assertEqual(html.count("L.geoJson(\n                thinkgreenTopobuf.decode("), 2)
+        with self.assertRaises(ValueError):
+            m.add_geojson(self.data, encoding="protobuf")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -4,4 +4,67 @@ __author__ = """Olivia Lamm"""
 __email__ = 'olamm@vols.utk.edu'
 __version__ = '0.0.3'
 
-from .thinkgreen import *
\ No newline at end of file
+import importlib
+import os
+
+# Heavy mapping backends are only imported when one of their attributes is
+# first accessed, so ``import thinkgreen`` stays cheap in kernels and workers.
+_BACKENDS = {
+    "ipyleaflet": ".thinkgreen",
+    "folium": ".foliumap",
+}
+
+_SUBMODULES = ["thinkgreen", "foliumap"]
+
+# Functions exposed at the package level, imported from their module on first use.
+_FUNCTIONS = {
+    "search_basemaps": ".basemaps",
+}
+
+_backend = os.environ.get("THINKGREEN_BACKEND", "ipyleaflet").lower()
+
+
+def set_backend(backend):
+    """Sets the mapping backend used by ``thinkgreen.Map``.
+
+    Only the selected backend is imported, the first time ``thinkgreen.Map``
+    is accessed. The default can also be set with the ``THINKGREEN_BACKEND``
+    environment variable.
+
+    Args:
+        backend (str): Either "ipyleaflet" or "folium".
+    """
+    global _backend
+
+    backend = backend.lower()
+    if backend not in _BACKENDS:
+        raise ValueError(f"backend must be one of {list(_BACKENDS)}")
+    _backend = backend
+    globals().pop("Map", None)
+
+
+def get_backend():
+    """Returns the name of the mapping backend used by ``thinkgreen.Map``.
+
+    Returns:
+        str: The backend name.
+    """
+    if _backend not in _BACKENDS:
+        raise ValueError(f"THINKGREEN_BACKEND must be one of {list(_BACKENDS)}")
+    return _backend
+
+
+def __getattr__(name):
+    if name == "Map":
+        module = importlib.import_module(_BACKENDS[get_backend()], __name__)
+        globals()["Map"] = module.Map
+        return module.Map
+    if name in _FUNCTIONS:
+        return getattr(importlib.import_module(_FUNCTIONS[name], __name__), name)
+    if name in _SUBMODULES:
+        return importlib.import_module(f".{name}", __name__)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals()) + ["Map"] + _SUBMODULES + list(_FUNCTIONS))
@@ -0,0 +1,229 @@
+"""A searchable index of basemaps from xyzservices and Google Maps."""
+
+import bisect
+import json
+import os
+import threading
+
+from .cache import get_cache_dir
+
+GOOGLE_BASEMAPS = {
+    "ROADMAP": "http://mt0.google.com/vt/lyrs=m&hl=en&x={x}&y={y}&z={z}",
+    "SATELLITE": "http://mt0.google.com/vt/lyrs=y&hl=en&x={x}&y={y}&z={z}",
+    "TERRAIN": "http://mt0.google.com/vt/lyrs=p&hl=en&x={x}&y={y}&z={z}",
+}
+
+_index = None
+_lock = threading.Lock()
+
+
+def _normalize(name):
+    return name.strip().lower().replace("_", ".")
+
+
+def _build_index():
+    """Flattens the xyzservices providers into a list of JSON-serializable entries."""
+    import xyzservices.providers as xyz
+
+    entries = [
+        {
+            "name": name,
+            "url": url,
+            "attribution": "Google",
+            "html_attribution": "Google",
+            "max_zoom": 22,
+            "tokens": [],
+        }
+        for name, url in GOOGLE_BASEMAPS.items()
+    ]
+    for name, provider in xyz.flatten().items():
+        tokens = [
+            key
+            for key, value in provider.items()
+            if isinstance(value, str) and value.startswith("<insert your")
+        ]
+        try:
+            url = provider.build_url(**{key: "{%s}" % key for key in tokens})
+        except ValueError:
+            continue
+        entries.append(
+            {
+                "name": name,
+                "url": url,
+                "attribution": provider.get("attribution", ""),
+                "html_attribution": provider.get("html_attribution", ""),
+                "max_zoom": provider.get("max_zoom", 18),
+                "tokens": tokens,
+            }
+        )
+    return entries
+
+
+class BasemapIndex:
+    """An index of basemaps with constant-time lookup and keyword search.
+
+    Args:
+        entries (list): The basemap entries, as dicts with at least "name", "url" and "attribution".
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._by_key = {_normalize(entry["name"]): entry for entry in entries}
+        self._keys = sorted(self._by_key)
+        self._haystacks = [
+            (entry, f"{entry['name']} {entry['attribution']}".lower()) for entry in entries
+        ]
+
+    def get(self, name):
+        """Returns the entry of a basemap by name, ignoring case and "." vs "_".
+
+        Args:
+            name (str): The basemap name, e.g. "OpenStreetMap.Mapnik".
+
+        Returns:
+            dict: The basemap entry, or None if there is no such basemap.
+        """
+        return self._by_key.get(_normalize(name))
+
+    def search(self, keyword, free_only=False, limit=None):
+        """Searches basemap names and attributions.
+
+        Names starting with the keyword come first, followed by names and
+        attributions containing it.
+
+        Args:
+            keyword (str): The keyword to search for.
+            free_only (bool, optional): Exclude basemaps that need an API key. Defaults to False.
+            limit (int, optional): The maximum number of results. Defaults to None.
+
+        Returns:
+            list: The names of the matching basemaps.
+        """
+        keyword = keyword.strip().lower()
+        prefix = _normalize(keyword)
+        results = {}
+
+        i = bisect.bisect_left(self._keys, prefix)
+        while i < len(self._keys) and self._keys[i].startswith(prefix):
+            entry = self._by_key[self._keys[i]]
+            results[entry["name"]] = entry
+            i += 1
+
+        for entry, haystack in self._haystacks:
+            if keyword in haystack:
+                results.setdefault(entry["name"], entry)
+
+        names = [name for name, entry in results.items() if not (free_only and entry["tokens"])]
+        return names[:limit] if limit is not None else names
+
+
+def get_basemap_index():
+    """Returns the basemap index, loading it from the cache file or building it once.
+
+    The flattened index is serialized to ``~/.cache/thinkgreen`` per
+    xyzservices version, so later sessions skip walking the providers.
+
+    Returns:
+        BasemapIndex: The basemap index.
+    """
+    global _index
+
+    with _lock:
+        if _index is None:
+            import xyzservices
+
+            path = os.path.join(get_cache_dir(), f"basemaps-{xyzservices.__version__}.json")
+            try:
+                with open(path) as f:
+                    entries = json.load(f)
+            except (OSError, ValueError):
+                entries = _build_index()
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "w") as f:
+                    json.dump(entries, f)
+                os.replace(tmp, path)
+            _index = BasemapIndex(entries)
+        return _index
+
+
+def get_basemap(name):
+    """Returns the entry of a basemap by name.
+
+    Args:
+        name (str): The basemap name, e.g. "SATELLITE" or "OpenStreetMap.Mapnik".
+
+    Returns:
+        dict: The basemap entry with its "url", "attribution" and "tokens".
+    """
+    entry = get_basemap_index().get(name)
+    if entry is None:
+        raise ValueError(f"Basemap '{name}' not found.")
+    return entry
+
+
+def search_basemaps(keyword, free_only=False, limit=None):
+    """Searches the available basemaps by keyword.
+
+    Args:
+        keyword (str): The keyword to search for in basemap names and attributions.
+        free_only (bool, optional): Exclude basemaps that need an API key. Defaults to False.
+        limit (int, optional): The maximum number of results. Defaults to None.
+
+    Returns:
+        list: The names of the matching basemaps.
+    """
+    return get_basemap_index().search(keyword, free_only=free_only, limit=limit)
+
+
+QMS_API = "https://qms.nextgis.com/api/v1/geoservices"
+
+
+def search_qms(keyword, limit=20):
+    """Searches the TMS basemaps of Quick Map Services (QMS).
+
+    Args:
+        keyword (str): The keyword to search for.
+        limit (int, optional): The maximum number of results. Defaults to 20.
+
+    Returns:
+        list: The names of the matching services, prefixed with "qms.".
+    """
+    from .common import get_client
+
+    response = get_client().get(
+        f"{QMS_API}/", params={"search": keyword, "type": "tms", "epsg": 3857, "limit": limit}
+    )
+    response.raise_for_status()
+    return [f"qms.{service['name']}" for service in response.json()["results"]]
+
+
+def get_qms_basemap(name):
+    """Returns the entry of a Quick Map Services basemap by name.
+
+    Args:
+        name (str): The service name, with or without the "qms." prefix.
+
+    Returns:
+        dict: The basemap entry with its "url", "attribution" and "max_zoom".
+    """
+    from .common import get_client
+
+    if name.startswith("qms."):
+        name = name[4:]
+    client = get_client()
+    response = client.get(f"{QMS_API}/", params={"search": name, "type": "tms", "epsg": 3857, "limit": 20})
+    response.raise_for_status()
+    matches = [s for s in response.json()["results"] if s["name"] == name]
+    if not matches:
+        raise ValueError(f"QMS basemap '{name}' not found.")
+
+    response = client.get(f"{QMS_API}/{matches[0]['id']}/", params={"format": "json"})
+    response.raise_for_status()
+    service = response.json()
+    return {
+        "name": f"qms.{service['name']}",
+        "url": service["url"],
+        "attribution": service.get("copyright_text") or "",
+        "max_zoom": service.get("z_max") or 18,
+        "tokens": [],
+    }
@@ -0,0 +1,309 @@
+"""Caches used by the tile servers and remote lookups."""
+
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread-safe least-recently-used cache bounded by the total size of its values.
+
+    Args:
+        max_bytes (int, optional): The maximum total size of the cached values. Defaults to 64 MiB.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns a cached value and marks it as recently used.
+
+        Args:
+            key (hashable): The cache key.
+            default (object, optional): The value to return on a miss. Defaults to None.
+
+        Returns:
+            object: The cached value, or ``default``.
+        """
+        with self._lock:
+            try:
+                value = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """Adds a value to the cache, evicting the least recently used values if needed.
+
+        Values larger than the cache itself are not stored.
+
+        Args:
+            key (hashable): The cache key.
+            value (bytes): The value to cache.
+        """
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= len(self._items.pop(key))
+            self._items[key] = value
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def clear(self):
+        """Removes all values from the cache."""
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
+
+
+def get_cache_dir(*parts):
+    """Returns a thinkgreen cache directory, creating it if needed.
+
+    The root defaults to ``~/.cache/thinkgreen`` and can be changed with the
+    ``THINKGREEN_CACHE_DIR`` environment variable.
+
+    Args:
+        parts (str): Subdirectories below the cache root.
+
+    Returns:
+        str: The path to the directory.
+    """
+    import os
+
+    root = os.environ.get("THINKGREEN_CACHE_DIR") or os.path.join(
+        os.path.expanduser("~"), ".cache", "thinkgreen"
+    )
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class TTLCache:
+    """A thread-safe cache of JSON values that expire, kept in memory and on disk.
+
+    Args:
+        ttl (float, optional): The time to live of the values in seconds. Defaults to 3600.
+        cache_dir (str, optional): The directory of the disk cache. Defaults to None (memory only).
+    """
+
+    def __init__(self, ttl=3600, cache_dir=None):
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        import hashlib
+        import os
+
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.json")
+
+    def get(self, key, default=None):
+        """Returns a value that has not expired yet.
+
+        Args:
+            key (str): The cache key.
+            default (object, optional): The value to return on a miss. Defaults to None.
+
+        Returns:
+            object: The cached value, or ``default``.
+        """
+        import json
+        import time
+
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+        if item is not None and item[0] > now:
+            return item[1]
+
+        if self.cache_dir is not None:
+            try:
+                with open(self._path(key)) as f:
+                    expires, value = json.load(f)
+            except (OSError, ValueError):
+                return default
+            if expires > now:
+                with self._lock:
+                    self._items[key] = (expires, value)
+                return value
+        return default
+
+    def put(self, key, value):
+        """Stores a JSON-serializable value.
+
+        Args:
+            key (str): The cache key.
+            value (object): The value to cache.
+        """
+        import json
+        import os
+        import time
+
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._items[key] = (expires, value)
+
+        if self.cache_dir is not None:
+            path = self._path(key)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "w") as f:
+                json.dump([expires, value], f)
+            os.replace(tmp, path)
+
+    def clear(self):
+        """Removes all values from memory (the disk cache is kept)."""
+        with self._lock:
+            self._items.clear()
+
+
+class DiskTileCache:
+    """A content-addressed tile cache on disk, bounded in bytes.
+
+    Tile contents are stored once per SHA-256 digest, so identical tiles
+    (e.g. empty ocean tiles) share storage. An SQLite index maps tile keys
+    to digests and tracks access times; when the stored contents exceed
+    ``max_bytes``, the least recently used tiles are evicted.
+
+    Args:
+        cache_dir (str, optional): The cache directory. Defaults to ``get_cache_dir("tiles")``.
+        max_bytes (int, optional): The maximum total size of the stored tiles. Defaults to 512 MiB.
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=512 * 1024 * 1024):
+        import os
+        import sqlite3
+
+        self.cache_dir = cache_dir or get_cache_dir("tiles")
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(self.cache_dir, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.cache_dir, "index.sqlite"), check_same_thread=False
+        )
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (key TEXT PRIMARY KEY, digest TEXT, atime REAL)"
+            )
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS tiles_atime ON tiles (atime)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS tiles_digest ON tiles (digest)")
+
+    def _object_path(self, digest):
+        import os
+
+        return os.path.join(self.cache_dir, "objects", digest[:2], digest)
+
+    @property
+    def nbytes(self):
+        """int: The total size of the stored tile contents."""
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def get(self, key):
+        """Returns a cached tile and updates its access time.
+
+        Args:
+            key (str): The tile key.
+
+        Returns:
+            bytes: The tile contents, or None if the tile is not cached.
+        """
+        import time
+
+        with self._lock:
+            row = self._db.execute("SELECT digest FROM tiles WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            with self._db:
+                self._db.execute("UPDATE tiles SET atime = ? WHERE key = ?", (time.time(), key))
+        try:
+            with open(self._object_path(row[0]), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def __contains__(self, key):
+        with self._lock:
+            return (
+                self._db.execute("SELECT 1 FROM tiles WHERE key = ?", (key,)).fetchone()
+                is not None
+            )
+
+    def put(self, key, data):
+        """Stores a tile, evicting the least recently used tiles if needed.
+
+        Args:
+            key (str): The tile key.
+            data (bytes): The tile contents.
+        """
+        import hashlib
+        import os
+        import time
+
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tiles (key, digest, atime) VALUES (?, ?, ?)",
+                (key, digest, time.time()),
+            )
+            self._db.execute(
+                "INSERT OR IGNORE INTO objects (digest, size) VALUES (?, ?)", (digest, len(data))
+            )
+            self._evict()
+
+    def _evict(self):
+        import os
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+        while total > self.max_bytes:
+            row = self._db.execute(
+                "SELECT key, digest FROM tiles ORDER BY atime LIMIT 1"
+            ).fetchone()
+            if row is None:
+                break
+            key, digest = row
+            self._db.execute("DELETE FROM tiles WHERE key = ?", (key,))
+            shared = self._db.execute(
+                "SELECT 1 FROM tiles WHERE digest = ? LIMIT 1", (digest,)
+            ).fetchone()
+            if shared is None:
+                size = self._db.execute(
+                    "SELECT size FROM objects WHERE digest = ?", (digest,)
+                ).fetchone()[0]
+                self._db.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+                try:
+                    os.remove(self._object_path(digest))
+                except OSError:
+                    pass
+                total -= size
@@ -0,0 +1,379 @@
+"""Renders charts to image bytes off the main thread, with a cache keyed by data and options."""
+
+import hashlib
+import inspect
+import threading
+
+from .cache import LRUCache
+
+CHART_KINDS = ("plot", "bar", "pie")
+
+_STYLES = {"plot": "_mpl-gallery", "bar": "_mpl-gallery", "pie": "_mpl-gallery-nogrid"}
+_TITLES = {"plot": "Plot", "bar": "Bar Graph", "pie": "Pie Chart"}
+
+_cache = LRUCache(64 * 1024 * 1024)
+_executor = None
+_lock = threading.Lock()
+_pending = {}
+
+
+def _get_executor():
+    global _executor
+
+    with _lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            # A single worker: matplotlib styles are applied through the global rcParams.
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thinkgreen-chart")
+        return _executor
+
+
+def chart_key(kind, x, y=None, **options):
+    """Returns the cache key of a chart, a hash of its data and options.
+
+    Args:
+        kind (str): The chart kind, one of "plot", "bar" or "pie".
+        x (array-like): The x values, or the wedge sizes of a pie chart.
+        y (array-like, optional): The y values. Defaults to None.
+        options: Keyword arguments for render_chart(); omitted ones count as their defaults.
+
+    Returns:
+        str: The hex digest.
+    """
+    import numpy as np
+
+    digest = hashlib.sha256(kind.encode("utf-8"))
+    for values in (x, y):
+        if values is None:
+            digest.update(b"\0")
+            continue
+        array = np.asarray(values)
+        digest.update(f"{array.dtype.str}{array.shape}".encode("utf-8"))
+        if array.dtype.hasobject:
+            digest.update(repr(array.tolist()).encode("utf-8"))
+        else:
+            digest.update(np.ascontiguousarray(array).tobytes())
+    options = {**_RENDER_DEFAULTS, **options}
+    digest.update(repr(sorted(options.items())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _as_float(values):
+    import numpy as np
+
+    values = np.asarray(values)
+    if values.dtype.kind in "mM":
+        return values.astype("int64").astype("float64")
+    return values.astype("float64")
+
+
+def lttb_indices(x, y, n_out):
+    """Selects the points of a line that best preserve its shape (Largest-Triangle-Three-Buckets).
+
+    The interior points are split into ``n_out - 2`` buckets. From each
+    bucket, the point forming the largest triangle with the previously
+    selected point and the mean of the next bucket is kept, along with the
+    first and last points. Each bucket is evaluated with vectorized NumPy, so
+    the Python loop runs once per output point.
+
+    Args:
+        x (array-like): The x values, sorted ascending. Datetimes are supported.
+        y (array-like): The y values.
+        n_out (int): The number of points to keep.
+
+    Returns:
+        numpy.ndarray: The indices of the selected points.
+    """
+    import numpy as np
+
+    n = len(y)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = _as_float(x)
+    y = _as_float(y)
+
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    counts = np.diff(edges)
+    next_x = np.append(np.add.reduceat(x[: n - 1], edges[:-1]) / counts, x[-1])[1:]
+    next_y = np.append(np.add.reduceat(y[: n - 1], edges[:-1]) / counts, y[-1])[1:]
+
+    indices = np.empty(n_out, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        area = np.abs(
+            (x[a] - next_x[b]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[b] - y[a])
+        )
+        a = lo + int(np.argmax(area))
+        indices[b + 1] = a
+    return indices
+
+
+def _bins(values, n_bins):
+    """Pads values with NaN and reshapes them into rows of consecutive samples."""
+    import numpy as np
+
+    n = len(values)
+    size = -(-n // n_bins)
+    rows = -(-n // size)
+    padded = np.full(rows * size, np.nan)
+    padded[:n] = values
+    return padded.reshape(rows, size), size
+
+
+def minmax_indices(y, n_bins):
+    """Selects the minimum and maximum of each bin of consecutive samples.
+
+    The selected points trace the envelope of the series, so spikes survive
+    downsampling.
+
+    Args:
+        y (array-like): The y values.
+        n_bins (int): The number of bins; at most ``2 * n_bins + 2`` points are kept.
+
+    Returns:
+        numpy.ndarray: The sorted indices of the selected points.
+    """
+    import numpy as np
+
+    n = len(y)
+    if 2 * n_bins >= n or n_bins < 1:
+        return np.arange(n)
+    rows, size = _bins(_as_float(y), n_bins)
+    valid = ~np.isnan(rows).all(axis=1)
+    offsets = np.arange(len(rows))[valid] * size
+    filled = rows[valid]
+    low = offsets + np.argmin(np.where(np.isnan(filled), np.inf, filled), axis=1)
+    high = offsets + np.argmax(np.where(np.isnan(filled), -np.inf, filled), axis=1)
+    return np.unique(np.concatenate(([0], low, high, [n - 1])))
+
+
+def bin_aggregate(x, y, n_bins, agg="mean"):
+    """Aggregates bins of consecutive samples, e.g. for bar charts.
+
+    Args:
+        x (array-like): The x values. Each bin is labelled with its middle x value.
+        y (array-like): The y values.
+        n_bins (int): The number of bins.
+        agg (str, optional): The aggregation, "mean", "sum", "min" or "max". Defaults to "mean".
+
+    Returns:
+        tuple: The (x, y) arrays of the bins.
+    """
+    import warnings
+
+    import numpy as np
+
+    functions = {"mean": np.nanmean, "sum": np.nansum, "min": np.nanmin, "max": np.nanmax}
+    if agg not in functions:
+        raise ValueError(f"agg must be one of {list(functions)}")
+    x = np.asarray(x)
+    n = len(x)
+    if n_bins >= n or n_bins < 1:
+        return x, np.asarray(y)
+    rows, size = _bins(_as_float(y), n_bins)
+    middles = np.minimum(np.arange(len(rows)) * size + size // 2, n - 1)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return x[middles], functions[agg](rows, axis=1)
+
+
+def downsample_series(x, y, max_points, method="lttb"):
+    """Reduces a series to about ``max_points`` points.
+
+    Args:
+        x (array-like): The x values, sorted ascending.
+        y (array-like): The y values.
+        max_points (int): The number of points to reduce the series to.
+        method (str, optional): "lttb", "minmax", or a bin aggregation ("mean", "sum", "min" or "max").
+            Defaults to "lttb".
+
+    Returns:
+        tuple: The downsampled (x, y) arrays.
+    """
+    import numpy as np
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) != len(y):
+        raise ValueError("x and y must have the same length.")
+    if len(y) <= max_points:
+        return x, y
+    if method == "lttb":
+        indices = lttb_indices(x, y, max_points)
+    elif method == "minmax":
+        indices = minmax_indices(y, max(max_points // 2 - 1, 1))
+    else:
+        return bin_aggregate(x, y, max_points, agg=method)
+    return x[indices], y[indices]
+
+
+def check_chart(kind, x, y=None, fmt="png"):
+    """Checks the arguments of a chart before it is rendered, raising ValueError if they are invalid.
+
+    Args:
+        kind (str): The chart kind, one of "plot", "bar" or "pie".
+        x (array-like): The x values, or the wedge sizes of a pie chart.
+        y (array-like, optional): The y values of line and bar charts. Defaults to None.
+        fmt (str, optional): The image format, "png" or "svg". Defaults to "png".
+    """
+    if kind not in CHART_KINDS:
+        raise ValueError(f"kind must be one of {list(CHART_KINDS)}")
+    if fmt not in ("png", "svg"):
+        raise ValueError("fmt must be 'png' or 'svg'")
+    if kind != "pie" and y is None:
+        raise ValueError(f"A {kind} chart requires y values.")
+    if y is not None and len(x) != len(y):
+        raise ValueError(f"x and y must have the same length, got {len(x)} and {len(y)}.")
+
+
+def render_chart(
+    kind,
+    x,
+    y=None,
+    fmt="png",
+    title=None,
+    xlabel="x",
+    ylabel="y",
+    figsize=(3, 2.5),
+    dpi=100,
+    max_points=None,
+    downsample="auto",
+):
+    """Renders a chart to image bytes without touching pyplot.
+
+    The figure is drawn on a standalone Agg canvas, so it is never shown or
+    registered with pyplot, and it is released as soon as it is saved.
+    Series longer than ``max_points`` are downsampled first, so the cost of
+    drawing depends on the output width rather than on the input size.
+
+    Args:
+        kind (str): The chart kind, one of "plot", "bar" or "pie".
+        x (array-like): The x values, or the wedge sizes of a pie chart.
+        y (array-like, optional): The y values of line and bar charts. Defaults to None.
+        fmt (str, optional): The image format, "png" or "svg". Defaults to "png".
+        title (str, optional): The chart title. Defaults to the name of the chart kind.
+        xlabel (str, optional): The x-axis label. Defaults to "x".
+        ylabel (str, optional): The y-axis label. Defaults to "y".
+        figsize (tuple, optional): The figure size in inches. Defaults to (3, 2.5).
+        dpi (int, optional): The resolution of PNG images. Defaults to 100.
+        max_points (int, optional): The length above which line and bar series are downsampled.
+            Defaults to the figure width in pixels.
+        downsample (str, optional): The downsampling method, see downsample_series(). Defaults to "auto":
+            "lttb" for line plots and "mean" for bar charts. None disables downsampling.
+
+    Returns:
+        bytes: The image.
+    """
+    import io
+
+    import numpy as np
+
+    import matplotlib
+    import matplotlib.style
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    check_chart(kind, x, y, fmt)
+
+    width = 1
+    if kind != "pie" and downsample is not None:
+        if max_points is None:
+            max_points = int(figsize[0] * dpi)
+        if downsample == "auto":
+            downsample = "lttb" if kind == "plot" else "mean"
+        if len(y) > max_points:
+            if kind == "bar":
+                max_points = max(max_points // 2, 1)
+            x, y = downsample_series(x, y, max_points, method=downsample)
+            if kind == "bar" and len(x) > 1 and np.asarray(x).dtype.kind in "iuf":
+                width = float(np.min(np.diff(x)))
+
+    with matplotlib.rc_context(matplotlib.style.library[_STYLES[kind]]):
+        fig = Figure(figsize=figsize, dpi=dpi, layout="constrained")
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        if kind == "plot":
+            ax.plot(x, y, linewidth=2.0)
+            ax.set(xlabel=xlabel, ylabel=ylabel)
+        elif kind == "bar":
+            ax.bar(x, y, width=width, edgecolor="white", linewidth=0.7)
+            ax.set(xlabel=xlabel, ylabel=ylabel)
+        else:
+            ax.pie(x, wedgeprops={"linewidth": 1, "edgecolor": "white"})
+        ax.set_title(_TITLES[kind] if title is None else title)
+
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format=fmt, dpi=dpi)
+    fig.clear()
+    return buffer.getvalue()
+
+
+_RENDER_DEFAULTS = {
+    name: param.default
+    for name, param in inspect.signature(render_chart).parameters.items()
+    if name not in ("kind", "x", "y")
+}
+
+
+def submit_chart(kind, x, y=None, **options):
+    """Renders a chart on the chart worker thread, or returns the cached render.
+
+    Requests for a chart that is already being rendered share its future.
+
+    Args:
+        kind (str): The chart kind, one of "plot", "bar" or "pie".
+        x (array-like): The x values, or the wedge sizes of a pie chart.
+        y (array-like, optional): The y values. Defaults to None.
+        options: Keyword arguments to pass to render_chart().
+
+    Returns:
+        concurrent.futures.Future: A future of the image bytes.
+    """
+    from concurrent.futures import Future
+
+    check_chart(kind, x, y, options.get("fmt", "png"))
+    key = chart_key(kind, x, y, **options)
+    data = _cache.get(key)
+    if data is not None:
+        future = Future()
+        future.set_result(data)
+        return future
+
+    def render():
+        try:
+            data = render_chart(kind, x, y, **options)
+            _cache.put(key, data)
+            return data
+        finally:
+            with _lock:
+                _pending.pop(key, None)
+
+    executor = _get_executor()
+    with _lock:
+        future = _pending.get(key)
+        if future is None:
+            future = _pending[key] = executor.submit(render)
+    return future
+
+
+def get_chart(kind, x, y=None, **options):
+    """Returns the image bytes of a chart, rendering it if it is not cached.
+
+    Args:
+        kind (str): The chart kind, one of "plot", "bar" or "pie".
+        x (array-like): The x values, or the wedge sizes of a pie chart.
+        y (array-like, optional): The y values. Defaults to None.
+        options: Keyword arguments to pass to render_chart().
+
+    Returns:
+        bytes: The image.
+    """
+    return submit_chart(kind, x, y, **options).result()
+
+
+def clear_cache():
+    """Removes all cached chart renders."""
+    _cache.clear()
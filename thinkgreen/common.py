@@ -0,0 +1,800 @@
+"""Common functions shared by the thinkgreen map backends."""
+
+import threading
+
+_client = None
+_executor = None
+_read_executor = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Returns the shared, connection-pooling HTTP client.
+
+    Returns:
+        httpx.Client: The HTTP client.
+    """
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            import httpx
+
+            _client = httpx.Client(
+                timeout=30,
+                follow_redirects=True,
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=32),
+            )
+        return _client
+
+
+def get_http_executor():
+    """Returns the shared thread pool used for concurrent HTTP requests.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: The thread pool.
+    """
+    global _executor
+
+    with _client_lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            _executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="thinkgreen-http")
+        return _executor
+
+
+def get_read_executor():
+    """Returns the shared thread pool used to read files off the kernel thread.
+
+    Returns:
+        concurrent.futures.ThreadPoolExecutor: The thread pool.
+    """
+    global _read_executor
+
+    with _client_lock:
+        if _read_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            _read_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="thinkgreen-read")
+        return _read_executor
+
+
+def read_csv_points(
+    in_csv,
+    x="longitude",
+    y="latitude",
+    columns=None,
+    dtype=None,
+    chunksize=100000,
+    **kwargs,
+):
+    """Reads point coordinates from a CSV file in chunks.
+
+    Only the coordinate columns and the requested attribute columns are parsed,
+    so memory use is bounded by ``chunksize`` rather than by the file size.
+
+    Args:
+        in_csv (str): The path to the CSV file.
+        x (str, optional): The column with longitudes. Defaults to "longitude".
+        y (str, optional): The column with latitudes. Defaults to "latitude".
+        columns (list, optional): Extra attribute columns to read. Defaults to None.
+        dtype (dict, optional): Dtypes for the attribute columns. Defaults to None.
+        chunksize (int, optional): The number of rows per chunk. Defaults to 100000.
+        kwargs: Keyword arguments to pass to pandas.read_csv.
+
+    Yields:
+        tuple: The longitudes and latitudes as float64 NumPy arrays, and a
+            DataFrame with the attribute columns of the same rows.
+    """
+    import numpy as np
+    import pandas as pd
+
+    columns = [c for c in (columns or []) if c not in (x, y)]
+    dtypes = {x: "float64", y: "float64"}
+    if dtype is not None:
+        dtypes.update(dtype)
+
+    with pd.read_csv(
+        in_csv, usecols=[x, y] + columns, dtype=dtypes, chunksize=chunksize, **kwargs
+    ) as reader:
+        for chunk in reader:
+            lon = chunk[x].to_numpy()
+            lat = chunk[y].to_numpy()
+            valid = np.isfinite(lon) & np.isfinite(lat)
+            if not valid.all():
+                lon, lat, chunk = lon[valid], lat[valid], chunk[valid]
+            yield lon, lat, chunk[columns]
+
+
+def sample_points(chunks, size, seed=0):
+    """Keeps a uniform random sample of the points of chunks, in their original order.
+
+    Each point gets a random key and the ``size`` points with the smallest
+    keys are kept, so at most ``size`` points and one chunk are in memory
+    at a time, whatever the number of points.
+
+    Args:
+        chunks (iterable): (lon, lat, DataFrame) chunks, e.g. from read_csv_points().
+        size (int): The number of points to keep.
+        seed (int, optional): The seed of the random keys. Defaults to 0.
+
+    Returns:
+        tuple: The longitudes, the latitudes, the DataFrame of attributes of the
+            kept points, and the number of points read.
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    keys = lons = lats = attrs = None
+    total = 0
+    for lon, lat, chunk in chunks:
+        total += len(lon)
+        if keys is None:
+            keys, lons, lats, attrs = rng.random(len(lon)), lon, lat, chunk.reset_index(drop=True)
+        else:
+            keys = np.concatenate([keys, rng.random(len(lon))])
+            lons, lats = np.concatenate([lons, lon]), np.concatenate([lats, lat])
+            attrs = pd.concat([attrs, chunk], ignore_index=True)
+        if len(keys) > size:
+            # The kept points stay in file order, as the indices are sorted.
+            keep = np.sort(np.argpartition(keys, size)[:size])
+            keys, lons, lats = keys[keep], lons[keep], lats[keep]
+            attrs = attrs.iloc[keep].reset_index(drop=True)
+    if keys is None:
+        return np.empty(0), np.empty(0), pd.DataFrame(), 0
+    return lons, lats, attrs, total
+
+
+def points_to_geojson(lon, lat, properties=None, precision=6):
+    """Builds a GeoJSON FeatureCollection from coordinate arrays.
+
+    Without properties, all points are packed into a single MultiPoint feature
+    so no per-point Python objects are created besides the coordinate pairs.
+
+    Args:
+        lon (numpy.ndarray): The longitudes.
+        lat (numpy.ndarray): The latitudes.
+        properties (pandas.DataFrame, optional): Per-point attributes. Defaults to None.
+        precision (int, optional): The number of decimals to keep. Defaults to 6.
+
+    Returns:
+        dict: The GeoJSON FeatureCollection.
+    """
+    import numpy as np
+
+    coords = np.round(np.column_stack((lon, lat)), precision).tolist()
+
+    if properties is None or properties.shape[1] == 0:
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "MultiPoint", "coordinates": coords},
+                "properties": {},
+            }
+        ]
+    else:
+        records = properties.to_dict(orient="records")
+        features = [
+            {
+                "type": "Feature",
+                "geometry": {"type": "Point", "coordinates": coord},
+                "properties": record,
+            }
+            for coord, record in zip(coords, records)
+        ]
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def csv_to_vector(
+    in_csv,
+    out_file,
+    out_format="geojson",
+    x="longitude",
+    y="latitude",
+    columns=None,
+    dtype=None,
+    chunksize=100000,
+    crs="EPSG:4326",
+    **kwargs,
+):
+    """Converts a CSV file with coordinates to a vector file, one batch at a time.
+
+    Each chunk is parsed into NumPy arrays, turned into point geometries in bulk
+    and appended to the output, so peak memory is bounded by ``chunksize``.
+    GeoParquet output can be read back with column projection, e.g.
+    ``geopandas.read_parquet(out_file, columns=["name", "geometry"])``.
+
+    Args:
+        in_csv (str): The path to the CSV file.
+        out_file (str): The path to the output file.
+        out_format (str, optional): One of "shapefile", "geojson" or "geoparquet". Defaults to "geojson".
+        x (str, optional): The column with longitudes. Defaults to "longitude".
+        y (str, optional): The column with latitudes. Defaults to "latitude".
+        columns (list, optional): The attribute columns to keep. Defaults to all columns.
+        dtype (dict, optional): Dtypes for the attribute columns. Defaults to None.
+        chunksize (int, optional): The number of rows per batch. Defaults to 100000.
+        crs (str, optional): The CRS of the coordinates. Defaults to "EPSG:4326".
+        kwargs: Keyword arguments to pass to pandas.read_csv.
+
+    Returns:
+        int: The number of points written.
+    """
+    import geopandas as gpd
+    import pandas as pd
+
+    drivers = {"shapefile": "ESRI Shapefile", "geojson": "GeoJSON", "geoparquet": None}
+    if out_format not in drivers:
+        raise ValueError(f"out_format must be one of {list(drivers)}")
+
+    if columns is None:
+        header = pd.read_csv(in_csv, nrows=0, **kwargs).columns
+        columns = [c for c in header if c not in (x, y)]
+    # Every batch must have the column types of the first one written.
+    dtype = _scan_csv_dtypes(in_csv, [c for c in columns if c not in (x, y)], dtype, chunksize, **kwargs)
+
+    writer = None
+    count = 0
+    try:
+        for lon, lat, attrs in read_csv_points(
+            in_csv, x, y, columns=columns, dtype=dtype, chunksize=chunksize, **kwargs
+        ):
+            gdf = gpd.GeoDataFrame(
+                attrs.reset_index(drop=True),
+                geometry=gpd.points_from_xy(lon, lat),
+                crs=crs,
+            )
+            if out_format == "geoparquet":
+                writer = _write_geoparquet_batch(writer, out_file, gdf)
+            elif out_format == "geojson":
+                writer = _write_geojson_batch(writer, out_file, gdf)
+            else:
+                gdf.to_file(out_file, driver=drivers[out_format], mode="a" if count else "w")
+            count += len(gdf)
+        if writer is None and out_format == "geojson":
+            writer = _write_geojson_batch(writer, out_file, None)
+    finally:
+        if writer is not None:
+            if out_format == "geojson":
+                writer.write("\n]}\n")
+            writer.close()
+
+    return count
+
+
+def _scan_csv_dtypes(in_csv, columns, dtype=None, chunksize=100000, **kwargs):
+    """Finds column dtypes that hold the values of every chunk of a CSV file.
+
+    pandas infers dtypes chunk by chunk, so a column of integers in the
+    first chunk may hold floats or text further down. The columns without
+    a dtype given are read once, and widened to the narrowest type of all
+    their chunks: integers to floats, and mixed or non-numeric columns to
+    strings. Types are never narrowed.
+
+    Args:
+        in_csv (str): The path to the CSV file.
+        columns (list): The attribute columns.
+        dtype (dict, optional): The dtypes given by the caller, kept as is. Defaults to None.
+        chunksize (int, optional): The number of rows per chunk. Defaults to 100000.
+        kwargs: Keyword arguments to pass to pandas.read_csv.
+
+    Returns:
+        dict: The dtypes of the columns.
+    """
+    import pandas as pd
+
+    dtypes = dict(dtype or {})
+    pending = [c for c in columns if c not in dtypes]
+    if not pending:
+        return dtypes
+
+    kinds, missing = {}, set()
+    with pd.read_csv(in_csv, usecols=pending, chunksize=chunksize, **kwargs) as reader:
+        for chunk in reader:
+            for column in pending:
+                series = chunk[column]
+                if series.isna().any():
+                    missing.add(column)
+                if series.isna().all():
+                    continue
+                kind = series.dtype.kind if series.dtype.kind in "bif" else "O"
+                previous = kinds.setdefault(column, kind)
+                if previous != kind:
+                    kinds[column] = "f" if {previous, kind} == {"i", "f"} else "O"
+
+    names = {"b": "bool", "i": "int64", "f": "float64", "O": "str"}
+    for column in pending:
+        # Columns without values are left to pandas, which reads them as floats.
+        if column not in kinds:
+            continue
+        kind = kinds[column]
+        if column in missing and kind in "bi":
+            # Missing values need floats for integers, and strings for booleans.
+            kind = "f" if kind == "i" else "O"
+        dtypes[column] = names[kind]
+    return dtypes
+
+
+def _write_geojson_batch(writer, out_file, gdf):
+    """Appends a GeoDataFrame batch to a GeoJSON FeatureCollection file.
+
+    GDAL rewrites GeoJSON files when appending, so features are serialized
+    in bulk and written to a plain text stream instead.
+
+    Args:
+        writer (file): The open output file, or None for the first batch.
+        out_file (str): The path to the output file.
+        gdf (geopandas.GeoDataFrame): The batch to write, or None to only open the file.
+
+    Returns:
+        file: The open output file to pass to the next call.
+    """
+    import shapely
+
+    first = writer is None
+    if first:
+        writer = open(out_file, "w", encoding="utf-8")
+        writer.write('{"type": "FeatureCollection", "features": [\n')
+    if gdf is None or len(gdf) == 0:
+        return writer
+
+    geometries = shapely.to_geojson(gdf.geometry.values)
+    attrs = gdf.drop(columns=gdf.geometry.name)
+    if attrs.shape[1]:
+        properties = attrs.to_json(orient="records", lines=True).splitlines()
+    else:
+        properties = ["{}"] * len(gdf)
+
+    if not first:
+        writer.write(",\n")
+    writer.write(
+        ",\n".join(
+            f'{{"type": "Feature", "properties": {p}, "geometry": {g}}}'
+            for p, g in zip(properties, geometries)
+        )
+    )
+    return writer
+
+
+def _write_geoparquet_batch(writer, out_file, gdf):
+    """Appends a GeoDataFrame batch to a GeoParquet file.
+
+    Args:
+        writer (pyarrow.parquet.ParquetWriter): The open writer, or None for the first batch.
+        out_file (str): The path to the output file.
+        gdf (geopandas.GeoDataFrame): The batch to write.
+
+    Returns:
+        pyarrow.parquet.ParquetWriter: The writer to pass to the next call.
+    """
+    import json
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import shapely
+
+    name = gdf.geometry.name
+    table = pa.Table.from_pandas(gdf.drop(columns=name), preserve_index=False)
+    table = table.append_column(name, pa.array(shapely.to_wkb(gdf.geometry.values), pa.binary()))
+
+    if writer is None:
+        geo = {
+            "version": "1.0.0",
+            "primary_column": name,
+            "columns": {
+                name: {
+                    "encoding": "WKB",
+                    "geometry_types": ["Point"],
+                    "crs": gdf.crs.to_json_dict() if gdf.crs else None,
+                }
+            },
+        }
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"geo"] = json.dumps(geo).encode("utf-8")
+        writer = pq.ParquetWriter(out_file, table.schema.with_metadata(metadata))
+
+    writer.write_table(table.cast(writer.schema))
+    return writer
+
+
+def iter_geojson_features(
+    in_geojson, bbox=None, properties=None, max_features=None, chunk_size=1 << 20
+):
+    """Iterates over the features of a GeoJSON file without loading the whole document.
+
+    The file is read in blocks and features are decoded one at a time from the
+    ``features`` array, so memory use is bounded by the largest feature.
+
+    Args:
+        in_geojson (str): The path to the GeoJSON file.
+        bbox (tuple, optional): Only yield features intersecting (minx, miny, maxx, maxy). Defaults to None.
+        properties (list, optional): The property names to keep. Defaults to all properties.
+        max_features (int, optional): Stop after this many features. Defaults to None.
+        chunk_size (int, optional): The number of characters read at a time. Defaults to 1 MiB.
+
+    Yields:
+        dict: The GeoJSON features.
+    """
+    count = 0
+    with open(in_geojson, "r", encoding="utf-8") as f:
+        for feature in _GeoJSONStream(f, chunk_size):
+            if bbox is not None and not _intersects(_feature_bounds(feature), bbox):
+                continue
+            if properties is not None:
+                props = feature.get("properties") or {}
+                feature["properties"] = {k: props[k] for k in properties if k in props}
+            yield feature
+            count += 1
+            if max_features is not None and count >= max_features:
+                return
+
+
+def read_geojson(in_geojson, bbox=None, properties=None, max_features=None):
+    """Reads the matching features of a GeoJSON file into a FeatureCollection.
+
+    Args:
+        in_geojson (str): The path to the GeoJSON file.
+        bbox (tuple, optional): Only keep features intersecting (minx, miny, maxx, maxy). Defaults to None.
+        properties (list, optional): The property names to keep. Defaults to all properties.
+        max_features (int, optional): Stop after this many features. Defaults to None.
+
+    Returns:
+        dict: The GeoJSON FeatureCollection.
+    """
+    features = list(
+        iter_geojson_features(
+            in_geojson, bbox=bbox, properties=properties, max_features=max_features
+        )
+    )
+    return {"type": "FeatureCollection", "features": features}
+
+
+class _GeoJSONStream:
+    """Incremental decoder for the features of a GeoJSON document."""
+
+    def __init__(self, f, chunk_size):
+        import json
+
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self, size=None):
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\n\r":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if self.eof:
+                return ""
+            self._fill()
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"Invalid GeoJSON: expected {char!r} at offset {self.pos}")
+        self.pos += 1
+
+    def _decode(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A value ending exactly at the buffer end may be truncated.
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            # Reading at least as much as is pending doubles the buffer on each retry, so the
+            # decoding restarted from the value start costs O(n) in total rather than O(n^2).
+            self._fill(max(self.chunk_size, len(self.buf) - self.pos))
+
+    def __iter__(self):
+        if self._peek() != "{":
+            yield from _as_features(self._decode())
+            return
+
+        self.pos += 1
+        header = {}
+        while True:
+            char = self._peek()
+            if char == "}":
+                break
+            if char == ",":
+                self.pos += 1
+                continue
+            key = self._decode()
+            self._expect(":")
+            if key != "features":
+                header[key] = self._decode()
+                continue
+            self._expect("[")
+            while True:
+                char = self._peek()
+                if char == "]":
+                    self.pos += 1
+                    break
+                if char == ",":
+                    self.pos += 1
+                    continue
+                yield self._decode()
+
+        if header.get("type") != "FeatureCollection":
+            yield from _as_features(header)
+
+
+def _as_features(obj):
+    """Yields the features of a parsed GeoJSON object of any type."""
+    kind = obj.get("type")
+    if kind == "FeatureCollection":
+        yield from obj.get("features", [])
+    elif kind == "Feature":
+        yield obj
+    elif kind is not None:
+        yield {"type": "Feature", "geometry": obj, "properties": {}}
+
+
+def _feature_bounds(feature):
+    """Returns the (minx, miny, maxx, maxy) bounds of a GeoJSON feature, or None."""
+    if "bbox" in feature:
+        # A 3D bbox is [minx, miny, minz, maxx, maxy, maxz].
+        bbox = feature["bbox"]
+        n = len(bbox) // 2
+        return bbox[0], bbox[1], bbox[n], bbox[n + 1]
+
+    xs, ys = [], []
+    stack = [feature.get("geometry")]
+    while stack:
+        geom = stack.pop()
+        if not geom:
+            continue
+        if geom.get("type") == "GeometryCollection":
+            stack.extend(geom.get("geometries", []))
+            continue
+        coords = [geom.get("coordinates")]
+        while coords:
+            item = coords.pop()
+            if not item:
+                continue
+            if isinstance(item[0], (int, float)):
+                xs.append(item[0])
+                ys.append(item[1])
+            else:
+                coords.extend(item)
+
+    if not xs:
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _intersects(bounds, bbox):
+    """Checks whether two (minx, miny, maxx, maxy) boxes intersect."""
+    if bounds is None:
+        return False
+    return not (
+        bounds[0] > bbox[2] or bounds[2] < bbox[0] or bounds[1] > bbox[3] or bounds[3] < bbox[1]
+    )
+
+
+def zoom_resolution(zoom, tile_size=256):
+    """Returns the size of a screen pixel in degrees at the given zoom level.
+
+    Args:
+        zoom (int): The zoom level.
+        tile_size (int, optional): The tile size in pixels. Defaults to 256.
+
+    Returns:
+        float: The pixel size in degrees of longitude.
+    """
+    return 360.0 / (tile_size * 2**zoom)
+
+
+def geojson_size(data):
+    """Returns the size of GeoJSON data once serialized to compact JSON.
+
+    Args:
+        data (dict): The GeoJSON data.
+
+    Returns:
+        int: The number of bytes.
+    """
+    import json
+
+    return len(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def simplify_by_zoom(data, zoom_levels=(0, 4, 8, 12, 16), tolerance=1.0):
+    """Builds simplified and quantized versions of vector data for a set of zoom levels.
+
+    For each zoom level, geometries are simplified with a tolerance of
+    ``tolerance`` screen pixels, and coordinates are rounded to the number of
+    decimals the zoom level can show. Polygon layers are simplified as a
+    coverage (shapely 2.1 or later), so neighbouring polygons keep sharing
+    their borders without gaps or overlaps; other layers are simplified
+    feature by feature, preserving the validity of each geometry.
+
+    Args:
+        data (dict | geopandas.GeoDataFrame): The GeoJSON data or GeoDataFrame, in EPSG:4326.
+        zoom_levels (tuple, optional): The zoom levels to build. Defaults to (0, 4, 8, 12, 16).
+        tolerance (float, optional): The simplification tolerance in pixels. Defaults to 1.0.
+
+    Returns:
+        dict: The GeoJSON data for each zoom level.
+    """
+    import math
+    import geopandas as gpd
+    import numpy as np
+    import shapely
+
+    if isinstance(data, dict):
+        if not data.get("features"):
+            return {zoom: data for zoom in zoom_levels}
+        gdf = gpd.GeoDataFrame.from_features(data["features"])
+    else:
+        gdf = data
+    geometries = gdf.geometry.values
+    attrs = gdf.drop(columns=gdf.geometry.name)
+
+    present = ~shapely.is_missing(geometries) & ~shapely.is_empty(geometries)
+    polygonal = np.isin(shapely.get_type_id(geometries[present]), (3, 6))
+    coverage = hasattr(shapely, "coverage_simplify") and present.any() and polygonal.all()
+
+    levels = {}
+    for zoom in sorted(zoom_levels):
+        resolution = zoom_resolution(zoom)
+        decimals = max(0, math.ceil(-math.log10(resolution / 4)))
+        if coverage:
+            simplified = np.array(geometries, dtype=object)
+            simplified[present] = shapely.coverage_simplify(geometries[present], resolution * tolerance)
+        else:
+            simplified = shapely.simplify(geometries, resolution * tolerance, preserve_topology=True)
+        simplified = shapely.transform(simplified, lambda c: np.round(c, decimals))
+        keep = ~shapely.is_empty(simplified)
+        level = gpd.GeoDataFrame(attrs[keep], geometry=simplified[keep])
+        levels[zoom] = level.to_geo_dict(drop_id=True)
+
+    return levels
+
+
+VECTOR_EXTENSIONS = (".shp", ".geojson", ".json", ".gpkg", ".fgb")
+
+
+def find_vector_files(path, pattern=None, recursive=False):
+    """Lists the vector files of a directory.
+
+    Args:
+        path (str): The directory.
+        pattern (str, optional): A glob pattern the file names must match, e.g. "roads_*.shp".
+            Defaults to any file with one of VECTOR_EXTENSIONS.
+        recursive (bool, optional): Whether to include subdirectories. Defaults to False.
+
+    Returns:
+        list: The sorted file paths.
+    """
+    import fnmatch
+    import os
+
+    if not os.path.isdir(path):
+        raise ValueError(f"{path} is not a directory.")
+    paths = []
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            if pattern is None:
+                if name.lower().endswith(VECTOR_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+            elif fnmatch.fnmatch(name, pattern):
+                paths.append(os.path.join(root, name))
+        if not recursive:
+            break
+    return sorted(paths)
+
+
+def _read_vector_file(task):
+    """Reads, reprojects and optionally simplifies one vector file, in a worker process."""
+    path, columns, simplify, zoom_levels = task
+    import geopandas as gpd
+
+    try:
+        gdf = gpd.read_file(path, columns=columns)
+    except Exception as e:
+        raise ValueError(f"Could not read {path}: {e}") from e
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    if not simplify:
+        return {"data": gdf.to_geo_dict(drop_id=True)}
+    levels = simplify_by_zoom(gdf, zoom_levels)
+    sizes = {
+        "original": geojson_size(gdf.__geo_interface__),
+        "levels": {zoom: geojson_size(level) for zoom, level in levels.items()},
+    }
+    # The GeoDataFrame is kept for the spatial index; it pickles far smaller than its GeoJSON.
+    return {"data": gdf, "levels": levels, "sizes": sizes}
+
+
+def read_vector_files(
+    paths,
+    columns=None,
+    simplify=False,
+    zoom_levels=(0, 4, 8, 12, 16),
+    processes=None,
+    max_tasks_per_child=32,
+    on_progress=None,
+):
+    """Reads vector files in parallel, reprojected to EPSG:4326.
+
+    Each file is read, reprojected and simplified in a worker process, one
+    file per worker at a time. At most two files per worker are queued, and
+    on Python 3.11 and later, workers are replaced after
+    ``max_tasks_per_child`` files, which bounds the memory of the workers
+    however many files there are.
+
+    Args:
+        paths (list): The file paths.
+        columns (list, optional): The attribute columns to read. Defaults to all columns.
+        simplify (bool, optional): Whether to simplify each file per zoom level, see simplify_by_zoom.
+            Defaults to False.
+        zoom_levels (tuple, optional): The zoom levels to simplify for. Defaults to (0, 4, 8, 12, 16).
+        processes (int, optional): The number of worker processes. Defaults to the number of CPUs.
+            0 or 1 reads in this process.
+        max_tasks_per_child (int, optional): The number of files a worker reads before it is replaced.
+            Ignored before Python 3.11, where workers are never replaced. Defaults to 32.
+        on_progress (callable, optional): Called with the number of files read, the number of files
+            and the path of the last file read. Defaults to None.
+
+    Returns:
+        list: For each path, a dict with the GeoJSON "data", or with simplify, the GeoDataFrame "data",
+            the GeoJSON "levels" by zoom level and their payload "sizes".
+    """
+    import multiprocessing
+    import os
+    import sys
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    tasks = [(path, columns, simplify, tuple(zoom_levels)) for path in paths]
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(tasks)))
+
+    results = [None] * len(tasks)
+    if processes == 1:
+        for i, task in enumerate(tasks):
+            results[i] = _read_vector_file(task)
+            if on_progress is not None:
+                on_progress(i + 1, len(tasks), task[0])
+        return results
+
+    # Spawned workers do not inherit the threads of the kernel or the map widgets.
+    options = {"mp_context": multiprocessing.get_context("spawn")}
+    if sys.version_info >= (3, 11):
+        options["max_tasks_per_child"] = max_tasks_per_child
+    with ProcessPoolExecutor(processes, **options) as executor:
+        pending = {}
+        queue = iter(enumerate(tasks))
+        done = 0
+        while True:
+            for i, task in queue:
+                pending[executor.submit(_read_vector_file, task)] = i
+                if len(pending) >= 2 * processes:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                i = pending.pop(future)
+                results[i] = future.result()
+                done += 1
+                if on_progress is not None:
+                    on_progress(done, len(tasks), tasks[i][0])
+    return results
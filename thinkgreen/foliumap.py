@@ -1,4 +1,7 @@
+import os
+
 import folium
+from folium.template import Template
 
 class Map(folium.Map):
     """Create a folium map object.
@@ -12,6 +15,8 @@ class Map(folium.Map):
             zoom (int, optional): The zoom level. Defaults to 2.
         """
         super().__init__(location=center, zoom_start=zoom, **kwargs)
+        self._managed_layers = {}
+        self._html = None
 
 
     def add_tile_layer(self, url, name, attribution="", **kwargs):
@@ -28,3 +33,522 @@ class Map(folium.Map):
             **kwargs
         )
         self.add_child(tile_layer)
+        return tile_layer
+
+    def add_basemap(self, basemap, **kwargs):
+        """Adds a basemap to the map.
+
+        Args:
+            basemap (str): The name of the basemap, e.g. "SATELLITE" or "OpenStreetMap.Mapnik".
+                See thinkgreen.search_basemaps().
+            kwargs: API keys for basemaps that need one (e.g. apikey="..."),
+                and keyword arguments to pass to the tile layer.
+
+        Returns:
+            folium.TileLayer: The tile layer.
+        """
+        from .basemaps import get_basemap
+
+        entry = get_basemap(basemap)
+        url = entry["url"]
+        for token in entry["tokens"]:
+            if token not in kwargs:
+                raise ValueError(f"Basemap '{basemap}' requires the '{token}' argument.")
+            url = url.replace("{%s}" % token, kwargs.pop(token))
+        return self.add_tile_layer(url, name=entry["name"], attribution=entry["attribution"], **kwargs)
+
+    def add_geojson(self, data, name="GeoJSON", encoding="json", precision=5, style=None, **kwargs):
+        """Adds a GeoJSON layer to the map.
+
+        With ``encoding="binary"``, the geometries are embedded as a compact
+        binary buffer of quantized, delta-encoded shared arcs (see
+        thinkgreen.topobuf) and decoded in the browser, which is typically
+        5-10x smaller than the GeoJSON text.
+
+        Args:
+            data (str | dict): The path to a GeoJSON file, or the GeoJSON data.
+            name (str, optional): The name of the layer. Defaults to "GeoJSON".
+            encoding (str, optional): "json" or "binary". Defaults to "json".
+            precision (int, optional): The decimal places kept with binary encoding. Defaults to 5.
+            style (dict, optional): The Leaflet path options of the features. Defaults to None.
+            kwargs: Keyword arguments to pass to folium.GeoJson, or to BinaryGeoJson.
+
+        Returns:
+            folium.map.Layer: The GeoJSON layer.
+        """
+        if encoding not in ("json", "binary"):
+            raise ValueError("encoding must be 'json' or 'binary'")
+        if isinstance(data, str):
+            from .common import read_geojson
+
+            data = read_geojson(data)
+
+        if encoding == "binary":
+            layer = BinaryGeoJson(data, name=name, precision=precision, style=style, **kwargs)
+        else:
+            if style is not None:
+                kwargs["style_function"] = lambda feature: style
+            layer = folium.GeoJson(data, name=name, **kwargs)
+        layer.add_to(self)
+        return layer
+
+    def add_gdf(self, gdf, name="GeoDataFrame", **kwargs):
+        """Adds a GeoDataFrame layer to the map.
+
+        Args:
+            gdf (geopandas.GeoDataFrame): The GeoDataFrame.
+            name (str, optional): The name of the layer. Defaults to "GeoDataFrame".
+            kwargs: Keyword arguments to pass to add_geojson.
+
+        Returns:
+            folium.map.Layer: The GeoJSON layer.
+        """
+        if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+            gdf = gdf.to_crs(epsg=4326)
+        return self.add_geojson(gdf.__geo_interface__, name=name, **kwargs)
+
+    def add_shp(self, data, name="Shapefile", **kwargs):
+        """Adds a Shapefile layer to the map.
+
+        Args:
+            data (str): The path to the Shapefile.
+            name (str, optional): The name of the layer. Defaults to "Shapefile".
+            kwargs: Keyword arguments to pass to add_geojson.
+
+        Returns:
+            folium.map.Layer: The GeoJSON layer.
+        """
+        import geopandas as gpd
+
+        return self.add_gdf(gpd.read_file(data), name=name, **kwargs)
+
+
+    def add_points(self, lon, lat, labels=None, name="Points", mode="canvas", radius=3, color="#3388ff", **kwargs):
+        """Adds a layer of many points, drawn in the browser from one compact array.
+
+        The coordinates are embedded as a single base64 Float32 array instead
+        of one marker per point. In "canvas" mode the points are drawn on
+        canvas tiles, which scales to millions of points; in "cluster" mode
+        markers are built client-side and grouped with Leaflet.markercluster.
+
+        Args:
+            lon (array-like): The longitudes.
+            lat (array-like): The latitudes.
+            labels (list, optional): A popup label for each point. Defaults to None.
+            name (str, optional): The name of the layer. Defaults to "Points".
+            mode (str, optional): "canvas" or "cluster". Defaults to "canvas".
+            radius (int, optional): The radius of the points in pixels, in canvas mode. Defaults to 3.
+            color (str, optional): The color of the points, in canvas mode. Defaults to "#3388ff".
+            kwargs: Keyword arguments to pass to FastPoints.
+
+        Returns:
+            FastPoints: The point layer.
+        """
+        layer = FastPoints(lon, lat, labels=labels, name=name, mode=mode, radius=radius, color=color, **kwargs)
+        layer.add_to(self)
+        return layer
+
+    def add_points_from_csv(
+        self,
+        in_csv,
+        x="longitude",
+        y="latitude",
+        label=None,
+        layer_name="Points",
+        dtype=None,
+        chunksize=100000,
+        **kwargs,
+    ):
+        """Adds the points of a CSV file as a fast point layer.
+
+        Args:
+            in_csv (str): The path to the CSV file.
+            x (str, optional): The column with longitudes. Defaults to "longitude".
+            y (str, optional): The column with latitudes. Defaults to "latitude".
+            label (str, optional): The column to show in popups. Defaults to None.
+            layer_name (str, optional): The name of the layer. Defaults to "Points".
+            dtype (dict, optional): Dtypes for the label column. Defaults to None.
+            chunksize (int, optional): The number of rows read at a time. Defaults to 100000.
+            kwargs: Keyword arguments to pass to add_points.
+
+        Returns:
+            FastPoints: The point layer.
+        """
+        import numpy as np
+
+        from .common import read_csv_points
+
+        lons, lats, labels = [], [], []
+        columns = [label] if label is not None else None
+        for lon, lat, attrs in read_csv_points(in_csv, x, y, columns=columns, dtype=dtype, chunksize=chunksize):
+            lons.append(lon)
+            lats.append(lat)
+            if label is not None:
+                labels.extend(attrs[label].astype(str).tolist())
+
+        return self.add_points(
+            np.concatenate(lons) if lons else np.zeros(0),
+            np.concatenate(lats) if lats else np.zeros(0),
+            labels=labels if label is not None else None,
+            name=layer_name,
+            **kwargs,
+        )
+
+    def set_layers(self, layers):
+        """Makes the layers managed by this method match ``layers``, keeping unchanged ones.
+
+        Layers are identified by key. Keys seen in an earlier call keep their
+        existing layer, new keys are built and added, and layers whose key is
+        gone are removed. In a Streamlit app, calling this on every rerun only
+        builds and encodes the layers that changed.
+
+        Args:
+            layers (dict): Maps keys to layers, or to functions without
+                arguments that return a layer (called only for new keys).
+
+        Returns:
+            dict: The managed layers by key.
+        """
+        for key in list(self._managed_layers):
+            if key not in layers:
+                layer = self._managed_layers.pop(key)
+                self._children.pop(layer.get_name(), None)
+        for key, layer in layers.items():
+            if key not in self._managed_layers:
+                layer = layer() if callable(layer) else layer
+                layer.add_to(self)
+                self._managed_layers[key] = layer
+        return dict(self._managed_layers)
+
+    def _fingerprint(self):
+        """Identifies the layers and controls of the map, to tell when it needs to be rendered again."""
+        from folium.elements import ElementAddToElement
+
+        children = tuple(
+            (name, id(child))
+            for name, child in self._children.items()
+            if not isinstance(child, ElementAddToElement)
+        )
+        return tuple(self.location or ()), self.options.get("zoom"), children
+
+    def to_html(self, **kwargs):
+        """Returns the HTML of the map, reusing the previous render if no layer was added or removed.
+
+        Changes made to a layer in place are not detected; replace the layer
+        (e.g. through set_layers) instead.
+
+        Args:
+            kwargs: Keyword arguments to pass to the render method.
+
+        Returns:
+            str: The HTML page.
+        """
+        fingerprint = self._fingerprint()
+        if self._html is None or self._html[0] != fingerprint:
+            self._html = (fingerprint, self._render(**kwargs))
+        return self._html[1]
+
+    def _render(self, **kwargs):
+        """Renders the map in a new figure.
+
+        Rendering adds the scripts of every element to the figure, and folium
+        never removes them, so the page is rendered in a fresh figure each time
+        to leave out layers that have since been removed.
+        """
+        from branca.element import Figure
+
+        parent = self._parent
+        figure = Figure()
+        if isinstance(parent, Figure):
+            figure = Figure(width=parent.width, height=parent.height)
+        figure.add_child(self)
+        try:
+            return figure.render(**kwargs)
+        finally:
+            self._parent = parent
+
+    def to_streamlit(self, width=None, height=600, scrolling=False, **kwargs):
+        """Renders the map in a Streamlit app.
+
+        The HTML is only rendered again when layers have been added or
+        removed. Otherwise the component receives the same page as in the
+        previous run, so Streamlit keeps the existing iframe.
+
+        Args:
+            width (int, optional): The width of the map in pixels. Defaults to None (the column width).
+            height (int, optional): The height of the map in pixels. Defaults to 600.
+            scrolling (bool, optional): Whether the map frame can scroll, for Streamlit versions
+                without st.iframe. Defaults to False.
+            kwargs: Keyword arguments to pass to the render method.
+
+        Returns:
+            streamlit.delta_generator.DeltaGenerator: The component.
+        """
+        import streamlit as st
+
+        html = self.to_html(**kwargs)
+        if hasattr(st, "iframe"):
+            return st.iframe(html, width=width or "stretch", height=height)
+
+        import streamlit.components.v1 as components
+
+        return components.html(html, width=width, height=height, scrolling=scrolling)
+
+    def save(self, outfile, close_file=True, chunk_size=3 * 1024 * 1024, **kwargs):
+        """Saves the map to an HTML file, streaming the embedded layer data.
+
+        The page is rendered with placeholders for the buffers of binary
+        layers, which are then base64-encoded and written in chunks, so the
+        whole page is never held in memory as one string.
+
+        Args:
+            outfile (str | file): The path, or a binary file object.
+            close_file (bool, optional): Whether to close the file afterwards. Defaults to True.
+            chunk_size (int, optional): The number of buffer bytes encoded per write. Defaults to 3 MiB.
+            kwargs: Keyword arguments to pass to the render method.
+        """
+        import base64
+        import re
+        import uuid
+
+        layers = [child for child in self._children.values() if isinstance(child, _EmbeddedData)]
+        token = uuid.uuid4().hex
+        for i, layer in enumerate(layers):
+            layer._placeholder = f"__thinkgreen_{token}_{i}__"
+        try:
+            html = self._render(**kwargs)
+        finally:
+            for layer in layers:
+                layer._placeholder = None
+
+        chunk_size = max(chunk_size - chunk_size % 3, 3)
+        fid = open(outfile, "wb") if isinstance(outfile, (str, bytes, os.PathLike)) else outfile
+        try:
+            parts = re.split(f"__thinkgreen_{token}_(\\d+)__", html)
+            for i, part in enumerate(parts):
+                if i % 2 == 0:
+                    fid.write(part.encode("utf-8"))
+                    continue
+                buffer = memoryview(layers[int(part)]._buffer)
+                for start in range(0, len(buffer), chunk_size):
+                    fid.write(base64.b64encode(buffer[start : start + chunk_size]))
+        finally:
+            if close_file:
+                fid.close()
+
+
+class _EmbeddedData:
+    """A mixin for layers that embed a binary buffer in the page as base64.
+
+    During Map.save the buffer is replaced by a placeholder, so the page can
+    be rendered without it and the buffer streamed to the file in chunks.
+    """
+
+    _placeholder = None
+
+    @property
+    def data(self):
+        """str: The base64 buffer, or its placeholder while the map is being saved."""
+        import base64
+
+        if self._placeholder is not None:
+            return self._placeholder
+        return base64.b64encode(self._buffer).decode("ascii")
+
+
+class BinaryGeoJson(_EmbeddedData, folium.map.Layer):
+    """A GeoJSON layer embedded as a thinkgreen.topobuf buffer and decoded in the browser.
+
+    Args:
+        data (dict | geopandas.GeoDataFrame): The GeoJSON data, or any object with a ``__geo_interface__``.
+        name (str, optional): The name of the layer. Defaults to None.
+        precision (int, optional): The number of decimal places kept in coordinates. Defaults to 5.
+        style (dict, optional): The Leaflet path options of the features. Defaults to None.
+        overlay (bool, optional): Whether the layer is an overlay. Defaults to True.
+        control (bool, optional): Whether the layer is listed in layer controls. Defaults to True.
+        show (bool, optional): Whether the layer is shown on opening. Defaults to True.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.geoJson(
+                thinkgreenTopobuf.decode("{{ this.data }}"),
+                {{ this.options|tojson }}
+            );
+        {% endmacro %}
+        """
+    )
+
+    def __init__(self, data, name=None, precision=5, style=None, overlay=True, control=True, show=True):
+        from .topobuf import encode
+
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "BinaryGeoJson"
+        self._buffer = encode(data, precision=precision)
+        self.options = {"style": style} if style else {}
+
+    def render(self, **kwargs):
+        from .topobuf import decoder_js
+
+        self.get_root().header.add_child(
+            folium.Element(f"<script>{decoder_js()}</script>"), name="thinkgreen_topobuf"
+        )
+        super().render(**kwargs)
+
+
+class FastPoints(_EmbeddedData, folium.elements.JSCSSMixin, folium.map.Layer):
+    """A layer of many points embedded as one base64 Float32 array.
+
+    In "canvas" mode, the points are sorted by longitude and drawn on canvas
+    tiles; each tile only visits the points in its longitude strip. Clicking
+    near a point opens its label. In "cluster" mode, markers are created in
+    the browser and added to a Leaflet.markercluster group in chunks.
+
+    Args:
+        lon (array-like): The longitudes.
+        lat (array-like): The latitudes.
+        labels (list, optional): A popup label for each point. Defaults to None.
+        name (str, optional): The name of the layer. Defaults to None.
+        mode (str, optional): "canvas" or "cluster". Defaults to "canvas".
+        radius (int, optional): The radius of the points in pixels, in canvas mode. Defaults to 3.
+        color (str, optional): The color of the points, in canvas mode. Defaults to "#3388ff".
+        overlay (bool, optional): Whether the layer is an overlay. Defaults to True.
+        control (bool, optional): Whether the layer is listed in layer controls. Defaults to True.
+        show (bool, optional): Whether the layer is shown on opening. Defaults to True.
+    """
+
+    _template = Template(
+        """
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = (function () {
+                var binary = atob("{{ this.data }}");
+                var bytes = new Uint8Array(binary.length);
+                for (var i = 0; i < binary.length; i++) {
+                    bytes[i] = binary.charCodeAt(i);
+                }
+                var coords = new Float32Array(bytes.buffer);
+                var n = coords.length / 2;
+                var labels = {{ this.labels|tojson }};
+                var options = {{ this.options|tojson }};
+
+                {% if this.mode == "cluster" %}
+                var layer = L.markerClusterGroup({chunkedLoading: true});
+                var markers = new Array(n);
+                for (var i = 0; i < n; i++) {
+                    markers[i] = L.marker([coords[2 * i + 1], coords[2 * i]], {index: i});
+                }
+                layer.addLayers(markers);
+                if (labels) {
+                    layer.on("click", function (e) {
+                        L.popup().setLatLng(e.latlng).setContent(String(labels[e.layer.options.index])).openOn(layer._map);
+                    });
+                }
+                return layer;
+                {% else %}
+                function firstAtOrEast(lng) {
+                    var lo = 0, hi = n;
+                    while (lo < hi) {
+                        var mid = (lo + hi) >> 1;
+                        if (coords[2 * mid] < lng) lo = mid + 1; else hi = mid;
+                    }
+                    return lo;
+                }
+
+                var layer = L.gridLayer({pane: "overlayPane"});
+                layer.createTile = function (tile) {
+                    var canvas = L.DomUtil.create("canvas", "leaflet-tile");
+                    var size = this.getTileSize();
+                    canvas.width = size.x;
+                    canvas.height = size.y;
+                    var map = this._map;
+                    var r = options.radius;
+                    var origin = L.point(tile.x * size.x, tile.y * size.y);
+                    var nw = map.unproject(origin.subtract([r, r]), tile.z);
+                    var se = map.unproject(origin.add(size).add([r, r]), tile.z);
+                    var ctx = canvas.getContext("2d");
+                    ctx.fillStyle = options.color;
+                    ctx.beginPath();
+                    for (var i = firstAtOrEast(nw.lng); i < n && coords[2 * i] <= se.lng; i++) {
+                        var lat = coords[2 * i + 1];
+                        if (lat > nw.lat || lat < se.lat) continue;
+                        var p = map.project([lat, coords[2 * i]], tile.z).subtract(origin);
+                        ctx.moveTo(p.x + r, p.y);
+                        ctx.arc(p.x, p.y, r, 0, 2 * Math.PI);
+                    }
+                    ctx.fill();
+                    return canvas;
+                };
+
+                if (labels) {
+                    var onClick = function (e) {
+                        var map = layer._map;
+                        var zoom = map.getZoom();
+                        var click = map.project(e.latlng, zoom);
+                        var tolerance = options.radius + 2;
+                        var west = map.unproject(click.subtract([tolerance, 0]), zoom).lng;
+                        var east = map.unproject(click.add([tolerance, 0]), zoom).lng;
+                        var best = -1, bestDistance = tolerance;
+                        for (var i = firstAtOrEast(west); i < n && coords[2 * i] <= east; i++) {
+                            var d = map.project([coords[2 * i + 1], coords[2 * i]], zoom).distanceTo(click);
+                            if (d <= bestDistance) {
+                                best = i;
+                                bestDistance = d;
+                            }
+                        }
+                        if (best >= 0) {
+                            L.popup().setLatLng([coords[2 * best + 1], coords[2 * best]])
+                                .setContent(String(labels[best])).openOn(map);
+                        }
+                    };
+                    layer.on("add", function () { layer._map.on("click", onClick); });
+                    layer.on("remove", function (e) { e.target._map && e.target._map.off("click", onClick); });
+                }
+                return layer;
+                {% endif %}
+            })();
+        {% endmacro %}
+        """
+    )
+
+    def __init__(
+        self,
+        lon,
+        lat,
+        labels=None,
+        name=None,
+        mode="canvas",
+        radius=3,
+        color="#3388ff",
+        overlay=True,
+        control=True,
+        show=True,
+    ):
+        import numpy as np
+
+        if mode not in ("canvas", "cluster"):
+            raise ValueError("mode must be 'canvas' or 'cluster'")
+
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "FastPoints"
+        self.mode = mode
+        self.options = {"radius": radius, "color": color}
+
+        lon = np.asarray(lon, dtype="float64")
+        lat = np.asarray(lat, dtype="float64")
+        if lon.shape != lat.shape:
+            raise ValueError("lon and lat must have the same length.")
+        if labels is not None and len(labels) != len(lon):
+            raise ValueError("labels must have one value per point.")
+
+        order = np.flatnonzero(np.isfinite(lon) & np.isfinite(lat))
+        if mode == "canvas":
+            order = order[np.argsort(lon[order], kind="stable")]
+        self._buffer = np.column_stack([lon[order], lat[order]]).astype("<f4").tobytes()
+        self.labels = [labels[i] for i in order.tolist()] if labels is not None else None
+
+        if mode == "cluster":
+            from folium.plugins import MarkerCluster
+
+            self.default_js = MarkerCluster.default_js
+            self.default_css = MarkerCluster.default_css
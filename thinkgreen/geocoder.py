@@ -0,0 +1,468 @@
+"""An offline geocoder over a local gazetteer of place names.
+
+build_gazetteer() turns a CSV or vector file of places into one index file,
+which a Gazetteer memory-maps, so opening it is instant and only the pages
+a search touches are read. The file holds:
+
+- the display names, coordinates and importance of the places;
+- the normalized names, and the rest of each name from every word on,
+  sorted, so the names starting with a prefix are one range found by
+  binary search (a flattened prefix trie);
+- for short prefixes matching many names, their most important places;
+- the postings of the byte trigrams of the normalized names, to find
+  names close to a misspelled query.
+
+Gazetteer.serve() answers searches from the shared localhost tile server
+with the JSON of Nominatim, so ``Map.add_search_control`` can use it in
+place of the public Nominatim service.
+
+Example:
+    >>> from thinkgreen.geocoder import build_gazetteer
+    >>> gazetteer = build_gazetteer("places.csv", name="name", details=["country"])
+    >>> gazetteer.search("new yo")[0]["display_name"]
+    'New York, United States'
+    >>> m.add_search_control(gazetteer=gazetteer)
+"""
+
+import itertools
+import json
+import re
+import unicodedata
+
+MAGIC = b"TGGAZ001"
+# Prefix ranges with more keys than this use the precomputed top places.
+LARGE_RANGE = 4096
+# The number of top places stored per short prefix.
+TOP_PLACES = 64
+# The longest prefix, in bytes, with precomputed top places.
+TOP_PREFIX_BYTES = 16
+# The number of word starts of a name that are indexed as prefixes.
+MAX_WORDS = 6
+# Trigrams with more postings than this are too common to help a fuzzy search.
+MAX_POSTINGS = 50000
+
+_WORD = re.compile(r"\w+")
+_CALLBACK = re.compile(r"^[\w.$]+$")
+_gazetteer_ids = itertools.count(1)
+
+
+def normalize(text):
+    """Normalizes a place name for matching: no accents, case folded, words separated by one space.
+
+    Args:
+        text (str): The name.
+
+    Returns:
+        str: The normalized name.
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(_WORD.findall(text))
+
+
+def _trigram_codes(data):
+    """Returns the codes of the byte trigrams of a buffer, as one int32 per position."""
+    import numpy as np
+
+    b = np.frombuffer(data, dtype=np.uint8).astype(np.int32)
+    if b.size < 3:
+        return np.empty(0, dtype=np.int32)
+    return (b[:-2] << 16) | (b[1:-1] << 8) | b[2:]
+
+
+def _write_index(path, arrays, meta):
+    """Writes named arrays to one file: a magic, a JSON header, and the arrays aligned to 64 bytes."""
+    import struct
+
+    header = {"meta": meta, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        header["arrays"][name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // 64) * 64
+    text = json.dumps(header).encode("utf-8")
+    start = -(-(len(MAGIC) + 8 + len(text)) // 64) * 64
+    with open(path, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(text)) + text)
+        f.write(b"\0" * (start - f.tell()))
+        for name, array in arrays.items():
+            f.write(array.tobytes())
+            f.write(b"\0" * (start + header["arrays"][name]["offset"] + -(-array.nbytes // 64) * 64 - f.tell()))
+    return start
+
+
+def _read_places(source, name, x, y, importance, details, layer, chunksize):
+    """Yields DataFrames of the places of a file or a DataFrame, with "name", "lon", "lat" and "importance"."""
+    import os
+
+    import numpy as np
+    import pandas as pd
+
+    columns = [name] + ([importance] if importance else []) + list(details or [])
+
+    def places(lon, lat, df):
+        labels = df[name].astype("string")
+        for column in details or []:
+            value = df[column].astype("string")
+            labels = labels.where(value.isna() | (value == ""), labels + ", " + value)
+        if importance:
+            weights = pd.to_numeric(df[importance], errors="coerce").fillna(0).to_numpy("float32")
+        else:
+            weights = np.zeros(len(df), dtype="float32")
+        keep = (labels.notna() & (labels != "")).to_numpy()
+        return pd.DataFrame(
+            {"name": labels[keep].tolist(), "lon": lon[keep], "lat": lat[keep], "importance": weights[keep]}
+        )
+
+    if isinstance(source, str) and os.path.splitext(source)[1].lower() == ".csv":
+        from .common import read_csv_points
+
+        for lon, lat, df in read_csv_points(source, x=x, y=y, columns=columns, chunksize=chunksize):
+            yield places(lon, lat, df)
+        return
+
+    if isinstance(source, pd.DataFrame) and not hasattr(source, "geometry"):
+        valid = source[x].notna() & source[y].notna()
+        df = source[valid]
+        yield places(df[x].to_numpy("float64"), df[y].to_numpy("float64"), df)
+        return
+
+    import geopandas as gpd
+
+    gdf = source if isinstance(source, gpd.GeoDataFrame) else gpd.read_file(source, layer=layer, columns=columns)
+    if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+        gdf = gdf.to_crs(epsg=4326)
+    gdf = gdf[gdf.geometry.notna() & ~gdf.geometry.is_empty]
+    for start in range(0, len(gdf), chunksize):
+        chunk = gdf.iloc[start : start + chunksize]
+        points = chunk.geometry.representative_point()
+        yield places(points.x.to_numpy(), points.y.to_numpy(), chunk)
+
+
+def build_gazetteer(
+    source,
+    path=None,
+    name="name",
+    x="longitude",
+    y="latitude",
+    importance=None,
+    details=None,
+    layer=None,
+    chunksize=100000,
+):
+    """Builds a gazetteer index file from a table of places.
+
+    Args:
+        source (str | pandas.DataFrame | geopandas.GeoDataFrame): A CSV file with coordinate columns,
+            a GeoPackage or another vector file, or the data itself. Polygons and lines are placed
+            at a point inside them.
+        path (str, optional): The index file to write. Defaults to a file named after the source in
+            the "geocoder" cache directory.
+        name (str, optional): The column with the place names. Defaults to "name".
+        x (str, optional): The column with longitudes, for CSV files and DataFrames. Defaults to "longitude".
+        y (str, optional): The column with latitudes, for CSV files and DataFrames. Defaults to "latitude".
+        importance (str, optional): A numeric column ranking places, e.g. the population. The most
+            important places are listed first. Defaults to None.
+        details (list, optional): Columns appended to the displayed names, e.g. ["state", "country"].
+            Defaults to None.
+        layer (str, optional): The layer to read from a GeoPackage. Defaults to the first layer.
+        chunksize (int, optional): The number of rows read at once. Defaults to 100000.
+
+    Returns:
+        Gazetteer: The gazetteer, opened from the new file.
+    """
+    import os
+
+    import numpy as np
+
+    if path is None:
+        from .cache import get_cache_dir
+
+        stem = os.path.splitext(os.path.basename(source))[0] if isinstance(source, str) else "gazetteer"
+        path = os.path.join(get_cache_dir("geocoder"), f"{stem}.gaz")
+
+    labels, lon, lat, weights = [], [], [], []
+    for df in _read_places(source, name, x, y, importance, details, layer, chunksize):
+        labels.extend(df["name"])
+        lon.append(df["lon"].to_numpy("float64"))
+        lat.append(df["lat"].to_numpy("float64"))
+        weights.append(df["importance"].to_numpy("float32"))
+    if not labels:
+        raise ValueError(f"No places found in {source}.")
+    coords = np.column_stack([np.concatenate(lat), np.concatenate(lon)])
+    weights = np.concatenate(weights)
+
+    def blob(items):
+        encoded = [item.encode("utf-8") for item in items]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(item) for item in encoded], out=offsets[1:])
+        return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+    names, name_offsets = blob(labels)
+    normalized = [normalize(label) for label in labels]
+    del labels
+
+    # The prefix keys: each normalized name from each of its first words on.
+    keys, key_ids = [], []
+    for i, text in enumerate(normalized):
+        if not text:
+            continue
+        starts = [0] + [m.end() for m in itertools.islice(re.finditer(" ", text), MAX_WORDS - 1)]
+        keys.extend(text[start:].encode("utf-8") for start in starts)
+        key_ids.extend([i] * len(starts))
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    keys = [keys[i] for i in order]
+    key_ids = np.asarray(key_ids, dtype=np.int32)[order]
+    key_blob = np.frombuffer(b"".join(keys), dtype=np.uint8)
+    key_offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum([len(key) for key in keys], out=key_offsets[1:])
+
+    # The top places of the prefixes with many keys, found one byte deeper
+    # at a time inside the ranges that were still large: the large trie nodes.
+    top_prefixes, top_ids = [], []
+    ranges = [(0, len(keys))]
+    for length in range(1, TOP_PREFIX_BYTES + 1):
+        large = []
+        for begin, end in ranges:
+            start = begin
+            for prefix, group in itertools.groupby(keys[i][:length] for i in range(begin, end)):
+                count = sum(1 for _ in group)
+                if count > LARGE_RANGE and len(prefix) == length:
+                    ids = key_ids[start : start + count]
+                    ranked = ids[np.argsort(-weights[ids], kind="stable")]
+                    unique = np.asarray(list(dict.fromkeys(ranked.tolist()))[:TOP_PLACES], dtype=np.int32)
+                    top_prefixes.append(prefix)
+                    top_ids.append(np.pad(unique, (0, TOP_PLACES - len(unique)), constant_values=-1))
+                    large.append((start, start + count))
+                start += count
+        ranges = large
+    del keys
+    top_prefixes = np.asarray(top_prefixes, dtype=f"S{TOP_PREFIX_BYTES}")
+    top_order = np.argsort(top_prefixes, kind="stable")
+    top_prefixes = top_prefixes[top_order]
+    top_ids = np.asarray(top_ids, dtype=np.int32).reshape(-1, TOP_PLACES)[top_order]
+
+    # The trigram postings, from the names padded with a leading space so word starts count.
+    padded, padded_offsets = blob(" " + text for text in normalized)
+    del normalized
+    codes = _trigram_codes(padded.tobytes())
+    ends = np.repeat(padded_offsets[1:], np.diff(padded_offsets))[: codes.size]
+    valid = np.arange(codes.size) + 2 < ends
+    entry_ids = np.repeat(np.arange(len(padded_offsets) - 1, dtype=np.int64), np.diff(padded_offsets))[: codes.size]
+    pairs = np.unique((codes[valid].astype(np.int64) << 32) | entry_ids[valid])
+    del codes, ends, valid, entry_ids
+    gram_codes, gram_starts = np.unique(pairs >> 32, return_index=True)
+    gram_offsets = np.append(gram_starts, pairs.size).astype(np.int64)
+    postings = (pairs & 0xFFFFFFFF).astype(np.int32)
+    del pairs
+
+    arrays = {
+        "names": names,
+        "name_offsets": name_offsets,
+        "coords": coords,
+        "importance": weights,
+        "keys": key_blob,
+        "key_offsets": key_offsets,
+        "key_ids": key_ids,
+        "top_prefixes": top_prefixes,
+        "top_ids": top_ids,
+        "gram_codes": gram_codes.astype(np.int32),
+        "gram_offsets": gram_offsets,
+        "postings": postings,
+    }
+    tmp = path + ".tmp"
+    _write_index(tmp, arrays, {"count": int(len(weights)), "source": str(source) if isinstance(source, str) else None})
+    os.replace(tmp, path)
+    return Gazetteer(path)
+
+
+class Gazetteer:
+    """Searches a gazetteer index file written by build_gazetteer(), memory-mapped.
+
+    Args:
+        path (str): The index file.
+    """
+
+    def __init__(self, path):
+        import mmap
+        import os
+        import struct
+
+        import numpy as np
+
+        path = os.path.expanduser(path)
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[: len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{path} is not a gazetteer index.")
+        (size,) = struct.unpack("<Q", self._mmap[len(MAGIC) : len(MAGIC) + 8])
+        header = json.loads(self._mmap[len(MAGIC) + 8 : len(MAGIC) + 8 + size])
+        start = -(-(len(MAGIC) + 8 + size) // 64) * 64
+        self.meta = header["meta"]
+        self._offsets = {}
+        arrays = {}
+        for name, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"]))
+            self._offsets[name] = start + spec["offset"]
+            arrays[name] = np.frombuffer(
+                self._mmap, dtype=dtype, count=count, offset=start + spec["offset"]
+            ).reshape(spec["shape"])
+        self._arrays = arrays
+        self._key_offsets = arrays["key_offsets"]
+        self._key_ids = arrays["key_ids"]
+        self._importance = arrays["importance"]
+        self._url = None
+
+    def __len__(self):
+        return self.meta["count"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        """Unregisters the search endpoint and closes the index file."""
+        if self._url is not None:
+            from .tileserver import get_server
+
+            get_server().unregister(self._prefix)
+            self._url = None
+        self._arrays = self._key_offsets = self._key_ids = self._importance = None
+        self._mmap.close()
+
+    def _key(self, i):
+        base = self._offsets["keys"]
+        return self._mmap[base + self._key_offsets[i] : base + self._key_offsets[i + 1]]
+
+    def _lower_bound(self, prefix):
+        lo, hi = 0, len(self._key_ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _prefix_ids(self, prefix, limit):
+        """Returns the most important places with a word starting with the prefix, most important first."""
+        import numpy as np
+
+        # No UTF-8 byte is 0xff, so this bounds every key starting with the prefix.
+        lo, hi = self._lower_bound(prefix), self._lower_bound(prefix + b"\xff")
+        if hi - lo > LARGE_RANGE and len(prefix) <= TOP_PREFIX_BYTES and limit <= TOP_PLACES:
+            prefixes = self._arrays["top_prefixes"]
+            row = np.searchsorted(prefixes, prefix)
+            if row < prefixes.size and prefixes[row] == prefix:
+                ids = self._arrays["top_ids"][row]
+                return ids[ids >= 0][:limit].tolist()
+        ids = self._key_ids[lo:hi]
+        weights = self._importance[ids]
+        if ids.size > LARGE_RANGE and limit * MAX_WORDS < ids.size:
+            # Each place has at most MAX_WORDS keys, so this keeps at least `limit` places.
+            best = np.argpartition(-weights, limit * MAX_WORDS)[: limit * MAX_WORDS]
+            best = best[np.argsort(best)]
+            ids, weights = ids[best], weights[best]
+        ranked = ids[np.argsort(-weights, kind="stable")]
+        return list(dict.fromkeys(ranked.tolist()))[:limit]
+
+    def _fuzzy_ids(self, text, limit):
+        """Returns the places sharing the most trigrams with a name, for misspelled queries."""
+        import numpy as np
+
+        codes = np.unique(_trigram_codes((" " + text).encode("utf-8")))
+        gram_codes, gram_offsets = self._arrays["gram_codes"], self._arrays["gram_offsets"]
+        rows = np.searchsorted(gram_codes, codes)
+        rows = rows[(rows < gram_codes.size) & (gram_codes[np.minimum(rows, gram_codes.size - 1)] == codes)]
+        if not rows.size:
+            return []
+        sizes = gram_offsets[rows + 1] - gram_offsets[rows]
+        rows, sizes = rows[sizes <= MAX_POSTINGS], sizes[sizes <= MAX_POSTINGS]
+        # The rarest trigrams are the most selective; stop once the postings get large.
+        order = np.argsort(sizes)
+        rows = rows[order][np.cumsum(sizes[order]) <= MAX_POSTINGS]
+        if not rows.size:
+            return []
+        postings = self._arrays["postings"]
+        ids, counts = np.unique(
+            np.concatenate([postings[gram_offsets[r] : gram_offsets[r + 1]] for r in rows]), return_counts=True
+        )
+        keep = counts * 2 >= len(rows)
+        ids, counts = ids[keep], counts[keep]
+        order = np.lexsort((-self._importance[ids], -counts))
+        return ids[order][:limit].tolist()
+
+    def place(self, i):
+        """Returns a place as a Nominatim search result.
+
+        Args:
+            i (int): The place index.
+
+        Returns:
+            dict: The "place_id", "display_name", "lat", "lon" and "importance" of the place.
+        """
+        offsets = self._arrays["name_offsets"]
+        base = self._offsets["names"]
+        lat, lon = self._arrays["coords"][i]
+        return {
+            "place_id": int(i),
+            "display_name": self._mmap[base + offsets[i] : base + offsets[i + 1]].decode("utf-8"),
+            "lat": repr(float(lat)),
+            "lon": repr(float(lon)),
+            "importance": float(self._importance[i]),
+        }
+
+    def search(self, query, limit=10, fuzzy=True):
+        """Finds the places whose name, or a word of it onwards, starts with the query.
+
+        Matching ignores case, accents and punctuation. Places are ranked by
+        importance. With ``fuzzy``, when no name matches, the names sharing
+        the most trigrams with the query are returned instead, so misspelled
+        queries still find places.
+
+        Args:
+            query (str): The text typed so far.
+            limit (int, optional): The maximum number of places. Defaults to 10.
+            fuzzy (bool, optional): Whether to fall back to close names. Defaults to True.
+
+        Returns:
+            list: The places as Nominatim search results, see place().
+        """
+        text = normalize(query)
+        if not text or limit <= 0:
+            return []
+        ids = self._prefix_ids(text.encode("utf-8"), limit)
+        if fuzzy and not ids and len(text) >= 3:
+            ids = self._fuzzy_ids(text, limit)
+        return [self.place(i) for i in ids]
+
+    def serve(self):
+        """Serves searches from the shared localhost tile server, as the Nominatim search API.
+
+        The endpoint takes the ``q`` and ``limit`` parameters, and wraps the
+        results in the function named by ``json_callback`` for JSONP.
+
+        Returns:
+            str: The search URL template, with {s} for the query, as expected by ipyleaflet.SearchControl.
+        """
+        from .tileserver import get_server
+
+        if self._url is None:
+
+            def handler(segments, query):
+                if segments != ["search"]:
+                    return None
+                limit = int(query.get("limit", 10))
+                body = json.dumps(self.search(query.get("q", ""), limit=min(limit, 50)))
+                callback = query.get("json_callback")
+                if callback is not None and _CALLBACK.match(callback):
+                    return f"{callback}({body});".encode("utf-8"), "application/javascript"
+                return body.encode("utf-8"), "application/json"
+
+            self._prefix = f"geocoder/{next(_gazetteer_ids)}"
+            self._url = get_server().register(self._prefix, handler) + "/search?format=json&q={s}"
+        return self._url
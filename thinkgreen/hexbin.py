@@ -0,0 +1,428 @@
+"""Aggregation of large point sets into hexagon or square grids for display.
+
+A BinPyramid bins points into a grid whose cells keep the same size on
+screen at every zoom level, so the number of cells drawn depends on the
+size of the map, not on the number of points. The coarse levels, which
+cover the whole data with few cells, are computed for all points up
+front. Deeper levels are computed tile by tile, only for the tiles in
+view, and cached: the points are sorted by the Morton code of their tile
+at INDEX_ZOOM, so the points of any tile are one contiguous slice.
+
+Cells keep a count and, as agg needs, the sum, min or max of the values,
+which merge exactly, so a cell straddling tiles is combined from the
+partial results of each.
+"""
+
+import functools
+import math
+import threading
+from collections import OrderedDict
+
+from .tileserver import ORIGIN_SHIFT, tiles_in_bounds
+
+AGGREGATIONS = ("count", "sum", "mean", "min", "max")
+# The zoom level of the tile index the points are sorted by.
+INDEX_ZOOM = 16
+# The number of points binned at a time, small enough for their temporaries to stay in cache.
+CHUNK_SIZE = 2**18
+# The largest dense array of cells used to aggregate; larger extents are aggregated by sorting.
+DENSE_CELLS = 4 * 1024 * 1024
+
+
+def lnglat_to_mercator(lon, lat):
+    """Projects longitudes and latitudes to Web Mercator (EPSG:3857) meters.
+
+    Args:
+        lon (numpy.ndarray): The longitudes.
+        lat (numpy.ndarray): The latitudes, clipped to the Web Mercator range.
+
+    Returns:
+        tuple: The x and y arrays.
+    """
+    import numpy as np
+
+    lat = np.clip(lat, -85.0511287798, 85.0511287798)
+    x = np.asarray(lon, dtype="float64") * (ORIGIN_SHIFT / 180.0)
+    y = np.log(np.tan((90.0 + lat) * (math.pi / 360.0))) * (ORIGIN_SHIFT / math.pi)
+    return x, y
+
+
+def mercator_to_lnglat(x, y):
+    """Converts Web Mercator (EPSG:3857) meters to longitudes and latitudes.
+
+    Args:
+        x (numpy.ndarray): The x coordinates.
+        y (numpy.ndarray): The y coordinates.
+
+    Returns:
+        tuple: The longitude and latitude arrays.
+    """
+    import numpy as np
+
+    lon = x * (180.0 / ORIGIN_SHIFT)
+    lat = np.degrees(2 * np.arctan(np.exp(y * (math.pi / ORIGIN_SHIFT))) - math.pi / 2)
+    return lon, lat
+
+
+def view_bounds(center, zoom, width=1024, height=512):
+    """Returns the bounds of a map view, for maps whose frontend has not reported them yet.
+
+    Args:
+        center (tuple): The (latitude, longitude) center of the view.
+        zoom (float): The zoom level.
+        width (int, optional): The width of the view in pixels. Defaults to 1024.
+        height (int, optional): The height of the view in pixels. Defaults to 512.
+
+    Returns:
+        tuple: The ((south, west), (north, east)) bounds.
+    """
+    import numpy as np
+
+    x, y = lnglat_to_mercator(np.array([center[1]]), np.array([center[0]]))
+    half = ORIGIN_SHIFT / (256 * 2**zoom)
+    lon, lat = mercator_to_lnglat(
+        np.array([x[0] - width * half, x[0] + width * half]),
+        np.clip([y[0] - height * half, y[0] + height * half], -ORIGIN_SHIFT, ORIGIN_SHIFT),
+    )
+    return (float(lat[0]), float(lon[0])), (float(lat[1]), float(lon[1]))
+
+
+@functools.lru_cache(maxsize=None)
+def _spread_table():
+    """Returns the 16 bit integers with their bits spread to the even bits, for Morton codes."""
+    import numpy as np
+
+    v = np.arange(2**16, dtype=np.uint64)
+    for shift, mask in ((8, 0x00FF00FF), (4, 0x0F0F0F0F), (2, 0x33333333), (1, 0x55555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v
+
+
+def _morton(tx, ty):
+    """Returns the Morton codes of tiles up to INDEX_ZOOM, interleaving the bits of their x and y."""
+    import numpy as np
+
+    table = _spread_table()
+    return table[tx] | (table[ty] << np.uint64(1))
+
+
+def _reduce(q, r, count=None, total=None, low=None, high=None):
+    """Aggregates values by cell.
+
+    Takes either points, without counts, or partial cell results to merge.
+    Returns the cells and their count, sum, min and max; the last three are
+    only computed when given, and None otherwise.
+    """
+    import numpy as np
+
+    if q.size == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return (empty, empty, empty, *(None if v is None else np.empty(0) for v in (total, low, high)))
+    q0, r0 = q.min(), r.min()
+    width = int(q.max() - q0) + 1
+    size = width * (int(r.max() - r0) + 1)
+    if size <= DENSE_CELLS:
+        index = (r - r0) * width + (q - q0)
+        counts = np.bincount(index, weights=count, minlength=size)
+        cells = pick = np.flatnonzero(counts)
+    else:
+        cells, index = np.unique((r - r0) * width + (q - q0), return_inverse=True)
+        size = cells.size
+        counts = np.bincount(index, weights=count, minlength=size)
+        pick = slice(None)
+    result = [cells % width + q0, cells // width + r0, counts[pick].astype(np.int64)]
+    result.append(None if total is None else np.bincount(index, weights=total, minlength=size)[pick])
+    for values, ufunc, start in ((low, np.minimum, np.inf), (high, np.maximum, -np.inf)):
+        if values is None:
+            result.append(None)
+            continue
+        out = np.full(size, start)
+        ufunc.at(out, index, values)
+        result.append(out[pick])
+    return tuple(result)
+
+
+def _merge(parts):
+    """Merges partial cell results, as returned by _reduce."""
+    import numpy as np
+
+    parts = [part for part in parts if part[0].size] or parts[:1]
+    if len(parts) == 1:
+        return parts[0]
+    columns = zip(*parts)
+    return _reduce(*(np.concatenate(column) if column[0] is not None else None for column in columns))
+
+
+class BinPyramid:
+    """Bins points into grids sized for each zoom level.
+
+    Args:
+        lon (numpy.ndarray): The longitudes of the points.
+        lat (numpy.ndarray): The latitudes of the points.
+        values (numpy.ndarray, optional): A value per point to aggregate. Defaults to None.
+        agg (str, optional): How cells aggregate: "count" of points, or the "sum", "mean", "min" or
+            "max" of their values. Defaults to "count".
+        kind (str, optional): "hex" for hexagons or "square" for squares. Defaults to "hex".
+        cell_size (float, optional): The width of a cell in screen pixels. Defaults to 24.
+        pyramid_zoom (int, optional): The deepest zoom level binned for all points up front.
+            Defaults to 6.
+        max_tiles (int, optional): The number of binned tiles of deeper levels kept in memory.
+            Defaults to 4096.
+    """
+
+    def __init__(
+        self, lon, lat, values=None, agg="count", kind="hex", cell_size=24, pyramid_zoom=6, max_tiles=4096
+    ):
+        import numpy as np
+
+        if kind not in ("hex", "square"):
+            raise ValueError('kind must be "hex" or "square"')
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"agg must be one of {', '.join(AGGREGATIONS)}")
+        if agg == "count":
+            values = None
+        elif values is None:
+            raise ValueError(f'agg="{agg}" needs values')
+        lon, lat = np.asarray(lon, dtype="float64"), np.asarray(lat, dtype="float64")
+        valid = np.isfinite(lon) & np.isfinite(lat)
+        if values is not None:
+            values = np.asarray(values, dtype="float64")
+            valid &= np.isfinite(values)
+        x, y = lnglat_to_mercator(lon[valid], lat[valid])
+
+        n = 2**INDEX_ZOOM
+        tx = np.clip(((x + ORIGIN_SHIFT) * (n / (2 * ORIGIN_SHIFT))).astype(np.int64), 0, n - 1)
+        ty = np.clip(((ORIGIN_SHIFT - y) * (n / (2 * ORIGIN_SHIFT))).astype(np.int64), 0, n - 1)
+        keys = _morton(tx, ty)
+        del tx, ty
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.x, self.y = x[order], y[order]
+        self.values = values[valid][order] if values is not None else None
+        self.agg = agg
+        self.kind = kind
+        self.cell_size = cell_size
+        self.pyramid_zoom = pyramid_zoom
+        self.max_tiles = max_tiles
+        self._tiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.levels = {zoom: self._bin(zoom, 0, len(self.keys)) for zoom in range(pyramid_zoom + 1)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def cell_meters(self, zoom):
+        """Returns the width of a cell in Web Mercator meters at a zoom level."""
+        return self.cell_size * 2 * ORIGIN_SHIFT / (256 * 2**zoom)
+
+    def _cells(self, zoom, x, y):
+        """Returns the cell of each point, as integer (q, r) coordinates."""
+        import numpy as np
+
+        size = self.cell_meters(zoom)
+        if self.kind == "square":
+            return np.floor(x / size).astype(np.int64), np.floor(y / size).astype(np.int64)
+        # Pointy-top hexagon centers form two rectangular lattices, offset by half a cell; each point
+        # belongs to the nearest of its candidate centers in either. Rows alternate between the two.
+        xs, ys = x * (1 / size), y * (1 / (size * math.sqrt(3)))
+        i1, j1 = np.round(xs), np.round(ys)
+        i2, j2 = np.floor(xs), np.floor(ys)
+        dx, dy = xs - i1, ys - j1
+        d1 = dx * dx + 3 * dy * dy
+        dx, dy = xs - i2 - 0.5, ys - j2 - 0.5
+        second = dx * dx + 3 * dy * dy < d1
+        i = np.where(second, i2, i1).astype(np.int64)
+        j = np.where(second, j2, j1).astype(np.int64)
+        return i - j, 2 * j + second
+
+    def centers(self, zoom, q, r):
+        """Returns the Web Mercator centers of cells.
+
+        Args:
+            zoom (int): The zoom level.
+            q (numpy.ndarray): The cell columns.
+            r (numpy.ndarray): The cell rows.
+
+        Returns:
+            tuple: The x and y arrays.
+        """
+        size = self.cell_meters(zoom)
+        if self.kind == "square":
+            return (q + 0.5) * size, (r + 0.5) * size
+        radius = size / math.sqrt(3)
+        return radius * math.sqrt(3) * (q + r / 2), radius * 1.5 * r
+
+    def polygons(self, zoom, q, r):
+        """Returns the rings of cells in longitude and latitude.
+
+        Args:
+            zoom (int): The zoom level.
+            q (numpy.ndarray): The cell columns.
+            r (numpy.ndarray): The cell rows.
+
+        Returns:
+            numpy.ndarray: The closed rings, of shape (cells, vertices + 1, 2).
+        """
+        import numpy as np
+
+        x, y = self.centers(zoom, q, r)
+        size = self.cell_meters(zoom)
+        if self.kind == "square":
+            dx = np.array([-0.5, 0.5, 0.5, -0.5, -0.5]) * size
+            dy = np.array([-0.5, -0.5, 0.5, 0.5, -0.5]) * size
+        else:
+            angles = np.radians(np.arange(7) * 60 - 30)
+            dx, dy = np.cos(angles) * size / math.sqrt(3), np.sin(angles) * size / math.sqrt(3)
+        lon, lat = mercator_to_lnglat(x[:, None] + dx, y[:, None] + dy)
+        return np.stack([lon, lat], axis=-1)
+
+    def _bin(self, zoom, lo, hi, bounds=None):
+        """Bins the points of a slice, optionally only those inside Web Mercator bounds."""
+        x, y = self.x[lo:hi], self.y[lo:hi]
+        values = self.values[lo:hi] if self.values is not None else None
+        if bounds is not None:
+            inside = (x >= bounds[0]) & (x < bounds[2]) & (y > bounds[1]) & (y <= bounds[3])
+            x, y = x[inside], y[inside]
+            values = values[inside] if values is not None else None
+        parts = []
+        for start in range(0, max(len(x), 1), CHUNK_SIZE):
+            end = start + CHUNK_SIZE
+            chunk = values[start:end] if values is not None else None
+            q, r = self._cells(zoom, x[start:end], y[start:end])
+            stats = [chunk if self.agg in aggs else None for aggs in (("sum", "mean"), ("min",), ("max",))]
+            parts.append(_reduce(q, r, None, *stats))
+        return _merge(parts)
+
+    def _tile(self, z, tx, ty):
+        """Returns the partial cells of the points in a tile, binned at its zoom level."""
+        import numpy as np
+
+        key = (z, tx, ty)
+        with self._lock:
+            if key in self._tiles:
+                self._tiles.move_to_end(key)
+                return self._tiles[key]
+
+        depth = min(z, INDEX_ZOOM)
+        shift = np.uint64(2 * (INDEX_ZOOM - depth))
+        prefix = _morton(tx >> (z - depth), ty >> (z - depth))
+        lo = int(np.searchsorted(self.keys, prefix << shift))
+        hi = int(np.searchsorted(self.keys, (prefix + np.uint64(1)) << shift))
+        bounds = None
+        if z > INDEX_ZOOM:
+            size = 2 * ORIGIN_SHIFT / 2**z
+            minx, maxy = -ORIGIN_SHIFT + tx * size, ORIGIN_SHIFT - ty * size
+            bounds = (minx, maxy - size, minx + size, maxy)
+        result = self._bin(z, lo, hi, bounds)
+
+        with self._lock:
+            self._tiles[key] = result
+            while len(self._tiles) > self.max_tiles:
+                self._tiles.popitem(last=False)
+        return result
+
+    def cells(self, zoom, bounds):
+        """Returns the aggregated cells whose centers are in view.
+
+        Args:
+            zoom (int): The zoom level; levels deeper than pyramid_zoom are binned per tile in view.
+            bounds (tuple): The ((south, west), (north, east)) bounds of the view.
+
+        Returns:
+            tuple: The q and r cell coordinates, and the count, sum, min and max of each cell;
+                the statistics agg does not need are None.
+        """
+        import numpy as np
+
+        zoom = max(0, int(round(zoom)))
+        if zoom in self.levels:
+            cells = self.levels[zoom]
+        else:
+            # A ring of tiles around the view completes the cells straddling its edges.
+            tiles = tiles_in_bounds(bounds, zoom, ring=1)
+            parts = [self._tile(*tile) for tile in tiles]
+            cells = _merge(parts)
+
+        (south, west), (north, east) = bounds
+        minx, miny = lnglat_to_mercator(np.array([west]), np.array([south]))
+        maxx, maxy = lnglat_to_mercator(np.array([east]), np.array([north]))
+        x, y = self.centers(zoom, cells[0], cells[1])
+        inside = (x >= minx[0]) & (x <= maxx[0]) & (y >= miny[0]) & (y <= maxy[0])
+        return tuple(part[inside] if part is not None else None for part in cells)
+
+    def aggregate(self, cells):
+        """Returns the value of each cell.
+
+        Args:
+            cells (tuple): The cells returned by cells().
+
+        Returns:
+            numpy.ndarray: The count, sum, mean, min or max of each cell, following agg.
+        """
+        _, _, count, total, low, high = cells
+        if self.agg == "mean":
+            return total / count
+        return {"count": count.astype("float64"), "sum": total, "min": low, "max": high}[self.agg]
+
+
+def legend_html(title, vmin, vmax, colormap="viridis", steps=6):
+    """Returns the HTML of a gradient legend.
+
+    Args:
+        title (str): The title.
+        vmin (float): The value of the low end.
+        vmax (float): The value of the high end.
+        colormap (str, optional): A matplotlib colormap name. Defaults to "viridis".
+        steps (int, optional): The number of gradient stops. Defaults to 6.
+
+    Returns:
+        str: The HTML.
+    """
+    import matplotlib
+    import numpy as np
+
+    colors = [matplotlib.colors.to_hex(c) for c in matplotlib.colormaps[colormap](np.linspace(0, 1, steps))]
+    return (
+        f"<div style='font-size:12px;padding:2px 4px'><b>{title}</b>"
+        f"<div style='width:160px;height:10px;background:linear-gradient(to right,{','.join(colors)})'></div>"
+        f"<div style='display:flex;justify-content:space-between;width:160px'>"
+        f"<span>{vmin:,.4g}</span><span>{vmax:,.4g}</span></div></div>"
+    )
+
+
+def to_geojson(pyramid, zoom, cells, values, vmin, vmax, colormap="viridis"):
+    """Builds the GeoJSON of cells colored by value.
+
+    Args:
+        pyramid (BinPyramid): The pyramid the cells come from.
+        zoom (int): The zoom level of the cells.
+        cells (tuple): The cells returned by BinPyramid.cells.
+        values (numpy.ndarray): The value of each cell, see BinPyramid.aggregate.
+        vmin (float): The value mapped to the low end of the colormap.
+        vmax (float): The value mapped to the high end of the colormap.
+        colormap (str, optional): A matplotlib colormap name. Defaults to "viridis".
+
+    Returns:
+        dict: The FeatureCollection, with the "count", "value" and fill color "style" of each cell.
+    """
+    import matplotlib
+    import numpy as np
+
+    from .common import zoom_resolution
+
+    lut = [matplotlib.colors.to_hex(c) for c in matplotlib.colormaps[colormap](np.linspace(0, 1, 256))]
+    scaled = np.clip((values - vmin) / ((vmax - vmin) or 1), 0, 1)
+    colors = np.round(np.nan_to_num(scaled) * 255).astype(int).tolist()
+    decimals = max(0, math.ceil(-math.log10(zoom_resolution(zoom) / 4)))
+    rings = np.round(pyramid.polygons(zoom, cells[0], cells[1]), decimals).tolist()
+    return {
+        "type": "FeatureCollection",
+        "features": [
+            {
+                "type": "Feature",
+                "properties": {"count": count, "value": value, "style": {"fillColor": lut[color]}},
+                "geometry": {"type": "Polygon", "coordinates": [ring]},
+            }
+            for ring, count, value, color in zip(rings, cells[2].tolist(), values.tolist(), colors)
+        ],
+    }
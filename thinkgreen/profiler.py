@@ -0,0 +1,284 @@
+"""Opt-in profiling of map construction.
+
+A Profiler wraps the public ``add_*`` methods of one map and records, for
+each call, its wall time, its peak Python memory and the bytes of widget
+messages serialized for the frontend while it ran, along with the number
+of layers and controls on the map afterwards. Nothing is wrapped until a
+profiler starts, so maps that are not profiled run at full speed.
+
+Example:
+    >>> m = thinkgreen.Map()
+    >>> with m.profile() as p:
+    ...     m.add_shp("countries.shp")
+    ...     m.add_raster(url)
+    >>> p.report()
+
+Setting the ``THINKGREEN_PROFILE`` environment variable to 1 profiles
+every new map from its creation, see ``Map.profiler``.
+"""
+
+import json
+import threading
+import time
+
+# Profilers currently running. The widget message hooks are installed while
+# this is non-empty, and notify every running profiler.
+_active = []
+_lock = threading.Lock()
+_originals = {}
+
+
+def _message_size(msg, buffers=None):
+    """Returns the bytes of a widget message once serialized, including binary buffers."""
+    size = len(json.dumps(msg, separators=(",", ":"), default=str).encode("utf-8"))
+    return size + sum(len(memoryview(buffer).cast("B")) for buffer in buffers or [])
+
+
+def _record_message(widget, size):
+    with _lock:
+        for profiler in _active:
+            profiler._on_message(widget, size)
+
+
+def _install_hooks():
+    """Counts the state sent by every widget when it opens its comm and when it syncs."""
+    from ipywidgets import Widget
+    from ipywidgets.widgets.widget import _remove_buffers
+
+    open_, send = Widget.open, Widget._send
+    _originals.update(open=open_, _send=send)
+
+    def hooked_open(self):
+        opened = self.comm is None
+        open_(self)
+        if opened and _active:
+            state, buffer_paths, buffers = _remove_buffers(self.get_state())
+            _record_message(self, _message_size({"state": state, "buffer_paths": buffer_paths}, buffers))
+
+    def hooked_send(self, msg, buffers=None):
+        if _active:
+            _record_message(self, _message_size(msg, buffers))
+        return send(self, msg, buffers=buffers)
+
+    Widget.open = hooked_open
+    Widget._send = hooked_send
+
+
+def _remove_hooks():
+    from ipywidgets import Widget
+
+    for name, method in _originals.items():
+        setattr(Widget, name, method)
+    _originals.clear()
+
+
+def _describe(args):
+    """Returns a short description of the first argument of a call, such as a path or URL."""
+    if not args:
+        return ""
+    value = args[0]
+    if isinstance(value, str):
+        return value if len(value) <= 60 else "..." + value[-57:]
+    return type(value).__name__
+
+
+def _can_trace_peak():
+    """Returns whether tracemalloc can reset its peak, which Python 3.9 added."""
+    import tracemalloc
+
+    return hasattr(tracemalloc, "reset_peak")
+
+
+class Profiler:
+    """Records the cost of the ``add_*`` calls made on a map.
+
+    Use it as a context manager, or call start() and stop(). Results are
+    available while it runs and after it stops.
+
+    Args:
+        m (thinkgreen.Map): The map to profile.
+        memory (bool, optional): Record the peak Python memory of each call
+            with tracemalloc, which slows calls down. Needs Python 3.9 or
+            later; peak memory is None on older versions. Defaults to True.
+    """
+
+    def __init__(self, m, memory=True):
+        self.map = m
+        self.memory = memory
+        self.records = []
+        self.widget_bytes = {}
+        self.total_bytes = 0
+        self.running = False
+        self._stack = []
+        self._wrapped = []
+        self._started_tracing = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        """Wraps the add_* methods of the map and starts counting widget messages.
+
+        Returns:
+            Profiler: The profiler.
+        """
+        import tracemalloc
+
+        if self.running:
+            return self
+        current = getattr(self.map, "profiler", None)
+        if current is not None and current.running:
+            raise ValueError("The map is already being profiled.")
+        self.running = True
+        self._wrapped = [
+            name for name in dir(type(self.map)) if name.startswith("add_") and callable(getattr(type(self.map), name))
+        ]
+        for name in self._wrapped:
+            setattr(self.map, name, self._wrap(name, getattr(self.map, name)))
+        if self.memory and _can_trace_peak() and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        with _lock:
+            if not _active:
+                _install_hooks()
+            _active.append(self)
+        self.map.profiler = self
+        return self
+
+    def stop(self):
+        """Restores the add_* methods of the map and stops counting widget messages."""
+        import tracemalloc
+
+        if not self.running:
+            return
+        self.running = False
+        for name in self._wrapped:
+            delattr(self.map, name)
+        with _lock:
+            _active.remove(self)
+            if not _active:
+                _remove_hooks()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def _on_message(self, widget, size):
+        self.total_bytes += size
+        key = getattr(widget, "model_id", None) or id(widget)
+        self.widget_bytes[key] = self.widget_bytes.get(key, 0) + size
+
+    def _counts(self):
+        batch = self.map._batch or {}
+        return len(batch.get("layers", self.map.layers)), len(batch.get("controls", self.map.controls))
+
+    def _wrap(self, name, method):
+        import functools
+        import tracemalloc
+
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            tracing = self.memory and _can_trace_peak() and tracemalloc.is_tracing()
+            if tracing:
+                if self._stack:
+                    parent = self._stack[-1]
+                    parent["peak"] = max(parent["peak"], tracemalloc.get_traced_memory()[1])
+                tracemalloc.reset_peak()
+                start_memory = tracemalloc.get_traced_memory()[0]
+            frame = {"peak": 0}
+            self._stack.append(frame)
+            record = {"call": name, "depth": len(self._stack) - 1, "target": _describe(args)}
+            self.records.append(record)
+            error = None
+            start_bytes, start = self.total_bytes, time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                error = type(e).__name__
+                raise
+            finally:
+                record["time"] = time.perf_counter() - start
+                self._stack.pop()
+                if tracing:
+                    frame["peak"] = max(frame["peak"], tracemalloc.get_traced_memory()[1])
+                    record["peak_memory"] = frame["peak"] - start_memory
+                    if self._stack:
+                        self._stack[-1]["peak"] = max(self._stack[-1]["peak"], frame["peak"])
+                else:
+                    record["peak_memory"] = None
+                record["comm_bytes"] = self.total_bytes - start_bytes
+                record["layers"], record["controls"] = self._counts()
+                record["error"] = error
+
+        return wrapper
+
+    def report(self, nested=True):
+        """Returns the recorded calls as a table.
+
+        Args:
+            nested (bool, optional): Include the add_* calls made by other
+                add_* calls, with their depth. Defaults to True.
+
+        Returns:
+            pandas.DataFrame: One row per call, in call order.
+        """
+        import pandas as pd
+
+        columns = ["call", "depth", "target", "time", "peak_memory", "comm_bytes", "layers", "controls", "error"]
+        records = [r for r in self.records if "time" in r and (nested or r["depth"] == 0)]
+        return pd.DataFrame(records, columns=columns)
+
+    def layer_report(self):
+        """Returns the bytes of widget messages sent by each layer and control on the map.
+
+        Returns:
+            pandas.DataFrame: One row per layer or control, with its name, its
+                type and the bytes sent while profiling.
+        """
+        import pandas as pd
+
+        rows = [{"kind": "map", "name": "", "type": type(self.map).__name__, "comm_bytes": self._bytes(self.map)}]
+        for kind, items in (("layer", self.map.layers), ("control", self.map.controls)):
+            for item in items:
+                name = getattr(item, "name", "")
+                rows.append({"kind": kind, "name": name, "type": type(item).__name__, "comm_bytes": self._bytes(item)})
+        return pd.DataFrame(rows, columns=["kind", "name", "type", "comm_bytes"])
+
+    def _bytes(self, widget):
+        return self.widget_bytes.get(widget.model_id, 0)
+
+    def to_dict(self):
+        """Returns the calls, the layers and the totals as a JSON-serializable dict.
+
+        Returns:
+            dict: The "calls", "layers", and "total_time" and "total_comm_bytes" of the top-level calls.
+        """
+        calls = self.report().astype(object).where(lambda df: df.notna(), None).to_dict("records")
+        top = [call for call in calls if call["depth"] == 0]
+        return {
+            "calls": calls,
+            "layers": self.layer_report().to_dict("records"),
+            "total_time": sum(call["time"] for call in top),
+            "total_comm_bytes": self.total_bytes,
+        }
+
+    def to_json(self, path=None, indent=2):
+        """Exports the results as JSON.
+
+        Args:
+            path (str, optional): The file to write to. Defaults to None.
+            indent (int, optional): The indentation. Defaults to 2.
+
+        Returns:
+            str: The JSON text.
+        """
+        text = json.dumps(self.to_dict(), indent=indent)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def _repr_html_(self):
+        return self.report().to_html(index=False)
@@ -0,0 +1,610 @@
+"""Functions for working with raster data and raster tile services."""
+
+import collections
+import itertools
+import os
+import threading
+
+from .cache import TTLCache, get_cache_dir
+from .common import get_client, get_http_executor
+
+_ids = itertools.count(1)
+_metadata_cache = None
+_lock = threading.Lock()
+
+
+def get_titiler_endpoint(titiler_endpoint=None):
+    """Returns the titiler endpoint to use.
+
+    Args:
+        titiler_endpoint (str, optional): An explicit endpoint. Defaults to the
+            ``TITILER_ENDPOINT`` environment variable, or https://titiler.xyz.
+
+    Returns:
+        str: The endpoint URL without a trailing slash.
+    """
+    if titiler_endpoint is None:
+        titiler_endpoint = os.environ.get("TITILER_ENDPOINT", "https://titiler.xyz")
+    return titiler_endpoint.rstrip("/")
+
+
+def _get_metadata_cache():
+    global _metadata_cache
+
+    with _lock:
+        if _metadata_cache is None:
+            _metadata_cache = TTLCache(ttl=24 * 3600, cache_dir=get_cache_dir("cog"))
+        return _metadata_cache
+
+
+def _get_json(url, params):
+    response = get_client().get(url, params=params)
+    response.raise_for_status()
+    return response.json()
+
+
+def cog_metadata(urls, titiler_endpoint=None):
+    """Fetches the bounds and TileJSON of Cloud Optimized GeoTIFFs from a titiler endpoint.
+
+    The ``/cog/info`` and ``/cog/tilejson.json`` documents of all uncached URLs
+    are requested concurrently over a pooled client. Results are cached in
+    memory and on disk for a day, keyed by endpoint and URL.
+
+    Args:
+        urls (str | list): The URL of a COG, or a list of URLs.
+        titiler_endpoint (str, optional): The titiler endpoint. Defaults to None.
+
+    Returns:
+        dict | list: For each URL, a dict with the "bounds" and "tilejson" of the COG.
+    """
+    single = isinstance(urls, str)
+    if single:
+        urls = [urls]
+
+    endpoint = get_titiler_endpoint(titiler_endpoint)
+    cache = _get_metadata_cache()
+    executor = get_http_executor()
+
+    results = {}
+    pending = {}
+    for url in dict.fromkeys(urls):
+        key = f"{endpoint}|{url}"
+        cached = cache.get(key)
+        if cached is not None:
+            results[url] = cached
+        else:
+            params = {"url": url}
+            pending[url] = (
+                executor.submit(_get_json, f"{endpoint}/cog/info", params),
+                executor.submit(_get_json, f"{endpoint}/cog/tilejson.json", params),
+            )
+
+    for url, (info, tilejson) in pending.items():
+        value = {"bounds": info.result()["bounds"], "tilejson": tilejson.result()}
+        cache.put(f"{endpoint}|{url}", value)
+        results[url] = value
+
+    metadata = [results[url] for url in urls]
+    return metadata[0] if single else metadata
+
+
+class LocalTileRenderer:
+    """Renders XYZ tiles from a local GeoTIFF or Cloud Optimized GeoTIFF.
+
+    Each tile is a windowed, decimated read of only the pixels under the
+    tile (GDAL picks the closest overview for the requested resolution),
+    warped to Web Mercator, rescaled with NumPy and colorized. Tiles are
+    rendered in a thread pool, kept in an LRU cache, and the neighbours of
+    each requested tile are prefetched. Prefetches wait in a bounded queue
+    and are rendered one at a time, only while no requested tile is waiting.
+
+    Args:
+        path (str): The path to the raster file.
+        bands (list, optional): The 1-based band indexes to render, one or three. Defaults to the first band,
+            or the first three bands of an RGB(A) raster.
+        vmin (float, optional): The value mapped to the low end of the colormap. Defaults to the 2nd percentile.
+        vmax (float, optional): The value mapped to the high end of the colormap. Defaults to the 98th percentile.
+        colormap (str, optional): A matplotlib colormap name for single-band rasters. Defaults to None (grayscale).
+        nodata (float, optional): The nodata value. Defaults to the value stored in the file.
+        cache_bytes (int, optional): The size limit of the tile cache. Defaults to 128 MiB.
+        max_workers (int, optional): The number of rendering threads. Defaults to 4.
+        prefetch (bool, optional): Whether to prefetch neighbouring tiles. Defaults to True.
+    """
+
+    tile_size = 256
+    # The most neighbours waiting to be prefetched; the oldest are dropped first.
+    prefetch_queue_size = 64
+
+    def __init__(
+        self,
+        path,
+        bands=None,
+        vmin=None,
+        vmax=None,
+        colormap=None,
+        nodata=None,
+        cache_bytes=128 * 1024 * 1024,
+        max_workers=4,
+        prefetch=True,
+    ):
+        from concurrent.futures import ThreadPoolExecutor
+
+        import numpy as np
+        import rasterio
+        from rasterio.warp import transform_bounds
+
+        from .cache import LRUCache
+
+        self.path = path
+        with rasterio.open(path) as src:
+            if bands is None:
+                bands = [1, 2, 3] if src.count >= 3 else [1]
+            self.crs = src.crs
+            self.nodata = src.nodata if nodata is None else nodata
+            self.bounds = transform_bounds(src.crs, "EPSG:4326", *src.bounds)
+
+            if vmin is None or vmax is None:
+                scale = max(1, max(src.width, src.height) // 1024)
+                sample = src.read(
+                    bands,
+                    out_shape=(len(bands), max(1, src.height // scale), max(1, src.width // scale)),
+                    masked=True,
+                ).astype("float64")
+                if self.nodata is not None:
+                    sample = np.ma.masked_equal(sample, self.nodata)
+                values = sample.compressed()
+                values = values[np.isfinite(values)]
+                if values.size:
+                    low, high = np.percentile(values, [2, 98])
+                else:
+                    low, high = 0.0, 1.0
+                vmin = low if vmin is None else vmin
+                vmax = high if vmax is None else vmax
+
+        self.bands = list(bands)
+        self.vmin = float(vmin)
+        self.vmax = float(vmax) if vmax != vmin else float(vmin) + 1.0
+        self.lut = None
+        if colormap is not None and len(self.bands) == 1:
+            import matplotlib
+
+            cmap = matplotlib.colormaps[colormap]
+            self.lut = (cmap(np.linspace(0, 1, 256)) * 255).astype(np.uint8)
+
+        self.prefetch = prefetch
+        self.cache = LRUCache(cache_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thinkgreen-cog")
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._requested = 0
+        self._prefetch_keys = collections.deque(maxlen=self.prefetch_queue_size)
+        self._prefetching = False
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thinkgreen-cog-prefetch")
+        self._local = threading.local()
+        self._blank = None
+        self._prefix = None
+
+    def _dataset(self):
+        import rasterio
+
+        ds = getattr(self._local, "ds", None)
+        if ds is None:
+            ds = self._local.ds = rasterio.open(self.path)
+        return ds
+
+    def tile(self, z, x, y):
+        """Returns the PNG tile at z/x/y, rendering it if it is not cached.
+
+        Args:
+            z (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            bytes: The PNG image.
+        """
+        data = self.cache.get((z, x, y))
+        if data is None:
+            with self._pending_lock:
+                self._requested += 1
+            try:
+                data = self._submit(z, x, y).result()
+            finally:
+                with self._pending_lock:
+                    self._requested -= 1
+
+        if self.prefetch:
+            n = 2**z
+            keys = [
+                (z, (x + dx) % n, y + dy)
+                for dx in (-1, 0, 1)
+                for dy in (-1, 0, 1)
+                if (dx or dy) and 0 <= y + dy < n
+            ]
+            self._queue_prefetch([key for key in keys if key not in self.cache])
+        return data
+
+    def _queue_prefetch(self, keys):
+        with self._pending_lock:
+            self._prefetch_keys.extend(keys)
+            if self._prefetching or not self._prefetch_keys:
+                return
+            self._prefetching = True
+        self._prefetch_executor.submit(self._run_prefetch)
+
+    def _run_prefetch(self):
+        """Renders the queued neighbours, newest first, until a requested tile is waiting."""
+        while True:
+            with self._pending_lock:
+                if self._requested or not self._prefetch_keys:
+                    # The next request queues its neighbours and resumes prefetching.
+                    self._prefetching = False
+                    return
+                key = self._prefetch_keys.pop()
+            if key not in self.cache:
+                # Errors are raised when the tile is requested.
+                self._submit(*key).exception()
+
+    def _submit(self, z, x, y):
+        key = (z, x, y)
+        with self._pending_lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._executor.submit(self._render_and_cache, key)
+                self._pending[key] = future
+        return future
+
+    def _render_and_cache(self, key):
+        try:
+            data = self.render(*key)
+            self.cache.put(key, data)
+            return data
+        finally:
+            with self._pending_lock:
+                self._pending.pop(key, None)
+
+    def render(self, z, x, y):
+        """Renders the PNG tile at z/x/y without using the cache.
+
+        Args:
+            z (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            bytes: The PNG image.
+        """
+        import math
+
+        import numpy as np
+        from affine import Affine
+        from rasterio.enums import Resampling
+        from rasterio.transform import from_bounds
+        from rasterio.warp import reproject, transform_bounds
+        from rasterio.windows import Window
+
+        from .tileserver import tile_bounds
+
+        size = self.tile_size
+        bounds = tile_bounds(z, x, y)
+        ds = self._dataset()
+
+        try:
+            src_bounds = transform_bounds("EPSG:3857", self.crs, *bounds, densify_pts=21)
+        except Exception:
+            return self._blank_tile()
+        window = ds.window(*src_bounds)
+        col = max(math.floor(window.col_off) - 1, 0)
+        row = max(math.floor(window.row_off) - 1, 0)
+        col_end = min(math.ceil(window.col_off + window.width) + 1, ds.width)
+        row_end = min(math.ceil(window.row_off + window.height) + 1, ds.height)
+        if col_end <= col or row_end <= row:
+            return self._blank_tile()
+        window = Window(col, row, col_end - col, row_end - row)
+
+        # Decimated read: GDAL serves it from the closest overview.
+        out_h = min(int(window.height), 2 * size)
+        out_w = min(int(window.width), 2 * size)
+        source = ds.read(
+            self.bands,
+            window=window,
+            out_shape=(len(self.bands), out_h, out_w),
+            resampling=Resampling.nearest,
+        ).astype("float32")
+        transform = ds.window_transform(window) * Affine.scale(
+            window.width / out_w, window.height / out_h
+        )
+        if self.nodata is not None:
+            source[source == self.nodata] = np.nan
+
+        dest = np.full((len(self.bands), size, size), np.nan, dtype="float32")
+        reproject(
+            source,
+            dest,
+            src_transform=transform,
+            src_crs=self.crs,
+            src_nodata=np.nan,
+            dst_transform=from_bounds(*bounds, size, size),
+            dst_crs="EPSG:3857",
+            dst_nodata=np.nan,
+            resampling=Resampling.nearest,
+        )
+        return self._colorize(dest)
+
+    def _colorize(self, data):
+        import io
+
+        import numpy as np
+        from PIL import Image
+
+        valid = np.isfinite(data).all(axis=0)
+        scaled = np.clip((data - self.vmin) / (self.vmax - self.vmin), 0, 1)
+        scaled = np.nan_to_num(scaled * 255).astype(np.uint8)
+
+        rgba = np.full(data.shape[1:] + (4,), 255, dtype=np.uint8)
+        if self.lut is not None:
+            rgba[:] = self.lut[scaled[0]]
+        elif len(self.bands) == 1:
+            rgba[..., :3] = scaled[0][..., None]
+        else:
+            rgba[..., :3] = np.moveaxis(scaled[:3], 0, -1)
+        rgba[~valid, 3] = 0
+
+        buffer = io.BytesIO()
+        Image.fromarray(rgba, "RGBA").save(buffer, format="PNG")
+        return buffer.getvalue()
+
+    def _blank_tile(self):
+        import numpy as np
+
+        if self._blank is None:
+            size = self.tile_size
+            self._blank = self._colorize(np.full((len(self.bands), size, size), np.nan))
+        return self._blank
+
+    def serve(self):
+        """Registers the renderer with the shared tile server.
+
+        Returns:
+            str: The XYZ URL template of the tiles.
+        """
+        from .tileserver import get_server, parse_tile
+
+        def handler(segments, query):
+            tile = parse_tile(segments)
+            if tile is None:
+                return None
+            return self.tile(*tile), "image/png"
+
+        self._prefix = f"raster/{next(_ids)}"
+        return get_server().register(self._prefix, handler) + "/{z}/{x}/{y}.png"
+
+    def close(self):
+        """Unregisters the renderer from the shared tile server and stops its rendering threads."""
+        from .tileserver import get_server
+
+        if self._prefix is not None:
+            get_server().unregister(self._prefix)
+            self._prefix = None
+        self._executor.shutdown(wait=False)
+        self._prefetch_executor.shutdown(wait=False)
+
+
+# Datasets opened by zonal statistics tasks, per process.
+_zonal_datasets = {}
+
+
+def _zonal_dataset(path):
+    import rasterio
+
+    ds = _zonal_datasets.get(path)
+    if ds is None:
+        ds = _zonal_datasets[path] = rasterio.open(path)
+    return ds
+
+
+def _block_windows(ds, band, geometry, max_pixels):
+    """Splits the window under a geometry into block-aligned windows of at most ``max_pixels``.
+
+    Windows that do not intersect the geometry, e.g. between the parts of a
+    multipolygon, are skipped.
+    """
+    import math
+
+    import shapely
+    from rasterio.windows import Window, bounds as window_bounds, from_bounds
+
+    window = from_bounds(*geometry.bounds, transform=ds.transform)
+    col = max(math.floor(window.col_off), 0)
+    row = max(math.floor(window.row_off), 0)
+    col_end = min(math.ceil(window.col_off + window.width), ds.width)
+    row_end = min(math.ceil(window.row_off + window.height), ds.height)
+    if col_end <= col or row_end <= row:
+        return
+
+    # Grow the window to whole blocks, so each block is decoded by one task only.
+    block_h, block_w = ds.block_shapes[band - 1]
+    col, row = col - col % block_w, row - row % block_h
+    col_end = min(-(-col_end // block_w) * block_w, ds.width)
+    row_end = min(-(-row_end // block_h) * block_h, ds.height)
+
+    blocks_x = max(1, min(int(math.sqrt(max(max_pixels // (block_w * block_h), 1))), -(-(col_end - col) // block_w)))
+    step_w = blocks_x * block_w
+    step_h = max(1, max_pixels // (step_w * block_h)) * block_h
+    for r in range(row, row_end, step_h):
+        for c in range(col, col_end, step_w):
+            chunk = Window(c, r, min(step_w, col_end - c), min(step_h, row_end - r))
+            if shapely.intersects(geometry, shapely.box(*window_bounds(chunk, ds.transform))):
+                yield chunk
+
+
+def _zonal_task(task):
+    """Computes the partial statistics of one geometry over one window."""
+    import numpy as np
+    from rasterio.features import geometry_mask
+    from rasterio.windows import Window
+
+    index, path, band, geometry, window, edges, nodata, all_touched = task
+    ds = _zonal_dataset(path)
+    window = Window(*window)
+    data = ds.read(band, window=window, masked=True)
+    inside = geometry_mask(
+        [geometry],
+        out_shape=data.shape,
+        transform=ds.window_transform(window),
+        all_touched=all_touched,
+        invert=True,
+    )
+    values = data.data[inside & ~np.ma.getmaskarray(data)]
+    if nodata is not None:
+        values = values[values != nodata]
+    if values.dtype.kind == "f":
+        values = values[np.isfinite(values)]
+    if not values.size:
+        return index, None
+    values = values.astype("float64")
+    histogram = np.histogram(np.clip(values, edges[0], edges[-1]), bins=edges)[0]
+    return index, (values.size, values.sum(), values.min(), values.max(), histogram)
+
+
+def zonal_stats(
+    path,
+    geometries,
+    crs="EPSG:4326",
+    band=1,
+    bins=10,
+    hist_range=None,
+    nodata=None,
+    all_touched=False,
+    processes=None,
+    max_pixels=4 * 1024 * 1024,
+):
+    """Computes the statistics of raster values under each geometry.
+
+    Only the pixels under each geometry are read, through windows aligned
+    to the internal blocks of the raster and split so none holds more than
+    ``max_pixels``, so memory use stays bounded however large the raster
+    or the geometries are. The windows are spread over a process pool and
+    their partial statistics merged per geometry.
+
+    Args:
+        path (str): The path to a GeoTIFF or another raster readable by rasterio.
+        geometries (list): The shapely polygons.
+        crs (str, optional): The CRS of the geometries. Defaults to "EPSG:4326".
+        band (int, optional): The 1-based band index. Defaults to 1.
+        bins (int, optional): The number of histogram bins. Defaults to 10.
+        hist_range (tuple, optional): The (min, max) range of the histogram, shared by all geometries; values outside
+            it are counted in the first or last bin. Defaults to the range of a decimated read of the raster.
+        nodata (float, optional): The nodata value. Defaults to the value stored in the file.
+        all_touched (bool, optional): Whether to include every pixel touched by a geometry, rather than the
+            pixels whose center is inside it. Defaults to False.
+        processes (int, optional): The number of worker processes. Defaults to the number of CPUs, or no
+            pool if all the windows fit in one read. 0 or 1 computes in this process.
+        max_pixels (int, optional): The maximum number of pixels read at once per process. Defaults to 4Mi.
+
+    Returns:
+        list: For each geometry, a dict with the "count", "sum", "mean", "min" and "max" of the values
+            under it ("mean", "min" and "max" are None without any), and the "histogram" counts.
+            The bin edges are stored under "bin_edges".
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    import numpy as np
+    import rasterio
+    from rasterio.crs import CRS
+
+    geometries = list(geometries)
+    with rasterio.open(path) as ds:
+        if not 1 <= band <= ds.count:
+            raise ValueError(f"band must be between 1 and {ds.count}")
+        if ds.crs is not None and CRS.from_user_input(crs) != ds.crs:
+            import geopandas as gpd
+
+            geometries = list(gpd.GeoSeries(geometries, crs=crs).to_crs(ds.crs))
+
+        if hist_range is None:
+            scale = max(1, max(ds.width, ds.height) // 1024)
+            sample = ds.read(
+                band, out_shape=(max(1, ds.height // scale), max(1, ds.width // scale)), masked=True
+            )
+            values = sample.compressed().astype("float64")
+            if nodata is not None:
+                values = values[values != nodata]
+            values = values[np.isfinite(values)]
+            hist_range = (values.min(), values.max()) if values.size else (0.0, 1.0)
+        low, high = float(hist_range[0]), float(hist_range[1])
+        edges = np.linspace(low, high if high > low else low + 1, bins + 1)
+
+        tasks = []
+        pixels = 0
+        for index, geometry in enumerate(geometries):
+            if geometry is None or geometry.is_empty:
+                continue
+            for window in _block_windows(ds, band, geometry, max_pixels):
+                pixels += window.width * window.height
+                tasks.append(
+                    (
+                        index,
+                        path,
+                        band,
+                        geometry,
+                        (window.col_off, window.row_off, window.width, window.height),
+                        edges,
+                        nodata,
+                        all_touched,
+                    )
+                )
+
+    if processes is None:
+        processes = 1 if pixels <= max_pixels else os.cpu_count() or 1
+    processes = max(1, min(processes, len(tasks)))
+    if processes == 1:
+        results = map(_zonal_task, tasks)
+    else:
+        # Spawned workers do not inherit the threads of the kernel or the map widgets.
+        executor = ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn"))
+        results = executor.map(_zonal_task, tasks, chunksize=max(1, len(tasks) // (processes * 8)))
+
+    partials = [None] * len(geometries)
+    try:
+        for index, partial in results:
+            if partial is None:
+                continue
+            current = partials[index]
+            if current is None:
+                partials[index] = list(partial)
+            else:
+                current[0] += partial[0]
+                current[1] += partial[1]
+                current[2] = min(current[2], partial[2])
+                current[3] = max(current[3], partial[3])
+                current[4] = current[4] + partial[4]
+    finally:
+        if processes > 1:
+            executor.shutdown()
+        ds = _zonal_datasets.pop(path, None)
+        if ds is not None:
+            ds.close()
+
+    stats = []
+    for partial in partials:
+        if partial is None:
+            stats.append(
+                {"count": 0, "sum": 0.0, "mean": None, "min": None, "max": None, "histogram": [0] * bins}
+            )
+            continue
+        count, total, minimum, maximum, histogram = partial
+        stats.append(
+            {
+                "count": int(count),
+                "sum": float(total),
+                "mean": float(total / count),
+                "min": float(minimum),
+                "max": float(maximum),
+                "histogram": histogram.tolist(),
+            }
+        )
+    for item in stats:
+        item["bin_edges"] = edges.tolist()
+    return stats
@@ -0,0 +1,527 @@
+"""Spatial indexes over the features of vector layers, for bounding box, point and identify queries."""
+
+import threading
+
+PREDICATES = ("intersects", "within", "contains", "covers", "covered_by", "overlaps", "crosses", "touches")
+
+
+def _coordinates(coords, xs, ys):
+    """Appends the x and y values of nested GeoJSON coordinates."""
+    if not len(coords):
+        return
+    first = coords[0]
+    if not isinstance(first, (list, tuple)):
+        xs.append(first)
+        ys.append(coords[1])
+    elif not isinstance(first[0], (list, tuple)):
+        xs.extend(position[0] for position in coords)
+        ys.extend(position[1] for position in coords)
+    else:
+        for part in coords:
+            _coordinates(part, xs, ys)
+
+
+def _geometry_coordinates(geometry, xs, ys):
+    if not geometry:
+        return
+    if geometry.get("type") == "GeometryCollection":
+        for part in geometry.get("geometries", []):
+            _geometry_coordinates(part, xs, ys)
+    else:
+        _coordinates(geometry.get("coordinates", []), xs, ys)
+
+
+def feature_bounds(features):
+    """Returns the bounds of GeoJSON features as one array.
+
+    All coordinates are gathered into two flat arrays in a single pass, and
+    the bounds of each feature are reduced from them with NumPy.
+
+    Args:
+        features (list): The GeoJSON features.
+
+    Returns:
+        numpy.ndarray: The (minx, miny, maxx, maxy) rows, NaN for features without coordinates.
+    """
+    import numpy as np
+
+    xs, ys = [], []
+    starts = np.empty(len(features), dtype=np.int64)
+    for i, feature in enumerate(features):
+        starts[i] = len(xs)
+        _geometry_coordinates(feature.get("geometry"), xs, ys)
+    xs = np.asarray(xs, dtype="float64")
+    ys = np.asarray(ys, dtype="float64")
+
+    bounds = np.full((len(features), 4), np.nan)
+    counts = np.diff(np.append(starts, len(xs)))
+    valid = counts > 0
+    if valid.any():
+        offsets = starts[valid]
+        bounds[valid] = np.column_stack(
+            [
+                np.minimum.reduceat(xs, offsets),
+                np.minimum.reduceat(ys, offsets),
+                np.maximum.reduceat(xs, offsets),
+                np.maximum.reduceat(ys, offsets),
+            ]
+        )
+    return bounds
+
+
+# The nesting depth of the coordinates of each geometry type, below a single position.
+_DEPTHS = {"Point": 0, "MultiPoint": 1, "LineString": 1, "MultiLineString": 2, "Polygon": 2, "MultiPolygon": 3}
+
+
+def _ragged(coords, depth, xs, ys, offsets):
+    """Appends nested coordinates to flat x and y lists, and the part ends to the offsets of each level."""
+    if depth == 1:
+        xs.extend(position[0] for position in coords)
+        ys.extend(position[1] for position in coords)
+        offsets[0].append(len(xs))
+        return
+    for part in coords:
+        _ragged(part, depth - 1, xs, ys, offsets)
+    offsets[depth - 1].append(len(offsets[depth - 2]) - 1)
+
+
+def geojson_geometries(geometries):
+    """Converts GeoJSON geometries to shapely geometries in bulk.
+
+    The geometries of each type are flattened into one coordinate array with
+    part offsets and built with shapely.from_ragged_array(), which is much
+    faster than converting them one by one. Geometry collections, and groups
+    that shapely rejects (e.g. rings with too few points), are converted one
+    by one instead.
+
+    Args:
+        geometries (list): The GeoJSON geometries; None for features without geometry.
+
+    Returns:
+        numpy.ndarray: The shapely geometries, None where the input is None.
+    """
+    import numpy as np
+    import shapely
+    from shapely.geometry import shape
+
+    out = np.empty(len(geometries), dtype=object)
+    groups = {}
+    for i, geometry in enumerate(geometries):
+        if geometry:
+            groups.setdefault(geometry.get("type"), []).append(i)
+
+    for kind, members in groups.items():
+        depth = _DEPTHS.get(kind)
+        built = None
+        if depth is not None:
+            xs, ys = [], []
+            offsets = [[0] for _ in range(depth)]
+            try:
+                for i in members:
+                    coords = geometries[i]["coordinates"]
+                    if depth == 0:
+                        xs.append(coords[0])
+                        ys.append(coords[1])
+                    else:
+                        _ragged(coords, depth, xs, ys, offsets)
+                built = shapely.from_ragged_array(
+                    getattr(shapely.GeometryType, kind.upper()),
+                    np.column_stack([np.asarray(xs, dtype="float64"), np.asarray(ys, dtype="float64")]),
+                    tuple(np.asarray(level, dtype=np.int64) for level in offsets) or None,
+                )
+            except (ValueError, TypeError, IndexError, shapely.errors.GEOSException):
+                built = None
+        if built is None:
+            built = [shape(geometries[i]) for i in members]
+        out[members] = built
+    return out
+
+
+def as_geometry(geometry):
+    """Converts a query geometry to a shapely geometry.
+
+    Args:
+        geometry (tuple | dict | shapely.Geometry): A (lon, lat) point, a
+            (minx, miny, maxx, maxy) bounding box, a GeoJSON geometry or feature,
+            or a shapely geometry.
+
+    Returns:
+        shapely.Geometry: The geometry.
+    """
+    import shapely
+    from shapely.geometry import shape
+
+    if isinstance(geometry, shapely.Geometry):
+        return geometry
+    if isinstance(geometry, dict):
+        return shape(geometry.get("geometry", geometry) if geometry.get("type") == "Feature" else geometry)
+    if len(geometry) == 2:
+        return shapely.points(*geometry)
+    if len(geometry) == 4:
+        return shapely.box(*geometry)
+    raise ValueError("geometry must be a (lon, lat) point, a (minx, miny, maxx, maxy) box or a geometry.")
+
+
+class SpatialIndex:
+    """An STRtree over the features of a vector layer, built on the first query.
+
+    GeoJSON features are indexed by their bounding boxes, and only the
+    candidates returned by the tree are converted to shapely geometries for
+    the exact test; these are kept, so repeated queries over the same area
+    do not convert them again. GeoDataFrames are indexed by their
+    geometries directly. Assigning new data drops the index.
+
+    Args:
+        data (dict | list | geopandas.GeoDataFrame): A GeoJSON FeatureCollection,
+            a list of features, or a GeoDataFrame.
+    """
+
+    def __init__(self, data):
+        self._lock = threading.Lock()
+        self.data = data
+
+    @property
+    def data(self):
+        """The indexed data. Setting it drops the index, which is rebuilt on the next query."""
+        return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._tree = None
+        self._features = None
+        self._geometries = None
+        self._points = None
+        self._frame = None
+
+    @property
+    def built(self):
+        """bool: Whether the index has been built since the data was last set."""
+        return self._tree is not None
+
+    def __len__(self):
+        self._build()
+        return len(self._geometries)
+
+    def _build(self):
+        # Queries may come from the kernel and from a clip running on a worker thread.
+        with self._lock:
+            if self._tree is None:
+                self._build_tree()
+
+    def _build_tree(self):
+        import numpy as np
+        import shapely
+
+        data = self._data
+        if hasattr(data, "geometry") and hasattr(data, "iloc"):
+            self._frame = data
+            self._geometries = np.asarray(data.geometry.values, dtype=object)
+            self._tree = shapely.STRtree(self._geometries)
+            return
+
+        if isinstance(data, dict):
+            data = data.get("features", [data] if data.get("type") == "Feature" else [])
+        self._features = data
+        bounds = feature_bounds(data)
+        self._points = np.array(
+            [(feature.get("geometry") or {}).get("type") == "Point" for feature in data], dtype=bool
+        )
+        boxes = shapely.box(*bounds.T) if len(bounds) else np.empty(0, dtype=object)
+        boxes[np.isnan(bounds).any(axis=1)] = None
+        self._geometries = np.empty(len(data), dtype=object)
+        self._geometries[self._points] = shapely.points(bounds[self._points, :2])
+        self._tree = shapely.STRtree(boxes)
+
+    def _shapes(self, indices):
+        """Returns the geometries of features, converting those not seen before."""
+        import numpy as np
+
+        if self._features is None:
+            return self._geometries[indices]
+        missing = indices[np.equal(self._geometries[indices], None)]
+        if len(missing):
+            self._geometries[missing] = geojson_geometries(
+                [self._features[i].get("geometry") for i in missing]
+            )
+        return self._geometries[indices]
+
+    def query(self, geometry, predicate="intersects"):
+        """Returns the indices of the features matching a query geometry.
+
+        Args:
+            geometry (tuple | dict | shapely.Geometry): The query geometry, see as_geometry().
+            predicate (str, optional): The test between the query geometry and each feature,
+                e.g. "intersects", or "contains" for features inside the query geometry.
+                Defaults to "intersects".
+
+        Returns:
+            numpy.ndarray: The sorted feature indices.
+        """
+        import numpy as np
+        import shapely
+
+        if predicate not in PREDICATES:
+            raise ValueError(f"predicate must be one of {list(PREDICATES)}")
+        self._build()
+        geometry = as_geometry(geometry)
+        if self._features is None:
+            return np.sort(self._tree.query(geometry, predicate=predicate))
+
+        candidates = np.sort(self._tree.query(geometry))
+        if not len(candidates):
+            return candidates
+        shapes = self._shapes(candidates)
+        matches = np.zeros(len(candidates), dtype=bool)
+        present = ~np.equal(shapes, None)
+        matches[present] = getattr(shapely, predicate)(geometry, shapes[present])
+        return candidates[matches]
+
+    def clip(self, geometry, chunk_size=10000):
+        """Clips the features intersecting a geometry to it, one chunk of candidates at a time.
+
+        The tree selects the candidates whose bounding boxes intersect the
+        geometry. Each chunk is then tested and clipped with vectorized
+        shapely operations against the prepared geometry; features lying
+        entirely inside it are kept as they are, without computing an
+        intersection.
+
+        Args:
+            geometry (tuple | dict | shapely.Geometry): The clip geometry, see as_geometry().
+            chunk_size (int, optional): The number of candidates per chunk. Defaults to 10000.
+
+        Yields:
+            tuple: The indices of the clipped features, their clipped geometries,
+                and the number of candidates processed so far out of the total.
+        """
+        import numpy as np
+        import shapely
+
+        self._build()
+        geometry = as_geometry(geometry)
+        shapely.prepare(geometry)
+        candidates = np.sort(self._tree.query(geometry))
+        for start in range(0, len(candidates), chunk_size):
+            chunk = candidates[start : start + chunk_size]
+            shapes = self._shapes(chunk)
+            present = ~np.equal(shapes, None)
+            chunk, shapes = chunk[present], shapes[present]
+
+            inside = shapely.contains_properly(geometry, shapes)
+            crossing = ~inside & shapely.intersects(geometry, shapes)
+            clipped = shapes.copy()
+            clipped[crossing] = shapely.intersection(shapes[crossing], geometry)
+            keep = inside | (crossing & ~shapely.is_empty(clipped))
+            yield chunk[keep], clipped[keep], (min(start + chunk_size, len(candidates)), len(candidates))
+
+    def properties(self, indices):
+        """Returns the properties of features by index.
+
+        Args:
+            indices (array-like): The feature indices.
+
+        Returns:
+            list: The property dicts.
+        """
+        self._build()
+        if self._frame is not None:
+            frame = self._frame.iloc[list(indices)]
+            return frame.drop(columns=frame.geometry.name).to_dict("records")
+        return [self._features[i].get("properties") or {} for i in indices]
+
+    def features(self, indices):
+        """Returns features by index as GeoJSON.
+
+        Args:
+            indices (array-like): The feature indices, e.g. from query().
+
+        Returns:
+            list: The GeoJSON features.
+        """
+        self._build()
+        if self._frame is not None:
+            return self._frame.iloc[list(indices)].__geo_interface__["features"]
+        return [self._features[i] for i in indices]
+
+
+def drawn_geometry(geo_json):
+    """Converts a shape drawn with the draw control to a geometry.
+
+    Circles are drawn as a center point with a radius in meters, and are
+    converted to polygons, scaling the longitude by the latitude of the center.
+
+    Args:
+        geo_json (dict): The GeoJSON feature of the drawn shape.
+
+    Returns:
+        shapely.Geometry: The geometry.
+    """
+    import math
+
+    import shapely
+    from shapely import affinity
+    from shapely.geometry import shape
+
+    geometry = shape(geo_json["geometry"])
+    properties = geo_json.get("properties") or {}
+    radius = properties.get("radius", (properties.get("style") or {}).get("radius"))
+    if geometry.geom_type == "Point" and radius:
+        degrees = radius / 111320
+        circle = geometry.buffer(degrees, quad_segs=32)
+        return affinity.scale(circle, xfact=1 / max(math.cos(math.radians(geometry.y)), 1e-6), yfact=1)
+    return shapely.make_valid(geometry)
+
+
+class AttributeSummary:
+    """Summarizes feature properties incrementally, as chunks of features arrive.
+
+    Numeric attributes keep their count, sum, minimum and maximum; other
+    attributes keep the counts of their values.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.numeric = {}
+        self.categories = {}
+
+    def update(self, properties):
+        """Adds the properties of a chunk of features.
+
+        Args:
+            properties (list): The property dicts.
+        """
+        from collections import Counter
+
+        import pandas as pd
+
+        if not len(properties):
+            return
+        self.count += len(properties)
+        df = pd.DataFrame.from_records(properties)
+        for column in df.columns:
+            values = df[column].dropna()
+            if not len(values):
+                continue
+            if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+                stats = self.numeric.setdefault(column, {"count": 0, "sum": 0.0, "min": None, "max": None})
+                stats["count"] += len(values)
+                stats["sum"] += float(values.sum())
+                low, high = float(values.min()), float(values.max())
+                stats["min"] = low if stats["min"] is None else min(stats["min"], low)
+                stats["max"] = high if stats["max"] is None else max(stats["max"], high)
+            else:
+                counts = self.categories.setdefault(column, Counter())
+                counts.update(values.astype(str).value_counts().to_dict())
+
+    def to_dict(self, top=3):
+        """Returns the summary.
+
+        Args:
+            top (int, optional): The number of most common values kept for non-numeric attributes. Defaults to 3.
+
+        Returns:
+            dict: The feature count, the count, sum, mean, minimum and maximum of
+                numeric attributes, and the number of distinct and most common values of the others.
+        """
+        attributes = {}
+        for column, stats in self.numeric.items():
+            attributes[column] = {**stats, "mean": stats["sum"] / stats["count"]}
+        for column, counts in self.categories.items():
+            attributes[column] = {"distinct": len(counts), "top": counts.most_common(top)}
+        return {"count": self.count, "attributes": attributes}
+
+    def to_html(self, top=3):
+        """Returns the summary as an HTML table.
+
+        Args:
+            top (int, optional): The number of most common values shown for non-numeric attributes. Defaults to 3.
+
+        Returns:
+            str: The HTML.
+        """
+        import html
+
+        rows = []
+        for column, stats in self.to_dict(top=top)["attributes"].items():
+            if "mean" in stats:
+                text = f"{stats['min']:.4g} to {stats['max']:.4g}, mean {stats['mean']:.4g}, sum {stats['sum']:.4g}"
+            else:
+                common = ", ".join(f"{value} ({count})" for value, count in stats["top"])
+                text = f"{stats['distinct']} values: {common}"
+            rows.append(f"<tr><td>{html.escape(str(column))}</td><td>{html.escape(text)}</td></tr>")
+        return f"<table>{''.join(rows)}</table>"
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thinkgreen-clip")
+        return _executor
+
+
+def clip_layers(indexes, geometry, chunk_size=10000, on_progress=None, cancel=None):
+    """Clips the features of several indexed layers to a geometry and summarizes them.
+
+    Args:
+        indexes (dict): The SpatialIndex of each layer, by layer key.
+        geometry (tuple | dict | shapely.Geometry): The clip geometry, see as_geometry().
+        chunk_size (int, optional): The number of candidates per chunk. Defaults to 10000.
+        on_progress (callable, optional): Called after each chunk with the layer key,
+            its AttributeSummary, and the number of candidates processed so far and in total.
+            Defaults to None.
+        cancel (threading.Event, optional): Stops the clip between chunks once set. Defaults to None.
+
+    Returns:
+        dict: The clipped features of each layer as a GeoDataFrame, by layer key,
+            or None if the clip was cancelled.
+    """
+    import geopandas as gpd
+    import numpy as np
+
+    geometry = as_geometry(geometry)
+    results = {}
+    for key, index in indexes.items():
+        summary = AttributeSummary()
+        indices, geometries = [], []
+        for chunk, clipped, progress in index.clip(geometry, chunk_size=chunk_size):
+            if cancel is not None and cancel.is_set():
+                return None
+            summary.update(index.properties(chunk))
+            indices.append(chunk)
+            geometries.append(clipped)
+            if on_progress is not None:
+                on_progress(key, summary, *progress)
+        if on_progress is not None and not indices:
+            on_progress(key, summary, 0, 0)
+        indices = np.concatenate(indices) if indices else np.empty(0, dtype=np.int64)
+        geometries = np.concatenate(geometries) if geometries else np.empty(0, dtype=object)
+        results[key] = gpd.GeoDataFrame(
+            index.properties(indices), geometry=list(geometries), crs="EPSG:4326"
+        )
+    return results
+
+
+def submit_clip(indexes, geometry, chunk_size=10000, on_progress=None, cancel=None):
+    """Runs clip_layers() on the clip worker thread.
+
+    Args:
+        indexes (dict): The SpatialIndex of each layer, by layer key.
+        geometry (tuple | dict | shapely.Geometry): The clip geometry, see as_geometry().
+        chunk_size (int, optional): The number of candidates per chunk. Defaults to 10000.
+        on_progress (callable, optional): See clip_layers(). Defaults to None.
+        cancel (threading.Event, optional): See clip_layers(). Defaults to None.
+
+    Returns:
+        concurrent.futures.Future: A future of the clipped layers.
+    """
+    return _get_executor().submit(
+        clip_layers, indexes, geometry, chunk_size=chunk_size, on_progress=on_progress, cancel=cancel
+    )
@@ -0,0 +1,135 @@
+// Decoder for the binary vector format written by thinkgreen.topobuf.encode.
+// Defines thinkgreenTopobuf.decode(input), where input is an ArrayBuffer, a
+// Uint8Array or a base64 string; it returns a GeoJSON FeatureCollection.
+(function (root) {
+    "use strict";
+
+    var TYPES = ["", "Point", "MultiPoint", "LineString", "MultiLineString", "Polygon", "MultiPolygon"];
+
+    function toBytes(input) {
+        if (typeof input === "string") {
+            var binary = atob(input);
+            var bytes = new Uint8Array(binary.length);
+            for (var i = 0; i < binary.length; i++) {
+                bytes[i] = binary.charCodeAt(i);
+            }
+            return bytes;
+        }
+        return input instanceof Uint8Array ? input : new Uint8Array(input);
+    }
+
+    // Zigzag varints; values stay exact up to 2^53.
+    function readVarints(bytes, start) {
+        var values = [];
+        var value = 0;
+        var shift = 1;
+        for (var i = start; i < bytes.length; i++) {
+            var b = bytes[i];
+            value += (b & 0x7f) * shift;
+            if (b < 0x80) {
+                values.push(value % 2 ? -(value + 1) / 2 : value / 2);
+                value = 0;
+                shift = 1;
+            } else {
+                shift *= 128;
+            }
+        }
+        return values;
+    }
+
+    function decode(input) {
+        var bytes = toBytes(input);
+        if (String.fromCharCode(bytes[0], bytes[1], bytes[2], bytes[3]) !== "TGB1") {
+            throw new Error("Not a thinkgreen binary vector buffer.");
+        }
+        var length = bytes[4] | (bytes[5] << 8) | (bytes[6] << 16) | (bytes[7] << 24);
+        var header = JSON.parse(new TextDecoder("utf-8").decode(bytes.subarray(8, 8 + length)));
+        var values = readVarints(bytes, 8 + length);
+        var scale = Math.pow(10, header.precision);
+        var pos = 0;
+
+        function read() {
+            return values[pos++];
+        }
+
+        var arcs = [];
+        var nArcs = values.length ? read() : 0;
+        for (var a = 0; a < nArcs; a++) {
+            var n = read();
+            var arc = new Array(n);
+            var x = 0;
+            var y = 0;
+            for (var j = 0; j < n; j++) {
+                x += read();
+                y += read();
+                arc[j] = [x / scale, y / scale];
+            }
+            arcs.push(arc);
+        }
+
+        function line() {
+            var coords = [];
+            var count = read();
+            for (var i = 0; i < count; i++) {
+                var ref = read();
+                var arc = ref >= 0 ? arcs[ref] : arcs[~ref].slice().reverse();
+                for (var k = i === 0 ? 0 : 1; k < arc.length; k++) {
+                    coords.push(arc[k]);
+                }
+            }
+            return coords;
+        }
+
+        function repeat(count, fn) {
+            var out = new Array(count);
+            for (var i = 0; i < count; i++) {
+                out[i] = fn();
+            }
+            return out;
+        }
+
+        var features = [];
+        for (var f = 0; f < header.properties.length; f++) {
+            var type = TYPES[read()];
+            var geometry = null;
+            if (type === "Point") {
+                geometry = { type: type, coordinates: [read() / scale, read() / scale] };
+            } else if (type === "MultiPoint") {
+                var px = 0;
+                var py = 0;
+                geometry = {
+                    type: type,
+                    coordinates: repeat(read(), function () {
+                        px += read();
+                        py += read();
+                        return [px / scale, py / scale];
+                    }),
+                };
+            } else if (type === "LineString") {
+                geometry = { type: type, coordinates: line() };
+            } else if (type === "MultiLineString" || type === "Polygon") {
+                geometry = { type: type, coordinates: repeat(read(), line) };
+            } else if (type === "MultiPolygon") {
+                geometry = {
+                    type: type,
+                    coordinates: repeat(read(), function () {
+                        return repeat(read(), line);
+                    }),
+                };
+            }
+            var feature = { type: "Feature", geometry: geometry, properties: header.properties[f] };
+            if (header.ids && header.ids[f] !== null && header.ids[f] !== undefined) {
+                feature.id = header.ids[f];
+            }
+            features.push(feature);
+        }
+        return { type: "FeatureCollection", features: features };
+    }
+
+    var api = { decode: decode };
+    if (typeof module !== "undefined" && module.exports) {
+        module.exports = api;
+    } else {
+        root.thinkgreenTopobuf = api;
+    }
+})(typeof self !== "undefined" ? self : this);
@@ -0,0 +1,117 @@
+"""Helpers for building Streamlit apps with thinkgreen maps.
+
+Lookups and data loads are cached across reruns and sessions with
+``st.cache_data``, and the map itself is kept in the session state, so a
+rerun triggered by a sidebar widget only rebuilds the layers that changed.
+
+Example:
+    >>> import streamlit as st
+    >>> from thinkgreen import streamlit_utils as stu
+    >>> m = stu.get_map()
+    >>> names = st.multiselect("Basemaps", stu.search_basemaps("esri"))
+    >>> m.set_layers({name: stu.basemap_layer(name) for name in names})
+    >>> m.to_streamlit(height=600)
+"""
+
+import streamlit as st
+
+
+@st.cache_data(show_spinner=False)
+def search_basemaps(keyword, free_only=True, limit=None):
+    """Searches the available basemaps by keyword, cached across reruns.
+
+    Args:
+        keyword (str): The keyword to search for in basemap names and attributions.
+        free_only (bool, optional): Exclude basemaps that need an API key. Defaults to True.
+        limit (int, optional): The maximum number of results. Defaults to None.
+
+    Returns:
+        list: The names of the matching basemaps.
+    """
+    from .basemaps import search_basemaps
+
+    return search_basemaps(keyword, free_only=free_only, limit=limit)
+
+
+@st.cache_data(show_spinner=False, ttl=24 * 3600)
+def search_qms(keyword, limit=20):
+    """Searches Quick Map Services basemaps by keyword, cached for a day.
+
+    Args:
+        keyword (str): The keyword to search for.
+        limit (int, optional): The maximum number of results. Defaults to 20.
+
+    Returns:
+        list: The names of the matching services, prefixed with "qms.".
+    """
+    from .basemaps import search_qms
+
+    return search_qms(keyword, limit=limit)
+
+
+@st.cache_data(show_spinner=False, ttl=24 * 3600)
+def get_basemap(name):
+    """Returns the entry of a basemap, including Quick Map Services ones, cached across reruns.
+
+    Args:
+        name (str): The basemap name, e.g. "Esri.WorldImagery" or "qms.OpenTopoMap".
+
+    Returns:
+        dict: The basemap entry with its "name", "url" and "attribution".
+    """
+    from .basemaps import get_basemap, get_qms_basemap
+
+    return get_qms_basemap(name) if name.startswith("qms.") else get_basemap(name)
+
+
+@st.cache_data(show_spinner=False)
+def read_file(path, **kwargs):
+    """Reads a vector file into a GeoDataFrame, cached across reruns.
+
+    Args:
+        path (str): The path or URL of the file.
+        kwargs: Keyword arguments to pass to geopandas.read_file.
+
+    Returns:
+        geopandas.GeoDataFrame: The data.
+    """
+    import geopandas as gpd
+
+    return gpd.read_file(path, **kwargs)
+
+
+def basemap_layer(name):
+    """Returns a function building the tile layer of a basemap, for Map.set_layers.
+
+    Args:
+        name (str): The basemap name, see get_basemap.
+
+    Returns:
+        callable: A function without arguments that returns a folium.TileLayer.
+    """
+    import folium
+
+    def build():
+        entry = get_basemap(name)
+        return folium.TileLayer(
+            tiles=entry["url"], name=entry["name"], attr=entry["attribution"], overlay=True
+        )
+
+    return build
+
+
+def get_map(key="thinkgreen_map", **kwargs):
+    """Returns the map kept in the session state, creating it on the first run.
+
+    Args:
+        key (str, optional): The session state key. Defaults to "thinkgreen_map".
+        kwargs: Keyword arguments to pass to thinkgreen.foliumap.Map on the first run.
+
+    Returns:
+        thinkgreen.foliumap.Map: The map.
+    """
+    if key not in st.session_state:
+        from .foliumap import Map
+
+        st.session_state[key] = Map(**kwargs)
+    return st.session_state[key]
@@ -1,11 +1,10 @@
 """Main module."""
 
-import string
-import random
-import ipyleaflet 
-import streamlit
-import numpy
-import matplotlib
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import ipyleaflet
 import ipywidgets as widgets
 
 class Map(ipyleaflet.Map):
@@ -15,6 +14,12 @@ class Map(ipyleaflet.Map):
             if "scroll_wheel_zoom" not in kwargs:
                 kwargs["scroll_wheel_zoom"] = True
 
+            self._batch = None
+            self.profiler = None
+            if os.environ.get("THINKGREEN_PROFILE", "0") not in ("", "0"):
+                from .profiler import Profiler
+
+                Profiler(self).start()
             super().__init__(center=center, zoom=zoom, **kwargs)
 
             if "height" not in kwargs:
@@ -32,24 +37,231 @@ class Map(ipyleaflet.Map):
             if kwargs["layers_control"]:
                 self.add_layers_control()
 
-        def add_search_control(self, position="topleft", **kwargs):
+            self._vector_levels = {}
+            self._payload_sizes = {}
+            self.observe(self._update_vector_levels, names="zoom")
+
+            self._tile_cache = None
+            self._tile_proxies = []
+            self._proxied_urls = {}
+            self.observe(self._prefetch_tiles, names="bounds")
+
+            self.basemap_pool_size = 2
+            self._basemap_pool = OrderedDict()
+            self._basemap_layer = None
+
+            self._spatial_indexes = {}
+            self._cleanups = {}
+            self._clip_job = None
+            self._clip_control = None
+            self._draw_control = None
+
+        @contextmanager
+        def batch(self):
+            """Queues map changes and sends them to the frontend as one update.
+
+            Inside the block, layers and controls added to the map are queued
+            and assigned in one go when the block exits, and trait changes
+            such as center and zoom are held and synced together. Only the
+            last ``fit_bounds`` call is kept and run after the update is sent.
+            Batches can be nested; changes are sent when the outermost exits.
+
+            Note that ``m.layers`` and ``m.controls`` only include the queued
+            items once the block has exited.
+
+            Example:
+                >>> with m.batch():
+                ...     for url in urls:
+                ...         m.add_tile_layer(url, name=url)
+
+            Yields:
+                thinkgreen.Map: The map.
+            """
+            if self._batch is not None:
+                yield self
+                return
+
+            self._batch = {"fit_bounds": None}
+            try:
+                with self.hold_sync():
+                    try:
+                        yield self
+                    finally:
+                        bounds = self._batch["fit_bounds"]
+                        self._flush_batch()
+                        if bounds is not None:
+                            (south, west), (north, east) = bounds
+                            self.center = ((south + north) / 2, (west + east) / 2)
+            finally:
+                self._batch = None
+            if bounds is not None:
+                self.fit_bounds(bounds)
+
+        def _flush_batch(self):
+            """Assigns the layers and controls queued by the current batch."""
+            if self._batch is None:
+                return
+            if "layers" in self._batch:
+                self.layers = tuple(self._batch.pop("layers"))
+                del self._batch["layer_ids"]
+            if "controls" in self._batch:
+                self.controls = tuple(self._batch.pop("controls"))
+                del self._batch["control_ids"]
+
+        def profile(self, memory=True):
+            """Profiles the add_* calls made on the map.
+
+            Each call records its wall time, its peak Python memory, the bytes
+            of widget messages serialized for the frontend, and the number of
+            layers and controls afterwards. Calls made by other add_* calls
+            are recorded too, with their depth. Profiling only costs anything
+            while it runs. Setting the ``THINKGREEN_PROFILE`` environment
+            variable to 1 starts a profiler for every new map instead, kept
+            in ``m.profiler``.
+
+            Example:
+                >>> with m.profile() as p:
+                ...     m.add_shp("countries.shp")
+                >>> p.report()
+
+            Args:
+                memory (bool, optional): Record peak memory with tracemalloc,
+                    which slows the profiled calls down. Defaults to True.
+
+            Returns:
+                thinkgreen.profiler.Profiler: The profiler, to use as a context manager.
+            """
+            from .profiler import Profiler
+
+            return Profiler(self, memory=memory)
+
+        def add(self, item, index=None):
+            """Adds a layer or a control to the map, queueing it inside a batch.
+
+            Args:
+                item (ipyleaflet.Layer | ipyleaflet.Control): The layer or control to add.
+                index (int, optional): The index to insert a layer at. Defaults to None (on top).
+
+            Returns:
+                thinkgreen.Map: The map.
+            """
+            if self._batch is None:
+                return super().add(item, index=index)
+
+            if hasattr(item, "as_leaflet_layer"):
+                item = item.as_leaflet_layer()
+            if isinstance(item, ipyleaflet.Layer):
+                kind, error = "layer", ipyleaflet.LayerException
+            elif isinstance(item, ipyleaflet.Control):
+                kind, error = "control", ipyleaflet.ControlException
+            else:
+                return self
+
+            if f"{kind}s" not in self._batch:
+                items = list(getattr(self, f"{kind}s"))
+                self._batch[f"{kind}s"] = items
+                self._batch[f"{kind}_ids"] = {i.model_id for i in items}
+            items, ids = self._batch[f"{kind}s"], self._batch[f"{kind}_ids"]
+
+            if item.model_id in ids:
+                raise error(f"{kind} already on map: {item!r}")
+            if index is None or kind == "control":
+                items.append(item)
+            elif not isinstance(index, int) or index < 0 or index > len(items):
+                raise ValueError("Invalid index value")
+            else:
+                items.insert(index, item)
+            ids.add(item.model_id)
+            return self
+
+        def remove(self, item):
+            """Removes a layer or a control, first applying the changes queued by a batch."""
+            self._flush_batch()
+            self._drop_index(item)
+            result = super().remove(item)
+            self._run_cleanups(item)
+            return result
+
+        def _on_remove(self, item, callback):
+            """Registers a callback to run when a layer or control is removed from the map.
+
+            Args:
+                item (ipyleaflet.Layer | ipyleaflet.Control): The layer or control.
+                callback (callable): Called without arguments, e.g. to stop observing the map.
+            """
+            self._cleanups.setdefault(item.model_id, []).append(callback)
+
+        def _run_cleanups(self, item):
+            """Runs the callbacks registered with _on_remove for an item and the layers of a group."""
+            if isinstance(item, ipyleaflet.LayerGroup):
+                for child in item.layers:
+                    self._run_cleanups(child)
+            for callback in self._cleanups.pop(getattr(item, "model_id", None), []):
+                callback()
+
+        def substitute(self, old, new):
+            """Replaces a layer or a control, first applying the changes queued by a batch."""
+            self._flush_batch()
+            return super().substitute(old, new)
+
+        def clear(self):
+            """Removes all layers and controls, including those queued by a batch."""
+            self._flush_batch()
+            for layer, _ in list(self._spatial_indexes.values()):
+                self._drop_index(layer)
+            result = super().clear()
+            for callbacks in list(self._cleanups.values()):
+                for callback in callbacks:
+                    callback()
+            self._cleanups.clear()
+            return result
+
+        def fit_bounds(self, bounds):
+            """Fits the map view to bounds, deferring to the end of the current batch.
+
+            Args:
+                bounds (list): The [[south, west], [north, east]] bounds.
+            """
+            if self._batch is not None:
+                self._batch["fit_bounds"] = bounds
+            else:
+                super().fit_bounds(bounds)
+
+        def add_search_control(self, position="topleft", gazetteer=None, **kwargs):
             """Adds a search control to the map.
             Args:
+                gazetteer (str | thinkgreen.geocoder.Gazetteer, optional): A gazetteer index, or the
+                    path to one, to search offline instead of Nominatim. See geocoder.build_gazetteer().
+                    Defaults to None.
                 kwargs: Keyword arguments to pass to the search control.
             
             Returns:
                 ipyleaflet.SearchControl: The search control.
             """
+            if gazetteer is not None:
+                from .geocoder import Gazetteer
+
+                if isinstance(gazetteer, str):
+                    gazetteer = Gazetteer(gazetteer)
+                kwargs.setdefault("url", gazetteer.serve())
             if "url" not in kwargs:
                 kwargs["url"] = 'https://nominatim.openstreetmap.org/search?format=json&q={s}'
         
 
             search_control = ipyleaflet.SearchControl(position=position, **kwargs)
             self.add_control(search_control)
+            return search_control
 
-        def add_draw_control(self, **kwargs):
+        def add_draw_control(self, clip=True, chunk_size=10000, **kwargs):
             """Adds a draw control to the map.
+
+            With ``clip``, each polygon, rectangle or circle drawn clips the
+            visible vector layers, see clip_layers().
+
             Args:
+                clip (bool, optional): Whether to clip and summarize the vector layers by drawn shapes. Defaults to True.
+                chunk_size (int, optional): The number of candidate features clipped between summary updates.
+                    Defaults to 10000.
                 kwargs: Keyword arguments to pass to the draw control.
             
             Returns:
@@ -91,7 +303,162 @@ class Map(ipyleaflet.Map):
                 }
             }
 
+            if clip:
+
+                def handle_draw(target, action, geo_json):
+                    from .spatial import drawn_geometry
+
+                    if action == "created" and geo_json["geometry"]["type"] in ("Polygon", "Point"):
+                        self.clip_layers(drawn_geometry(geo_json), chunk_size=chunk_size)
+                    elif action == "deleted" and self._clip_job is not None:
+                        self._clip_job.set()
+                        self._clip_job = None
+
+                draw_control.on_draw(handle_draw)
+
             self.add_control(draw_control)
+            self._draw_control = draw_control
+            return draw_control
+
+        def clip_layers(self, geometry, layers=None, chunk_size=10000, show=True):
+            """Clips the visible vector layers to a geometry and summarizes their attributes.
+
+            Candidate features are selected with the spatial index of each
+            layer, then clipped with vectorized shapely operations on a worker
+            thread, one chunk at a time, so the map stays responsive. With
+            ``show``, a summary control on the map is updated after each chunk
+            with the feature count and attribute summaries of each layer.
+            Starting a new clip cancels the previous one.
+
+            Args:
+                geometry (tuple | dict | shapely.Geometry): A (minx, miny, maxx, maxy) bounding box,
+                    a GeoJSON geometry or a shapely geometry.
+                layers (list, optional): The layers or layer names to clip. Defaults to all visible vector layers.
+                chunk_size (int, optional): The number of candidate features clipped between summary updates.
+                    Defaults to 10000.
+                show (bool, optional): Whether to show the summaries on the map. Defaults to True.
+
+            Returns:
+                concurrent.futures.Future: A future of the clipped features of each layer
+                    as a GeoDataFrame, by layer model_id, or of None if the clip is cancelled.
+            """
+            import html
+            import threading
+
+            from .spatial import submit_clip
+
+            if layers is not None:
+                layers = [layer if isinstance(layer, str) else layer.model_id for layer in layers]
+            indexes, names = {}, {}
+            for layer, index in self._spatial_indexes.values():
+                if layers is None and not layer.visible:
+                    continue
+                if layers is not None and layer.name not in layers and layer.model_id not in layers:
+                    continue
+                indexes[layer.model_id] = index
+                names[layer.model_id] = layer.name
+
+            if self._clip_job is not None:
+                self._clip_job.set()
+            cancel = self._clip_job = threading.Event()
+
+            progress = None
+            if show:
+                if self._clip_control is None:
+                    self._clip_control = ipyleaflet.WidgetControl(
+                        widget=widgets.HTML(), position="bottomleft"
+                    )
+                content = self._clip_control.widget
+                content.value = "<b>Clipping...</b>" if indexes else "<b>No vector layers to clip.</b>"
+                if self._clip_control not in self.controls:
+                    self.add(self._clip_control)
+                sections = {}
+
+                def show_progress(key, summary, done, total):
+                    if cancel.is_set():
+                        return
+                    status = "" if done == total else f" (scanned {done:,} of {total:,} candidates)"
+                    sections[key] = (
+                        f"<b>{html.escape(str(names[key]))}</b>: {summary.count:,} features{status}"
+                        f"{summary.to_html()}"
+                    )
+                    content.value = "".join(sections.values())
+
+                progress = show_progress
+
+            return submit_clip(indexes, geometry, chunk_size=chunk_size, on_progress=progress, cancel=cancel)
+
+        def zonal_stats(self, raster_path, polygons=None, band=1, bins=10, processes=None, **kwargs):
+            """Computes the statistics of a local raster under polygons.
+
+            Only the pixels under each polygon are read, in block-aligned
+            windows spread over a process pool, see thinkgreen.raster.zonal_stats().
+
+            Args:
+                raster_path (str): The path to a local GeoTIFF.
+                polygons (str | ipyleaflet.Layer | ipyleaflet.DrawControl | dict | geopandas.GeoDataFrame, optional):
+                    The name of a vector layer, a vector layer, a draw control, GeoJSON data or a GeoDataFrame.
+                    Defaults to the shapes drawn with the draw control of the map.
+                band (int, optional): The 1-based band index. Defaults to 1.
+                bins (int, optional): The number of histogram bins. Defaults to 10.
+                processes (int, optional): The number of worker processes. Defaults to the number of CPUs
+                    for large reads.
+                kwargs: Keyword arguments to pass to thinkgreen.raster.zonal_stats, e.g. hist_range or nodata.
+
+            Returns:
+                geopandas.GeoDataFrame: The polygons and their properties, with the "count", "sum",
+                    "mean", "min", "max" and "histogram" columns added.
+            """
+            import geopandas as gpd
+
+            from .raster import zonal_stats
+            from .spatial import drawn_geometry
+
+            if polygons is None:
+                if self._draw_control is None:
+                    raise ValueError("No polygons given and no draw control on the map.")
+                polygons = self._draw_control
+            if isinstance(polygons, ipyleaflet.DrawControl):
+                features = [
+                    feature for feature in polygons.data
+                    if feature["geometry"]["type"] in ("Polygon", "MultiPolygon", "Point")
+                ]
+                gdf = gpd.GeoDataFrame(
+                    [{} for _ in features],
+                    geometry=[drawn_geometry(feature) for feature in features],
+                    crs="EPSG:4326",
+                )
+            else:
+                if isinstance(polygons, (str, ipyleaflet.Layer)):
+                    name = polygons
+                    polygons = None
+                    for layer, index in self._spatial_indexes.values():
+                        if layer is name or layer.name == name:
+                            polygons = index.data
+                            break
+                    if polygons is None:
+                        raise ValueError(f"No vector layer named {name!r} on the map.")
+                if isinstance(polygons, gpd.GeoDataFrame):
+                    gdf = polygons if polygons.crs is not None else polygons.set_crs(epsg=4326)
+                else:
+                    if isinstance(polygons, dict):
+                        polygons = polygons.get("features", [polygons])
+                    gdf = gpd.GeoDataFrame.from_features(polygons, crs="EPSG:4326")
+
+            stats = zonal_stats(
+                raster_path,
+                list(gdf.geometry),
+                crs=gdf.crs,
+                band=band,
+                bins=bins,
+                processes=processes,
+                **kwargs,
+            )
+            gdf = gdf.copy()
+            for column in ("count", "sum", "mean", "min", "max", "histogram"):
+                gdf[column] = [item[column] for item in stats]
+            gdf.attrs["bin_edges"] = stats[0]["bin_edges"] if stats else None
+            return gdf
 
         def add_layers_control(self, position="topright"):
             """Adds a layers control to the map.
@@ -126,111 +493,749 @@ class Map(ipyleaflet.Map):
             Returns:
                 ipyleaflet.TileLayer: Adds a new layer to the map.
             """
+            url = self._proxy_tile_url(url, kwargs.get("subdomains", "abc"))
             tile_layer = ipyleaflet.TileLayer(url=url, attribution=attribution, name=name, **kwargs)
             self.add_layer(tile_layer)
+            self._on_remove(tile_layer, lambda: self._release_proxy(url))
+            return tile_layer
+
+        def _proxy_tile_url(self, url, subdomains="abc"):
+            """Returns the URL to load a remote tile service from, through the tile cache if enabled."""
+            if self._tile_cache is None or not url.startswith(("http://", "https://")):
+                return url
+
+            from .tileserver import TileProxy, get_server
+
+            server = get_server()
+            if url.startswith((server.url, server.client_url)):
+                return url
+            if url not in self._proxied_urls:
+                proxy = TileProxy(
+                    url,
+                    cache=self._tile_cache,
+                    offline=self._tile_offline,
+                    subdomains=subdomains,
+                )
+                self._tile_proxies.append(proxy)
+                self._proxied_urls[url] = proxy.serve()
+            return self._proxied_urls[url]
+
+        def _release_proxy(self, url):
+            """Unregisters the proxy serving a tile URL once no layer of the map uses it."""
+            layers = list(self.layers) + list(self._basemap_pool.values())
+            if any(getattr(layer, "url", None) == url for layer in layers):
+                return
+            for remote, local in list(self._proxied_urls.items()):
+                if local == url:
+                    del self._proxied_urls[remote]
+                    for proxy in [p for p in self._tile_proxies if p.url == remote]:
+                        proxy.close()
+                        self._tile_proxies.remove(proxy)
+
+        def enable_tile_cache(self, cache_dir=None, max_bytes=512 * 1024 * 1024, offline=False, prefetch=True):
+            """Routes tile layers added afterwards through a local caching tile proxy.
+
+            Tiles are kept in a content-addressed disk cache shared across
+            kernel restarts. When prefetching, the ring of tiles around the
+            viewport and the tiles of the next zoom level are fetched in the
+            background. In offline mode only cached tiles are served.
+
+            Args:
+                cache_dir (str, optional): The cache directory. Defaults to ~/.cache/thinkgreen/tiles.
+                max_bytes (int, optional): The maximum size of the cache. Defaults to 512 MiB.
+                offline (bool, optional): Whether to only serve cached tiles. Defaults to False.
+                prefetch (bool, optional): Whether to prefetch tiles around the viewport. Defaults to True.
+            """
+            from .cache import DiskTileCache
+
+            if self._tile_cache is None or cache_dir is not None:
+                self._tile_cache = DiskTileCache(cache_dir, max_bytes=max_bytes)
+                self._proxied_urls = {}
+            self._tile_cache.max_bytes = max_bytes
+            self._tile_offline = offline
+            self._tile_prefetch = prefetch
+            for proxy in self._tile_proxies:
+                proxy.offline = offline
+
+        def _prefetch_tiles(self, change):
+            """Prefetches the tiles of the proxied layers on the map around the new viewport."""
+            if self._tile_cache is None or not self._tile_prefetch:
+                return
+            urls = {getattr(layer, "url", None) for layer in self.layers}
+            for proxy in self._tile_proxies:
+                if self._proxied_urls.get(proxy.url) in urls:
+                    proxy.prefetch(change["new"], self.zoom)
 
         def add_basemap(self, basemap, **kwargs):
             """Adds a base layer to the map.
 
             Args:
-                basemap (dict): The basemap layer from an xyz url.
+                basemap (str): The name of the basemap, e.g. "SATELLITE" or
+                    "OpenStreetMap.Mapnik". See thinkgreen.search_basemaps().
+                kwargs: API keys for basemaps that need one (e.g. apikey="..."),
+                    and keyword arguments to pass to the tile layer.
 
             Returns:
                 xyzservices.providers: Adds a tile layer as a basemap.
             """
+            entry, url = self._resolve_basemap(basemap, kwargs)
+            self.add_tile_layer(url, name=entry["name"], attribution=entry["attribution"], **kwargs)
+
+        def _resolve_basemap(self, basemap, kwargs):
+            """Looks up a basemap and fills in the API keys it needs, popping them from kwargs."""
+            from .basemaps import get_basemap
+
+            entry = get_basemap(basemap)
+            url = entry["url"]
+            for token in entry["tokens"]:
+                if token not in kwargs:
+                    raise ValueError(f"Basemap '{basemap}' requires the '{token}' argument.")
+                url = url.replace("{%s}" % token, kwargs.pop(token))
+            return entry, url
+
+        def set_basemap(self, basemap, **kwargs):
+            """Shows a basemap in the basemap slot of the map.
+
+            Unlike add_basemap, switching basemaps does not stack tile layers:
+            the slot holds a single layer on the map, so only one basemap is
+            ever fetched and drawn. Up to ``basemap_pool_size`` recently used
+            basemap layers are kept warm, so switching back to one of them
+            re-adds the existing layer. Beyond that, the least recently used
+            layer is reused by swapping its URL in place.
 
-            import xyzservices.providers as xyz
+            Args:
+                basemap (str): The name of the basemap, e.g. "SATELLITE" or
+                    "OpenStreetMap.Mapnik". See thinkgreen.search_basemaps().
+                kwargs: API keys for basemaps that need one (e.g. apikey="..."),
+                    and keyword arguments to pass to the tile layer.
 
-            if basemap.lower() == "roadmap":
-                url = 'http://mt0.google.com/vt/lyrs=m&hl=en&x={x}&y={y}&z={z}'
-                self.add_tile_layer(url, name=basemap, **kwargs)
-            elif basemap.lower() == "satellite":
-                url = 'http://mt0.google.com/vt/lyrs=y&hl=en&x={x}&y={y}&z={z}'
-                self.add_tile_layer(url, name=basemap, **kwargs)
-            elif basemap.lower() == "terrain":
-                url = 'http://mt0.google.com/vt/lyrs=p&hl=en&x={x}&y={y}&z={z}'
-                self.add_tile_layer(url, name=basemap, **kwargs)
+            Returns:
+                ipyleaflet.TileLayer: The layer in the basemap slot.
+            """
+            entry, url = self._resolve_basemap(basemap, kwargs)
+            name = entry["name"]
+            url = self._proxy_tile_url(url, kwargs.get("subdomains", "abc"))
+            pool = self._basemap_pool
+
+            if name in pool:
+                layer = pool[name]
+                pool.move_to_end(name)
+            elif len(pool) < max(self.basemap_pool_size, 1):
+                layer = ipyleaflet.TileLayer(
+                    url=url, name=name, attribution=entry["attribution"], base=True, **kwargs
+                )
+                pool[name] = layer
             else:
-                try:
-                    basemap = eval(f"xyz.{basemap}")
-                    url = basemap.build_url() 
-                    attribution = basemap.attribution
-                    self.add_tile_layer(url, name=basemap.name, attribution=attribution, **kwargs)
-                except:
-                    raise ValueError(f"Basemap '{basemap}' not found.")
-        
-
-        def add_geojson(self, data, **kwargs):
+                _, layer = pool.popitem(last=False)
+                with layer.hold_sync():
+                    layer.url = url
+                    layer.name = name
+                    layer.attribution = entry["attribution"]
+                    for key, value in kwargs.items():
+                        setattr(layer, key, value)
+                pool[name] = layer
+
+            if layer is not self._basemap_layer:
+                if self._basemap_layer in self.layers:
+                    self.substitute(self._basemap_layer, layer)
+                elif self.layers and getattr(self.layers[0], "base", False):
+                    self.substitute(self.layers[0], layer)
+                else:
+                    self.add(layer, index=0)
+                self._basemap_layer = layer
+            return layer
+
+        def add_geojson(
+            self,
+            data,
+            bbox=None,
+            max_features=None,
+            properties=None,
+            refresh_on_move=False,
+            simplify=False,
+            zoom_levels=(0, 4, 8, 12, 16),
+            **kwargs,
+        ):
             """Adds a GeoJSON layer to the map.
+
+            File paths are read incrementally, so only the features and
+            properties that pass the filters are ever held in memory. With
+            ``simplify``, a simplified and quantized copy of the data is built
+            for each of ``zoom_levels`` and swapped in as the map zooms.
+
             Args:
-                data (dict): The GeoJSON data.
+                data (str | dict): The path to a GeoJSON file, or the GeoJSON data.
+                bbox (tuple, optional): Only load features intersecting (minx, miny, maxx, maxy). Defaults to None.
+                max_features (int, optional): The maximum number of features to load. Defaults to None.
+                properties (list, optional): The property names to keep. Defaults to all properties.
+                refresh_on_move (bool, optional): Reload the features in view whenever the map
+                    is panned or zoomed, in a background thread. Only applies to file paths.
+                    Defaults to False.
+                simplify (bool, optional): Whether to simplify the data per zoom level. Defaults to False.
+                zoom_levels (tuple, optional): The zoom levels to simplify for. Defaults to (0, 4, 8, 12, 16).
                 kwargs: Keyword arguments to pass to the GeoJSON layer.
 
             Returns:
-                ipyleaflet.Geojson: Adds a GeoJSON layer to map. 
+                ipyleaflet.GeoJSON: Adds a GeoJSON layer to map.
             """
-            import json
-            
-            #for file paths:
-            if isinstance(data, str):
-                with open(data, "r") as f:
-                    data = json.load(f)
+            from .common import read_geojson
+
+            path = data if isinstance(data, str) else None
+
+            if path is not None:
+                data = read_geojson(
+                    path, bbox=bbox, properties=properties, max_features=max_features
+                )
+
+            source = data
+            if simplify:
+                levels, sizes = self._simplify_vector(data, zoom_levels)
+                data = levels[self._pick_level(levels)]
 
             geojson = ipyleaflet.GeoJSON(data=data, **kwargs)
-            self.add_layer(geojson)
-        
+            if simplify:
+                self._track_levels(geojson, levels, sizes)
+            self._index_layer(geojson, source)
+            self.add(geojson)
+
+            if refresh_on_move and path is not None:
+                import threading
+
+                from .common import get_read_executor
+
+                state = {"bbox": bbox, "view": None, "future": None, "removed": False}
+                lock = threading.Lock()
+
+                def load():
+                    # Reads the latest view requested; views requested while reading replace
+                    # each other, so a burst of pans costs at most one more read.
+                    while True:
+                        with lock:
+                            view, state["view"] = state["view"], None
+                            if view is None:
+                                state["future"] = None
+                                return
+                        data = read_geojson(path, bbox=view, properties=properties, max_features=max_features)
+                        with lock:
+                            if state["removed"]:
+                                return
+                            if state["view"] is not None:
+                                continue
+                        self._index_layer(geojson, data)
+                        if simplify:
+                            levels, sizes = self._simplify_vector(data, zoom_levels)
+                            self._track_levels(geojson, levels, sizes)
+                            data = levels[self._pick_level(levels)]
+                        geojson.data = data
+
+                def refresh(change):
+                    (south, west), (north, east) = change["new"]
+                    view = (west, south, east, north)
+                    current = state["bbox"]
+                    if current is not None and (
+                        current[0] <= view[0]
+                        and current[1] <= view[1]
+                        and current[2] >= view[2]
+                        and current[3] >= view[3]
+                    ):
+                        return
+                    # Pad the view so small pans reuse the loaded subset.
+                    dx, dy = (east - west) / 2, (north - south) / 2
+                    padded = (west - dx, south - dy, east + dx, north + dy)
+                    state["bbox"] = padded
+                    if bbox is not None:
+                        padded = (
+                            max(padded[0], bbox[0]),
+                            max(padded[1], bbox[1]),
+                            min(padded[2], bbox[2]),
+                            min(padded[3], bbox[3]),
+                        )
+                    # The file is read off the kernel thread, which stays free to handle events.
+                    with lock:
+                        state["view"] = padded
+                        if state["future"] is None:
+                            state["future"] = get_read_executor().submit(load)
+
+                def stop():
+                    self.unobserve(refresh, names="bounds")
+                    with lock:
+                        state["removed"] = True
+
+                self.observe(refresh, names="bounds")
+                self._on_remove(geojson, stop)
+
+            return geojson
+
         def add_shp(self, data, name='Shapefile', **kwargs):
             """Adds a Shapefile layer to the map.
 
             Args:
                 data (str): The path to the Shapefile.
-            
+                name (str, optional): The name of the layer. Defaults to 'Shapefile'.
+                kwargs: Keyword arguments to pass to add_gdf.
+
             Returns:
-                ipyleaflet.ShapeFile: Adds a shapefile to map.
+                ipyleaflet.GeoJSON: Adds a shapefile to map.
             """
             import geopandas as gpd
             gdf = gpd.read_file(data)
-            geojson = gdf.__geo_interface__
-            self.add_geojson(geojson, name=name, **kwargs)
+            return self.add_gdf(gdf, name=name, **kwargs)
+
+        def add_gdf(self, gdf, name='GeoDataFrame', simplify=False, zoom_levels=(0, 4, 8, 12, 16), **kwargs):
+            """Adds a GeoDataFrame layer to the map.
+
+            Args:
+                gdf (geopandas.GeoDataFrame): The GeoDataFrame.
+                name (str, optional): The name of the layer. Defaults to 'GeoDataFrame'.
+                simplify (bool, optional): Whether to simplify the data per zoom level. Defaults to False.
+                zoom_levels (tuple, optional): The zoom levels to simplify for. Defaults to (0, 4, 8, 12, 16).
+                kwargs: Keyword arguments to pass to add_geojson.
+
+            Returns:
+                ipyleaflet.GeoJSON: Adds a GeoDataFrame to map.
+            """
+            if gdf.crs is not None and gdf.crs.to_epsg() != 4326:
+                gdf = gdf.to_crs(epsg=4326)
+
+            if simplify:
+                levels, sizes = self._simplify_vector(gdf, zoom_levels)
+                geojson = self.add_geojson(levels[self._pick_level(levels)], name=name, **kwargs)
+                self._track_levels(geojson, levels, sizes)
+            else:
+                geojson = self.add_geojson(gdf.__geo_interface__, name=name, **kwargs)
+            self._index_layer(geojson, gdf)
+            return geojson
+
+        def add_vector_dir(
+            self,
+            path,
+            pattern=None,
+            name=None,
+            recursive=False,
+            columns=None,
+            simplify=False,
+            zoom_levels=(0, 4, 8, 12, 16),
+            processes=None,
+            on_progress=None,
+            **kwargs,
+        ):
+            """Adds every vector file of a directory as one layer group.
+
+            The files are read, reprojected to EPSG:4326 and optionally
+            simplified in a process pool (see common.read_vector_files), then
+            added to the map in a single update, one GeoJSON layer per file
+            named after the file. A progress bar is shown while they load.
+
+            Args:
+                path (str): The directory.
+                pattern (str, optional): A glob pattern the file names must match, e.g. "*.shp".
+                    Defaults to any shapefile, GeoJSON, GeoPackage or FlatGeobuf file.
+                name (str, optional): The name of the layer group. Defaults to the directory name.
+                recursive (bool, optional): Whether to include subdirectories. Defaults to False.
+                columns (list, optional): The attribute columns to read. Defaults to all columns.
+                simplify (bool, optional): Whether to simplify the data per zoom level. Defaults to False.
+                zoom_levels (tuple, optional): The zoom levels to simplify for. Defaults to (0, 4, 8, 12, 16).
+                processes (int, optional): The number of worker processes. Defaults to the number of CPUs.
+                on_progress (callable, optional): Called with the number of files read, the number of
+                    files and the last file read. Defaults to None.
+                kwargs: Keyword arguments to pass to each GeoJSON layer, e.g. style.
+
+            Returns:
+                ipyleaflet.LayerGroup: The group of layers.
+            """
+            from .common import find_vector_files, read_vector_files
+
+            paths = find_vector_files(path, pattern=pattern, recursive=recursive)
+            if not paths:
+                raise ValueError(f"No vector files found in {path}.")
+            if name is None:
+                name = os.path.basename(os.path.normpath(path))
+
+            progress = None
+            if self._batch is None:
+                progress = widgets.IntProgress(value=0, min=0, max=len(paths), description="Loading")
+                progress_control = ipyleaflet.WidgetControl(widget=progress, position="bottomleft")
+                self.add(progress_control)
+
+            def report(done, total, last):
+                if progress is not None:
+                    progress.value = done
+                if on_progress is not None:
+                    on_progress(done, total, last)
+
+            try:
+                results = read_vector_files(
+                    paths,
+                    columns=columns,
+                    simplify=simplify,
+                    zoom_levels=zoom_levels,
+                    processes=processes,
+                    on_progress=report,
+                )
+            finally:
+                if progress is not None:
+                    self.remove(progress_control)
+
+            layers = []
+            for file_path, result in zip(paths, results):
+                layer_name = os.path.splitext(os.path.relpath(file_path, path))[0]
+                if simplify:
+                    levels = result["levels"]
+                    layer = ipyleaflet.GeoJSON(data=levels[self._pick_level(levels)], name=layer_name, **kwargs)
+                    self._track_levels(layer, levels, result["sizes"])
+                else:
+                    layer = ipyleaflet.GeoJSON(data=result["data"], name=layer_name, **kwargs)
+                self._index_layer(layer, result["data"])
+                layers.append(layer)
 
-        def add_raster(self, url, name='Raster', fit_bounds=True, **kwargs):
+            # All the layers reach the frontend in the one update that adds the group.
+            group = ipyleaflet.LayerGroup(layers=layers, name=name)
+            self.add(group)
+            return group
+
+        def _simplify_vector(self, data, zoom_levels):
+            """Simplifies vector data per zoom level and measures the payload sizes.
+
+            Args:
+                data (dict | geopandas.GeoDataFrame): The vector data.
+                zoom_levels (tuple): The zoom levels to build.
+
+            Returns:
+                tuple: The GeoJSON data for each zoom level, and the payload sizes of the
+                    original data and of each level.
+            """
+            from .common import geojson_size, simplify_by_zoom
+
+            levels = simplify_by_zoom(data, zoom_levels)
+            original = data if isinstance(data, dict) else data.__geo_interface__
+            sizes = {
+                "original": geojson_size(original),
+                "levels": {zoom: geojson_size(level) for zoom, level in levels.items()},
+            }
+            return levels, sizes
+
+        def _track_levels(self, layer, levels, sizes):
+            """Swaps the simplified levels of a layer as the map zooms, until it is removed.
+
+            Args:
+                layer (ipyleaflet.GeoJSON): The layer.
+                levels (dict): The GeoJSON data for each zoom level.
+                sizes (dict): The payload sizes, for payload_report.
+            """
+            if layer.model_id not in self._vector_levels:
+
+                def forget():
+                    self._vector_levels.pop(layer.model_id, None)
+                    self._payload_sizes.pop(layer.model_id, None)
+
+                self._on_remove(layer, forget)
+            self._vector_levels[layer.model_id] = (layer, levels)
+            self._payload_sizes[layer.model_id] = (layer, sizes)
+
+        def _pick_level(self, levels):
+            """Returns the most detailed level that does not exceed the current zoom."""
+            zooms = sorted(levels)
+            candidates = [zoom for zoom in zooms if zoom <= self.zoom]
+            return candidates[-1] if candidates else zooms[0]
+
+        def _update_vector_levels(self, change):
+            """Swaps in the simplified data matching the new zoom level."""
+            for layer, levels in self._vector_levels.values():
+                data = levels[self._pick_level(levels)]
+                if layer.data is not data:
+                    layer.data = data
+
+        def payload_report(self):
+            """Reports the serialized payload size of each simplified vector layer.
+
+            Returns:
+                pandas.DataFrame: The original and per-zoom payload bytes of each layer.
+            """
+            import pandas as pd
+
+            rows = []
+            for layer, sizes in self._payload_sizes.values():
+                name = layer.name
+                rows.append({"layer": name, "zoom": None, "bytes": sizes["original"], "ratio": 1.0})
+                for zoom, size in sizes["levels"].items():
+                    rows.append(
+                        {
+                            "layer": name,
+                            "zoom": zoom,
+                            "bytes": size,
+                            "ratio": size / sizes["original"] if sizes["original"] else 0.0,
+                        }
+                    )
+            df = pd.DataFrame(rows, columns=["layer", "zoom", "bytes", "ratio"])
+            return df.astype({"zoom": "Int64"})
+
+        def _index_layer(self, layer, data):
+            """Sets the data indexed for a vector layer, dropping its previous index.
+
+            Args:
+                layer (ipyleaflet.GeoJSON): The layer.
+                data (dict | geopandas.GeoDataFrame): The full-resolution data of the layer.
+            """
+            from .spatial import SpatialIndex
+
+            entry = self._spatial_indexes.get(layer.model_id)
+            if entry is not None:
+                entry[1].data = data
+                return
+            self._spatial_indexes[layer.model_id] = (layer, SpatialIndex(data))
+            layer.observe(self._invalidate_index, names="data")
+
+        def _invalidate_index(self, change):
+            """Drops the index of a layer whose data was replaced, unless by one of its simplified levels."""
+            layer = change["owner"]
+            entry = self._spatial_indexes.get(layer.model_id)
+            if entry is None:
+                return
+            levels = self._vector_levels.get(layer.model_id)
+            if levels is not None and any(change["new"] is level for level in levels[1].values()):
+                return
+            entry[1].data = change["new"]
+
+        def _drop_index(self, layer):
+            if isinstance(layer, ipyleaflet.LayerGroup):
+                for child in layer.layers:
+                    self._drop_index(child)
+            entry = self._spatial_indexes.pop(getattr(layer, "model_id", None), None)
+            if entry is not None:
+                layer.unobserve(self._invalidate_index, names="data")
+
+        def query(self, geometry, layers=None, predicate="intersects"):
+            """Finds the features of vector layers matching a point, a bounding box or a geometry.
+
+            Each layer added with add_geojson, add_shp, add_gdf, add_vector or add_vector_dir
+            keeps a spatial index over its features. The index is built on the
+            first query and rebuilt after the layer data changes, so a query
+            only tests the few features whose bounding boxes match.
+
+            Args:
+                geometry (tuple | dict | shapely.Geometry): A (lon, lat) point, a
+                    (minx, miny, maxx, maxy) bounding box, a GeoJSON geometry or a shapely geometry.
+                layers (list, optional): The layers or layer names to query. Defaults to all vector layers.
+                predicate (str, optional): The test between the query geometry and each feature,
+                    e.g. "intersects", or "contains" for features inside the query geometry.
+                    Defaults to "intersects".
+
+            Returns:
+                dict: The matching GeoJSON features, by layer name.
+            """
+            from .spatial import as_geometry
+
+            geometry = as_geometry(geometry)
+            if layers is not None:
+                layers = [layer if isinstance(layer, str) else layer.model_id for layer in layers]
+
+            results = {}
+            for layer, index in self._spatial_indexes.values():
+                if layers is not None and layer.name not in layers and layer.model_id not in layers:
+                    continue
+                features = index.features(index.query(geometry, predicate=predicate))
+                if features:
+                    results.setdefault(layer.name, []).extend(features)
+            return results
+
+        def add_identify(self, layers=None, tolerance=5, max_features=5):
+            """Shows the properties of the features under the cursor in a popup on click.
+
+            Args:
+                layers (list, optional): The layers or layer names to identify. Defaults to all vector layers.
+                tolerance (int, optional): The search radius around the click, in pixels. Defaults to 5.
+                max_features (int, optional): The maximum number of features shown per layer. Defaults to 5.
+
+            Returns:
+                ipyleaflet.Popup: The popup.
+            """
+            import html
+
+            from .common import zoom_resolution
+
+            if getattr(self, "_identify_handler", None) is not None:
+                self.on_interaction(self._identify_handler, remove=True)
+
+            content = widgets.HTML()
+            popup = ipyleaflet.Popup(child=content, close_button=True, auto_close=False, name="Identify")
+
+            def identify(**kwargs):
+                if kwargs.get("type") != "click":
+                    return
+                lat, lon = kwargs["coordinates"]
+                radius = tolerance * zoom_resolution(self.zoom)
+                results = self.query(
+                    (lon - radius, lat - radius, lon + radius, lat + radius), layers=layers
+                )
+                if popup in self.layers:
+                    self.remove(popup)
+                if not results:
+                    return
+
+                parts = []
+                for name, features in results.items():
+                    parts.append(f"<b>{html.escape(str(name))}</b>")
+                    for feature in features[:max_features]:
+                        rows = "".join(
+                            f"<tr><td>{html.escape(str(key))}</td><td>{html.escape(str(value))}</td></tr>"
+                            for key, value in (feature.get("properties") or {}).items()
+                        )
+                        parts.append(f"<table>{rows}</table>")
+                    if len(features) > max_features:
+                        parts.append(f"<i>{len(features) - max_features} more</i>")
+                content.value = "".join(parts)
+                popup.location = [lat, lon]
+                self.add(popup)
+
+            self._identify_handler = identify
+            self.on_interaction(identify)
+            return popup
+
+        def add_vector_tiles(
+            self,
+            data,
+            name="Vector tiles",
+            columns=None,
+            style=None,
+            cache_bytes=64 * 1024 * 1024,
+            **kwargs,
+        ):
+            """Adds a large vector dataset to the map as vector tiles.
+
+            The data is cut into Mapbox Vector Tiles on demand by a localhost
+            tile server, so the browser only fetches the tiles in view.
+
+            Args:
+                data (str | geopandas.GeoDataFrame): The vector data or the path to a vector file.
+                name (str, optional): The name of the layer. Defaults to "Vector tiles".
+                columns (list, optional): The attribute columns to include. Defaults to all columns.
+                style (dict, optional): The style of the features. Defaults to None.
+                cache_bytes (int, optional): The size limit of the tile cache. Defaults to 64 MiB.
+                kwargs: Keyword arguments to pass to the vector tile layer.
+
+            Returns:
+                ipyleaflet.VectorTileLayer: Adds a vector tile layer to the map.
+            """
+            from .vectortiles import VectorTileSource
+
+            source = VectorTileSource(data, name="layer", columns=columns, cache_bytes=cache_bytes)
+
+            if style is None:
+                style = {
+                    "fill": True,
+                    "weight": 1,
+                    "color": "#2b8a3e",
+                    "fillColor": "#6be5c3",
+                    "fillOpacity": 0.4,
+                    "radius": 3,
+                }
+
+            layer = ipyleaflet.VectorTileLayer(
+                url=source.serve(), layer_styles={"layer": style}, name=name, **kwargs
+            )
+            layer.source = source
+            self.add(layer)
+            self._on_remove(layer, source.close)
+            return layer
+
+        def add_raster(self, url, name='Raster', fit_bounds=True, titiler_endpoint=None, **kwargs):
             """Adds a raster layer to the map.
 
             Args:
                 url (str): The URL of the raster layer.
                 name (str, optional): The name of the raster layer. Defaults to 'Raster'.
                 fit_bounds (bool, optional): Whether to fit the map bounds to the raster layer. Defaults to True.
+                titiler_endpoint (str, optional): The titiler endpoint. Defaults to the
+                    TITILER_ENDPOINT environment variable, or https://titiler.xyz.
             
             Returns:
-                ipyleaflet.raster: Adds a raster image to the map. 
+                ipyleaflet.TileLayer: The raster layer added to the map.
             """
-            import requests
+            if os.path.exists(url):
+                return self.add_local_raster(url, name=name, fit_bounds=fit_bounds, **kwargs)
+
+            return self.add_rasters(
+                [url], names=[name], fit_bounds=fit_bounds, titiler_endpoint=titiler_endpoint, **kwargs
+            )[0]
+
+        def add_local_raster(
+            self,
+            path,
+            name='Raster',
+            bands=None,
+            vmin=None,
+            vmax=None,
+            colormap=None,
+            nodata=None,
+            fit_bounds=True,
+            **kwargs,
+        ):
+            """Adds a local GeoTIFF or COG to the map, rendered by a built-in tile server.
+
+            No remote tiler is needed: tiles are rendered in-process from
+            windowed reads, cached, and served from localhost.
 
-            titiler_endpoint = "https://titiler.xyz"
+            Args:
+                path (str): The path to the raster file.
+                name (str, optional): The name of the raster layer. Defaults to 'Raster'.
+                bands (list, optional): The 1-based band indexes to render, one or three. Defaults to None.
+                vmin (float, optional): The value mapped to the low end of the colormap. Defaults to None.
+                vmax (float, optional): The value mapped to the high end of the colormap. Defaults to None.
+                colormap (str, optional): A matplotlib colormap name for single-band rasters. Defaults to None.
+                nodata (float, optional): The nodata value. Defaults to the value stored in the file.
+                fit_bounds (bool, optional): Whether to fit the map bounds to the raster layer. Defaults to True.
+                kwargs: Keyword arguments to pass to the tile layer.
 
-            r = requests.get(
-                f"{titiler_endpoint}/cog/info",
-                params = {
-                    "url": url,
-                }
-            ).json()
+            Returns:
+                ipyleaflet.TileLayer: Adds a raster image to the map.
+            """
+            from .raster import LocalTileRenderer
 
-            bounds = r["bounds"]
+            renderer = LocalTileRenderer(
+                path, bands=bands, vmin=vmin, vmax=vmax, colormap=colormap, nodata=nodata
+            )
+            layer = ipyleaflet.TileLayer(url=renderer.serve(), name=name, **kwargs)
+            layer.tile_renderer = renderer
+            self.add(layer)
+            self._on_remove(layer, renderer.close)
 
-            r = requests.get(
-                f"{titiler_endpoint}/cog/tilejson.json",
-                params = {
-                    "url": url,
-                }
-            ).json()
+            if fit_bounds:
+                bounds = renderer.bounds
+                self.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
+            return layer
 
-            tile = r["tiles"][0]
+        def add_rasters(self, urls, names=None, fit_bounds=True, titiler_endpoint=None, **kwargs):
+            """Adds several raster layers to the map, fetching their metadata in parallel.
 
-            self.add_tile_layer(url=tile, name=name, **kwargs)
+            Args:
+                urls (list): The URLs of the raster layers.
+                names (list, optional): The names of the raster layers. Defaults to 'Raster 1', 'Raster 2', ...
+                fit_bounds (bool, optional): Whether to fit the map bounds to all the raster layers. Defaults to True.
+                titiler_endpoint (str, optional): The titiler endpoint. Defaults to None.
 
-            if fit_bounds:
-                bbox = [[bounds[1], bounds[0]], [bounds[3], bounds[2]]]
+            Returns:
+                list: The ipyleaflet.TileLayer of each raster, in the order of the URLs.
+            """
+            from .raster import cog_metadata
+
+            if names is None:
+                names = [f"Raster {i + 1}" for i in range(len(urls))]
+
+            metadata = cog_metadata(list(urls), titiler_endpoint=titiler_endpoint)
+
+            layers = [
+                self.add_tile_layer(url=meta["tilejson"]["tiles"][0], name=name, **kwargs)
+                for name, meta in zip(names, metadata)
+            ]
+
+            if fit_bounds and metadata:
+                bounds = [meta["bounds"] for meta in metadata]
+                bbox = [
+                    [min(b[1] for b in bounds), min(b[0] for b in bounds)],
+                    [max(b[3] for b in bounds), max(b[2] for b in bounds)],
+                ]
                 self.fit_bounds(bbox)
+            return layers
         
         def add_image(self, path, w=250, h=250):
             """Adds a small image (like your logo) to the bottom right of the map
@@ -243,6 +1248,7 @@ class Map(ipyleaflet.Map):
                 ipywidgets.image: Adds an image to the map. 
             """
             import ipywidgets as widgets
+            from IPython.display import display
 
             file = open(path, "rb")
             image = file.read()
@@ -259,25 +1265,25 @@ class Map(ipyleaflet.Map):
             with output_widget:
                 display(i)
 
-        def add_vector(self, data, name, **kwarags):
+        def add_vector(self, data, name, **kwargs):
             """Adds a vector layer to the map.
             Can be GeoJson, shapefile, GeoDataFrame, etc
             Args:
                 data: the vector data
                 name: the type of data. example: 'GeoJson', 'Shapefile', 'GeoDataFrame'
-                kwargs: Keyword arguments to pass to the layer.
+                kwargs: Keyword arguments to pass to the layer, e.g. simplify=True.
 
             Returns:
                 ipyleaflet.vector: Adds a vector layer to the map. 
             """
             if name == "GeoJson":
-                self.add_geojson(self, data, name, **kwargs)
+                return self.add_geojson(data, **kwargs)
             elif name == "Shapefile":
-                self.add_shp(self, data, name, **kwargs)
+                return self.add_shp(data, **kwargs)
             elif name == "GeoDataFrame":
-                self.add_geodf(self, data, name, **kwargs)
+                return self.add_gdf(data, **kwargs)
             else:
-                print("This type of vector is not supported yet.")
+                raise ValueError("This type of vector is not supported yet.")
 
         def add_toolbar(self, position="topright", **kwargs):
             """Adds a toolbar using ipywidgets to change the basemap.
@@ -295,22 +1301,41 @@ class Map(ipyleaflet.Map):
             if position not in allowed_positions:
                 raise Exception(f"position must be one of {allowed_positions}")
             
+            from .basemaps import search_basemaps
+
+            default_options = ['ROADMAP', 'SATELLITE', 'TERRAIN']
+
+            search = widgets.Text(
+            placeholder='Search basemaps',
+            continuous_update=False,
+            layout=widgets.Layout(width='250px')
+            )
+
             basemap = widgets.Dropdown(
-            options=['ROADMAP', 'SATELLITE', 'TERRAIN'],
+            options=default_options,
             value=None,
             description='Basemap:',
             style={'description_width': 'initial'},
             layout=widgets.Layout(width='250px')
             )
 
-            basemap_ctrl = ipyleaflet.WidgetControl(widget=basemap, position='topright')
+            basemap_ctrl = ipyleaflet.WidgetControl(widget=widgets.VBox([search, basemap]), position=position)
             self.add_control(basemap_ctrl)
             def change_basemap(change):
                 if change['new']:
-                    self.add_basemap(basemap.value)
+                    self.set_basemap(basemap.value)
 
             basemap.observe(change_basemap, names='value')
 
+            def search_basemap(change):
+                keyword = change['new'].strip()
+                options = search_basemaps(keyword, free_only=True, limit=100) if keyword else default_options
+                with basemap.hold_trait_notifications():
+                    basemap.options = options
+                    basemap.value = None
+
+            search.observe(search_basemap, names='value')
+
             def toolbar_click(b):
                 with b:
                     b.clear_output()
@@ -318,114 +1343,134 @@ class Map(ipyleaflet.Map):
                     if b.icon == 'map':
                         self.add_control(basemap_ctrl)
 
-        def add_plot(self, x, y, **kwargs):
-            """Add a plot to the map.
+        def add_plot(self, x, y, position="bottomright", fmt="png", **kwargs):
+            """Add a line plot to the map.
+
+            The chart is rendered to an image on a worker thread and cached, so
+            adding the same plot again does not re-plot it. Long series are
+            downsampled with Largest-Triangle-Three-Buckets (or min/max envelopes
+            with ``downsample="minmax"``) to about one point per pixel.
 
             Args:
-                x (str, optional): Data to use for the x-axis.
-                y (str, optional): Data to use for the y-axis.
-                **kwargs: Other keyword arguments for ipywidgets.HTML().
+                x (array-like): Data to use for the x-axis.
+                y (array-like): Data to use for the y-axis.
+                position (str, optional): The position of the chart. Defaults to "bottomright".
+                fmt (str, optional): The image format, "png" or "svg". Defaults to "png".
+                **kwargs: Other keyword arguments for thinkgreen.charts.render_chart().
 
             Returns:
-                matplotlib.plot: Generates a plot graph. 
+                ipyleaflet.WidgetControl: The control showing the plot.
             """
+            return self._add_chart_image("plot", x, y, position=position, fmt=fmt, **kwargs)
 
-            import matplotlib.pyplot as plt
-            import numpy as np
-
-            plt.style.use('_mpl-gallery')
-
-            # plot
-            fig, ax = plt.subplots()
-            ax.plot(x, y, linewidth=2.0)
-            ax.set(xlabel='x', ylabel='y', title='Plot')
-
-            plt.show()
-
-        def add_bar(self, x, y):
+        def add_bar(self, x, y, position="bottomright", fmt="png", **kwargs):
             """Add a bar graph to the map.
 
+            Long series are aggregated into bins of consecutive samples (the mean
+            by default, see ``downsample``) before plotting.
+
             Args:
-                x (str, optional): Data to use for the x-axis.
-                y (str, optional): Data to use for the y-axis.
-                **kwargs: Other keyword arguments for ipywidgets.HTML().
+                x (array-like): Data to use for the x-axis.
+                y (array-like): Data to use for the y-axis.
+                position (str, optional): The position of the chart. Defaults to "bottomright".
+                fmt (str, optional): The image format, "png" or "svg". Defaults to "png".
+                **kwargs: Other keyword arguments for thinkgreen.charts.render_chart().
 
             Returns:
-                matplotlib.plot: Generates a bar graph. 
+                ipyleaflet.WidgetControl: The control showing the bar graph.
             """
-            import matplotlib.pyplot as plt
-            import numpy as np
-
-            plt.style.use('_mpl-gallery')
-
-            # plot
-            fig, ax = plt.subplots()
-            ax.bar(x, y, width=1, edgecolor="white", linewidth=0.7)
-            ax.set(xlabel='x', ylabel='y', title='Bar Graph')
+            return self._add_chart_image("bar", x, y, position=position, fmt=fmt, **kwargs)
 
-            plt.show()
-
-        def add_pie(self, x):
+        def add_pie(self, x, position="bottomright", fmt="png", **kwargs):
             """Add a pie chart to the map.
 
             Args:
-                x (str, optional): Data to use for the pie chart.
-                **kwargs: Other keyword arguments for ipywidgets.HTML().
+                x (array-like): Data to use for the pie chart.
+                position (str, optional): The position of the chart. Defaults to "bottomright".
+                fmt (str, optional): The image format, "png" or "svg". Defaults to "png".
+                **kwargs: Other keyword arguments for thinkgreen.charts.render_chart().
 
             Returns:
-                matplotlib.plot: Generates a pie graph. 
+                ipyleaflet.WidgetControl: The control showing the pie chart.
             """
-            import matplotlib.pyplot as plt
-            import numpy as np
+            return self._add_chart_image("pie", x, position=position, fmt=fmt, **kwargs)
+
+        def _add_chart_image(self, kind, x, y=None, position="bottomright", fmt="png", **kwargs):
+            """Adds an image widget that shows a chart once it has been rendered."""
+            from .charts import submit_chart
 
-            plt.style.use('_mpl-gallery-nogrid')
+            image = widgets.Image(format="png" if fmt == "png" else "svg+xml")
+            self._show_chart(image, submit_chart(kind, x, y, fmt=fmt, **kwargs))
+            return self.add_widget(image, position=position)
 
-            # plot
-            fig, ax = plt.subplots()
-            ax.pie(x, radius=3, wedgeprops={"linewidth": 1, "edgecolor": "white"}, frame=True)
-            ax.set(xlabel='x', title='Pie Chart')
+        @staticmethod
+        def _show_chart(image, future):
+            """Sets the value of an image widget when a chart render completes, logging render errors."""
+            import logging
 
-            plt.show()
+            def show(future):
+                error = future.exception()
+                if error is None:
+                    image.value = future.result()
+                else:
+                    logging.getLogger(__name__).error(
+                        "The chart could not be rendered.", exc_info=(type(error), error, error.__traceback__)
+                    )
+
+            future.add_done_callback(show)
 
+        def add_chart(self, position="bottomleft", x=None, y=None, fmt="png", **kwargs):
+            """Add a chart to the map, with a dropdown to switch between chart types.
 
-        def add_chart(self, position="bottomleft", **kwargs):
-            """Add a figure to the map.
+            All chart types are rendered in the background up front and cached,
+            so switching between them only swaps the image.
 
             Args:
-                content (str | ipywidgets.Widget | object): The chart to add.
-                position (str, optional): The position of the widget. Defaults to "bottomright".
-                **kwargs: Other keyword arguments for ipywidgets.HTML().
+                position (str, optional): The position of the widget. Defaults to "bottomleft".
+                x (array-like, optional): Data to use for the x-axis. Defaults to [1, 2, 3, 4].
+                y (array-like, optional): Data to use for the y-axis and the pie chart. Defaults to x.
+                fmt (str, optional): The image format, "png" or "svg". Defaults to "png".
+                **kwargs: Other keyword arguments for thinkgreen.charts.render_chart().
 
             Returns:
-                ipywidgets.chart: Adds a chart dropdown widget to map. 
+                ipyleaflet.WidgetControl: The control with the chart dropdown.
             """
-            import streamlit as st
-            import ipywidgets as widgets
+            from .charts import submit_chart
 
             allowed_positions = ["topleft", "topright", "bottomleft", "bottomright"]
 
             if position not in allowed_positions:
                 raise Exception(f"position must be one of {allowed_positions}")
 
+            if x is None:
+                x = [1, 2, 3, 4]
+            if y is None:
+                y = x
+
+            renders = {
+                "PLOT": submit_chart("plot", x, y, fmt=fmt, **kwargs),
+                "BAR": submit_chart("bar", x, y, fmt=fmt, **kwargs),
+                "PIE": submit_chart("pie", y, fmt=fmt, **kwargs),
+            }
+
             chart_type = widgets.Dropdown(
-                options=['PLOT','BAR','PIE'],
+                options=list(renders),
                 value=None,
                 description='Chart:',
                 style={'description_width': 'initial'},
                 layout=widgets.Layout(width='250px')
             )
+            image = widgets.Image(format="png" if fmt == "png" else "svg+xml")
 
-            chart_ctrl = ipyleaflet.WidgetControl(widget=chart_type, position=position)
+            chart_ctrl = ipyleaflet.WidgetControl(widget=widgets.VBox([chart_type, image]), position=position)
             self.add_control(chart_ctrl)
             
             def change_chart(change):
                 if change['new']:
-                    selected_option = chart_type.value
-                    self.add_widget(selected_option, position=position)
+                    self._show_chart(image, renders[change['new']])
 
             chart_type.observe(change_chart, names='value')
-
-
+            return chart_ctrl
 
         def add_widget(self, content, position="bottomright", **kwargs):
             """Add a widget (e.g., text, HTML, figure) to the map.
@@ -439,6 +1484,8 @@ class Map(ipyleaflet.Map):
                 ipyleaflet.WidgetControl: Adds a widget to the map. 
             """
 
+            from IPython.display import display
+
             allowed_positions = ["topleft", "topright", "bottomleft", "bottomright"]
 
             if position not in allowed_positions:
@@ -450,6 +1497,8 @@ class Map(ipyleaflet.Map):
                 if isinstance(content, str):
                     widget = widgets.HTML(value=content, **kwargs)
                     control = ipyleaflet.WidgetControl(widget=widget, position=position)
+                elif isinstance(content, widgets.Widget):
+                    control = ipyleaflet.WidgetControl(widget=content, position=position)
                 else:
                     output = widgets.Output(**kwargs)
                     with output:
@@ -459,60 +1508,320 @@ class Map(ipyleaflet.Map):
 
             except Exception as e:
                 raise Exception(f"Error adding widget: {e}")
+            return control
 
 
-        def add_csv(self, in_csv, out_file, out_format, x="longitude", y="latitude"):
-            import csv
-            import geopandas as gpd
-            from shapely.geometry import Point
-
-            # Read CSV file and extract lat/lon coordinates
-            points = []
-            with open(in_csv, 'r') as csv_file:
-                reader = csv.DictReader(csv_file)
-                for row in reader:
-                    lon = float(row[x])
-                    lat = float(row[y])
-                    point = Point(lon, lat)
-                    points.append(point)
-
-            # Create a GeoDataFrame from the points
-            gdf = gpd.GeoDataFrame(geometry=points)
-
-            # Save GeoDataFrame to the specified output format
-            if out_format == 'shapefile':
-                gdf.to_file(out_file, driver='ESRI Shapefile')
-            elif out_format == 'geojson':
-                gdf.to_file(out_file, driver='GeoJSON')
-            else:
-                print("Unsupported output format. Please choose either 'shapefile' or 'geojson'.")
+        def add_csv(
+            self,
+            in_csv,
+            out_file,
+            out_format,
+            x="longitude",
+            y="latitude",
+            columns=None,
+            chunksize=100000,
+            **kwargs,
+        ):
+            """Converts a CSV file with coordinates to a vector file.
+
+            The CSV is streamed in batches, so memory use does not grow with
+            the size of the input.
 
-            #gj = gdf.__geo_interface__
-            #self.add_csv(gj, out_file=out_file, out_format=out_format)
+            Args:
+                in_csv (str): The path to the CSV file.
+                out_file (str): The path to the output file.
+                out_format (str): One of "shapefile", "geojson" or "geoparquet".
+                x (str, optional): The column with longitudes. Defaults to "longitude".
+                y (str, optional): The column with latitudes. Defaults to "latitude".
+                columns (list, optional): The attribute columns to keep. Defaults to all columns.
+                chunksize (int, optional): The number of rows per batch. Defaults to 100000.
+                kwargs: Keyword arguments to pass to thinkgreen.common.csv_to_vector.
+
+            Returns:
+                int: The number of points written.
+            """
+            from .common import csv_to_vector
+
+            return csv_to_vector(
+                in_csv,
+                out_file,
+                out_format,
+                x=x,
+                y=y,
+                columns=columns,
+                chunksize=chunksize,
+                **kwargs,
+            )
 
+        def add_points_from_csv(
+            self,
+            in_csv,
+            x="longitude",
+            y="latitude",
+            label=None,
+            layer_name="Points",
+            columns=None,
+            dtype=None,
+            chunksize=100000,
+            max_points=None,
+            point_style=None,
+            sample_size=100000,
+            **kwargs,
+        ):
+            """Adds points from a CSV file to the map.
+
+            The CSV is read in chunks with only the needed columns. The layer
+            holds one GeoJSON coordinate pair (and one properties dict with
+            ``label`` or ``columns``) per point, so its memory and payload grow
+            with the number of points shown. Files with more than
+            ``sample_size`` points are shown as a uniform random sample of that
+            many points, read with bounded memory; use add_hexbin() to show
+            all of them aggregated.
 
+            Args:
+                in_csv (str): The path to the CSV file.
+                x (str, optional): The column with longitudes. Defaults to "longitude".
+                y (str, optional): The column with latitudes. Defaults to "latitude".
+                label (str, optional): The column to show in a popup on click. Defaults to None.
+                layer_name (str, optional): The name of the layer. Defaults to "Points".
+                columns (list, optional): Extra attribute columns to keep. Defaults to None.
+                dtype (dict, optional): Dtypes for the attribute columns. Defaults to None.
+                chunksize (int, optional): The number of rows read at a time. Defaults to 100000.
+                max_points (int, optional): Stop reading after this many points, instead of
+                    sampling. Defaults to None.
+                point_style (dict, optional): The circle marker style. Defaults to None.
+                sample_size (int, optional): The most points shown when max_points is not set.
+                    Defaults to 100000.
+                kwargs: Keyword arguments to pass to pandas.read_csv.
 
-        def add_points_from_csv(self, in_csv, x="longitude", y="latitude", label=None, layer_name="Marker cluster"):
+            Returns:
+                ipyleaflet.GeoJSON: Adds a point layer to the map.
+            """
+            import logging
 
+            import numpy as np
             import pandas as pd
-            import folium
-            from folium.plugins import MarkerCluster
-            # Load CSV data into a pandas DataFrame
-            df = pd.read_csv(in_csv)
-            
-            # Create a MarkerCluster layer
-            marker_cluster = MarkerCluster(name=layer_name)
-            
-            
-            # Iterate over rows and add markers to the cluster
-            for index, row in df.iterrows():
-                location = [row[y], row[x]]  # Swap x and y to match lat/lon
-                marker = folium.Marker(location=location, popup=row[label] if label else None)
-                marker.add_to(marker_cluster)
-            
-            #markercluster = 
-            #self.add_points_from_csv(markercluster)
+            from .common import points_to_geojson, read_csv_points, sample_points
+
+            columns = list(columns or [])
+            if label is not None and label not in columns:
+                columns.append(label)
+
+            chunks = read_csv_points(in_csv, x, y, columns=columns, dtype=dtype, chunksize=chunksize, **kwargs)
+            if max_points is None:
+                lon, lat, properties, total = sample_points(chunks, sample_size)
+                if total > len(lon):
+                    logging.getLogger(__name__).warning(
+                        "Showing a sample of %d of the %d points of %s.", len(lon), total, in_csv
+                    )
+            else:
+                lons, lats, attrs = [], [], []
+                count = 0
+                for lon, lat, chunk in chunks:
+                    if count + len(lon) > max_points:
+                        keep = max_points - count
+                        lon, lat, chunk = lon[:keep], lat[:keep], chunk.iloc[:keep]
+                    lons.append(lon)
+                    lats.append(lat)
+                    attrs.append(chunk)
+                    count += len(lon)
+                    if count >= max_points:
+                        break
+                lon = np.concatenate(lons) if lons else np.empty(0)
+                lat = np.concatenate(lats) if lats else np.empty(0)
+                properties = pd.concat(attrs, ignore_index=True) if attrs else None
+            data = points_to_geojson(lon, lat, properties if columns else None)
+
+            if point_style is None:
+                point_style = {
+                    "radius": 4,
+                    "color": "#2b8a3e",
+                    "weight": 1,
+                    "fillOpacity": 0.7,
+                }
+
+            layer = ipyleaflet.GeoJSON(data=data, point_style=point_style, name=layer_name)
+
+            popup = None
+            if label is not None:
+                import html
+
+                content = widgets.HTML()
+                popup = ipyleaflet.Popup(child=content, close_button=True, name=f"{layer_name} label")
+
+                def show_label(feature, **kwargs):
+                    lon, lat = feature["geometry"]["coordinates"]
+                    if popup in self.layers:
+                        self.remove(popup)
+                    content.value = html.escape(str(feature["properties"][label]))
+                    popup.location = [lat, lon]
+                    self.add(popup)
+
+                layer.on_click(show_label)
+
+            self.add(layer)
+            if popup is not None:
+
+                def close_label():
+                    if popup in self.layers:
+                        self.remove(popup)
+
+                self._on_remove(layer, close_label)
+            return layer
+
+        def add_hexbin(
+            self,
+            data,
+            x="longitude",
+            y="latitude",
+            value=None,
+            agg="count",
+            kind="hex",
+            cell_size=24,
+            colormap="viridis",
+            vmin=None,
+            vmax=None,
+            opacity=0.7,
+            pyramid_zoom=6,
+            legend=True,
+            name="Hexbin",
+            **kwargs,
+        ):
+            """Adds points aggregated into a hexagon or square grid to the map.
+
+            The points stay in Python: they are binned into a grid whose cells
+            keep the same size on screen at every zoom level (see
+            hexbin.BinPyramid), and only the cells in view are sent to the map,
+            colored by their aggregate. The cells are recomputed in a background
+            thread as the map is panned or zoomed, for the latest view only, so
+            the payload grows with the size of the map, not with the number of
+            points.
 
+            Args:
+                data (str | pandas.DataFrame | geopandas.GeoDataFrame): The path to a CSV file,
+                    a DataFrame with coordinate columns, or a GeoDataFrame of points.
+                x (str, optional): The column with longitudes. Defaults to "longitude".
+                y (str, optional): The column with latitudes. Defaults to "latitude".
+                value (str, optional): The column to aggregate. Defaults to None.
+                agg (str, optional): "count" of points, or the "sum", "mean", "min" or "max"
+                    of value. Defaults to "count".
+                kind (str, optional): "hex" for hexagons or "square" for squares. Defaults to "hex".
+                cell_size (float, optional): The width of a cell in screen pixels. Defaults to 24.
+                colormap (str, optional): A matplotlib colormap name. Defaults to "viridis".
+                vmin (float, optional): The value mapped to the low end of the colormap.
+                    Defaults to the 2nd percentile of the cells in view.
+                vmax (float, optional): The value mapped to the high end of the colormap.
+                    Defaults to the 98th percentile of the cells in view.
+                opacity (float, optional): The fill opacity of the cells. Defaults to 0.7.
+                pyramid_zoom (int, optional): The deepest zoom level binned up front; deeper
+                    levels are binned per tile in view. Defaults to 6.
+                legend (bool, optional): Whether to show a legend. Defaults to True.
+                name (str, optional): The name of the layer. Defaults to "Hexbin".
+                kwargs: Keyword arguments to pass to the GeoJSON layer, e.g. hover_style.
+
+            Returns:
+                ipyleaflet.GeoJSON: The layer of cells.
+            """
+            import threading
+
+            import numpy as np
+
+            from .common import get_read_executor
+            from .hexbin import BinPyramid, legend_html, to_geojson, view_bounds
+
+            values = None
+            if isinstance(data, str):
+                from .common import read_csv_points
+
+                columns = [value] if value is not None else None
+                lons, lats, attrs = [], [], []
+                for lon, lat, chunk in read_csv_points(data, x, y, columns=columns):
+                    lons.append(lon)
+                    lats.append(lat)
+                    attrs.append(chunk[value].to_numpy() if value is not None else None)
+                lon = np.concatenate(lons) if lons else np.empty(0)
+                lat = np.concatenate(lats) if lats else np.empty(0)
+                if value is not None:
+                    values = np.concatenate(attrs) if attrs else np.empty(0)
+            else:
+                if hasattr(data, "geometry") and x not in data.columns:
+                    if data.crs is not None and not data.crs.equals("EPSG:4326"):
+                        data = data.to_crs("EPSG:4326")
+                    lon, lat = data.geometry.x.to_numpy(), data.geometry.y.to_numpy()
+                else:
+                    lon, lat = data[x].to_numpy(), data[y].to_numpy()
+                if value is not None:
+                    values = data[value].to_numpy()
+
+            pyramid = BinPyramid(
+                lon, lat, values, agg=agg, kind=kind, cell_size=cell_size, pyramid_zoom=pyramid_zoom
+            )
+            title = agg if value is None else f"{agg} of {value}"
+            style = {"color": "white", "weight": 0.5, "fillOpacity": opacity}
+            empty = {"type": "FeatureCollection", "features": []}
+            layer = ipyleaflet.GeoJSON(data=empty, name=name, style=style, **kwargs)
+            legend_widget = widgets.HTML()
+
+            def render(zoom, bounds):
+                cells = pyramid.cells(zoom, bounds)
+                result = pyramid.aggregate(cells)
+                low, high = vmin, vmax
+                if (low is None or high is None) and result.size:
+                    p2, p98 = np.percentile(result, [2, 98])
+                    low = p2 if low is None else low
+                    high = p98 if high is None else high
+                low = 0.0 if low is None else float(low)
+                high = low + 1.0 if high is None or high == low else float(high)
+                return to_geojson(pyramid, zoom, cells, result, low, high, colormap), legend_html(
+                    title, low, high, colormap
+                )
+
+            state = {"view": None, "future": None, "removed": False}
+            lock = threading.Lock()
+
+            def load():
+                # Bins the latest view requested; views requested meanwhile replace each other.
+                while True:
+                    with lock:
+                        view, state["view"] = state["view"], None
+                        if view is None:
+                            state["future"] = None
+                            return
+                    data, legend_value = render(*view)
+                    with lock:
+                        if state["removed"]:
+                            return
+                        if state["view"] is not None:
+                            continue
+                    layer.data = data
+                    legend_widget.value = legend_value
+
+            def update(change):
+                # The cells are binned off the kernel thread, which stays free to handle events.
+                with lock:
+                    state["view"] = (int(round(self.zoom)), change["new"])
+                    if state["future"] is None:
+                        state["future"] = get_read_executor().submit(load)
+
+            layer.data, legend_widget.value = render(
+                int(round(self.zoom)), self.bounds or view_bounds(self.center, self.zoom)
+            )
+            self.add(layer)
+            legend_control = None
+            if legend:
+                legend_control = ipyleaflet.WidgetControl(widget=legend_widget, position="bottomright")
+                self.add(legend_control)
+
+            def stop():
+                self.unobserve(update, names="bounds")
+                with lock:
+                    state["removed"] = True
+                if legend_control is not None and legend_control in self.controls:
+                    self.remove(legend_control)
+
+            self.observe(update, names="bounds")
+            self._on_remove(layer, stop)
+            return layer
 
         def add_button(self, position = "topleft", **kwargs):
             import ipywidgets as widgets
@@ -0,0 +1,434 @@
+"""An in-process localhost HTTP server for tiles and other map resources.
+
+The browser showing the map must reach the server. On JupyterHub the
+requests go through jupyter-server-proxy, and on Colab through the kernel
+port proxy. Elsewhere, set the ``THINKGREEN_TILE_PREFIX`` environment
+variable to the URL the browser reaches the server at, with ``{port}`` for
+its port, e.g. ``/user/me/proxy/{port}`` behind another Jupyter proxy.
+"""
+
+import collections
+import itertools
+import math
+import os
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Half the width of the Web Mercator (EPSG:3857) world in meters.
+ORIGIN_SHIFT = 20037508.342789244
+
+_proxy_ids = itertools.count(1)
+
+
+def tile_bounds(z, x, y):
+    """Returns the Web Mercator bounds of an XYZ tile.
+
+    Args:
+        z (int): The zoom level.
+        x (int): The tile column.
+        y (int): The tile row, counted from the top.
+
+    Returns:
+        tuple: The (minx, miny, maxx, maxy) bounds in meters.
+    """
+    size = 2 * ORIGIN_SHIFT / 2**z
+    minx = -ORIGIN_SHIFT + x * size
+    maxy = ORIGIN_SHIFT - y * size
+    return minx, maxy - size, minx + size, maxy
+
+
+def lnglat_to_tile(lng, lat, z):
+    """Returns the XYZ tile containing a longitude/latitude at a zoom level.
+
+    Args:
+        lng (float): The longitude.
+        lat (float): The latitude.
+        z (int): The zoom level.
+
+    Returns:
+        tuple: The (x, y) tile indices.
+    """
+    n = 2**z
+    lat = max(min(lat, 85.0511287798), -85.0511287798)
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def client_url(port):
+    """Returns the URL the browser reaches a port of the kernel machine at, when it is not localhost.
+
+    Args:
+        port (int): The port on the kernel machine.
+
+    Returns:
+        str: The base URL, or None if the browser reaches the port directly.
+    """
+    prefix = os.environ.get("THINKGREEN_TILE_PREFIX")
+    if prefix:
+        return prefix.format(port=port).rstrip("/")
+    if "google.colab" in sys.modules:
+        from google.colab.output import eval_js
+
+        return eval_js(f"google.colab.kernel.proxyPort({port})").rstrip("/")
+    service_prefix = os.environ.get("JUPYTERHUB_SERVICE_PREFIX")
+    if service_prefix:
+        try:
+            import jupyter_server_proxy  # noqa: F401
+        except ImportError:
+            raise ValueError(
+                "The browser cannot reach the tile server of a JupyterHub kernel. "
+                "Install jupyter-server-proxy, or set THINKGREEN_TILE_PREFIX."
+            )
+        return f"{service_prefix.rstrip('/')}/proxy/{port}"
+    return None
+
+
+class _Server(ThreadingHTTPServer):
+    # Browsers and the HTTP thread pool open many connections at once; with the
+    # default backlog of 5, the rest are dropped and retried a second later.
+    request_queue_size = 128
+
+
+class TileServer:
+    """A localhost HTTP server that dispatches requests to registered handlers.
+
+    Handlers are registered under a path prefix and called with the remaining
+    path segments and the parsed query string. They return a ``(body,
+    content_type)`` tuple, or None for a 404 response.
+
+    ``url`` is the local address of the server, and ``client_url`` the one
+    the browser reaches it at, see client_url().
+
+    Args:
+        host (str, optional): The host to bind to. Defaults to "127.0.0.1".
+        port (int, optional): The port to bind to. Defaults to 0 (any free port).
+    """
+
+    def __init__(self, host="127.0.0.1", port=0):
+        self._handlers = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Every response has a Content-Length, so connections can be kept alive.
+            # Headers and body are separate writes; without TCP_NODELAY, each
+            # response on a kept-alive connection waits for a delayed ACK.
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = _Server((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.host, self.port = self.httpd.server_address[:2]
+        self.url = f"http://{self.host}:{self.port}"
+        try:
+            self.client_url = client_url(self.port) or self.url
+        except Exception:
+            self.httpd.server_close()
+            raise
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def register(self, prefix, handler):
+        """Registers a handler for a path prefix.
+
+        Args:
+            prefix (str): The first path segment, e.g. "vt/1".
+            handler (callable): Called as ``handler(segments, query)``.
+
+        Returns:
+            str: The base URL of the handler, as reached by the browser.
+        """
+        self._handlers[prefix.strip("/")] = handler
+        return f"{self.client_url}/{prefix.strip('/')}"
+
+    def unregister(self, prefix):
+        """Removes the handler for a path prefix.
+
+        Args:
+            prefix (str): The path prefix passed to register.
+        """
+        self._handlers.pop(prefix.strip("/"), None)
+
+    def shutdown(self):
+        """Stops the server."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handle(self, request):
+        parts = urlsplit(request.path)
+        segments = [s for s in parts.path.split("/") if s]
+        query = {k: v[0] for k, v in parse_qs(parts.query).items()}
+
+        result = None
+        for i in range(len(segments), 0, -1):
+            handler = self._handlers.get("/".join(segments[:i]))
+            if handler is not None:
+                try:
+                    result = handler(segments[i:], query)
+                except Exception as e:
+                    self._respond(request, 500, str(e).encode("utf-8"), "text/plain")
+                    return
+                break
+
+        if result is None:
+            self._respond(request, 404, b"", "text/plain")
+        else:
+            self._respond(request, 200, *result)
+
+    @staticmethod
+    def _respond(request, status, body, content_type):
+        request.send_response(status)
+        request.send_header("Content-Type", content_type)
+        request.send_header("Content-Length", str(len(body)))
+        request.send_header("Access-Control-Allow-Origin", "*")
+        request.end_headers()
+        request.wfile.write(body)
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def get_server():
+    """Returns the shared tile server of this process, starting it if needed.
+
+    Returns:
+        TileServer: The running server.
+    """
+    global _server
+
+    with _server_lock:
+        if _server is None:
+            _server = TileServer()
+        return _server
+
+
+def parse_tile(segments):
+    """Parses ``z/x/y.ext`` path segments.
+
+    Args:
+        segments (list): The path segments.
+
+    Returns:
+        tuple: The (z, x, y) tile indices, or None if the path is not a tile.
+    """
+    if len(segments) != 3:
+        return None
+    try:
+        return int(segments[0]), int(segments[1]), int(segments[2].split(".")[0])
+    except ValueError:
+        return None
+
+
+def tiles_in_bounds(bounds, z, ring=0):
+    """Lists the XYZ tiles covering a lat/lon bounding box.
+
+    Args:
+        bounds (tuple): The ((south, west), (north, east)) bounds.
+        z (int): The zoom level.
+        ring (int, optional): The number of extra tiles to add around the box. Defaults to 0.
+
+    Returns:
+        list: The (z, x, y) tiles.
+    """
+    (south, west), (north, east) = bounds
+    n = 2**z
+    x0, y0 = lnglat_to_tile(west, north, z)
+    x1, y1 = lnglat_to_tile(east, south, z)
+    if east - west >= 360:
+        x0, x1 = 0, n - 1
+    xs = range(x0 - ring, x1 + ring + 1) if x1 >= x0 else range(x0 - ring, x1 + n + ring + 1)
+    xs = list(dict.fromkeys(x % n for x in xs))
+    ys = range(max(y0 - ring, 0), min(y1 + ring, n - 1) + 1)
+    return [(z, x, y) for x in xs for y in ys]
+
+
+def _content_type(data):
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return "image/png"
+    if data[:3] == b"\xff\xd8\xff":
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+class TileProxy:
+    """Serves the tiles of a remote XYZ service through a local disk cache.
+
+    Args:
+        url (str): The URL template of the remote tiles, with {z}, {x}, {y} and optionally {s}.
+        cache (thinkgreen.cache.DiskTileCache, optional): The tile cache. Defaults to the cache in
+            ``~/.cache/thinkgreen/tiles``.
+        offline (bool, optional): Whether to only serve cached tiles. Defaults to False.
+        subdomains (str, optional): The values of {s} in the URL template. Defaults to "abc".
+    """
+
+    def __init__(self, url, cache=None, offline=False, subdomains="abc"):
+        from .cache import DiskTileCache
+
+        self.url = url
+        self.cache = cache if cache is not None else DiskTileCache()
+        self.offline = offline
+        self.subdomains = subdomains or "a"
+        self.upstream_requests = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._prefix = None
+        self._requested = 0
+        self._prefetch_keys = collections.deque()
+        self._prefetching = False
+        self._prefetch_executor = None
+
+    def upstream_url(self, z, x, y):
+        """Returns the remote URL of a tile.
+
+        Args:
+            z (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            str: The URL.
+        """
+        url = self.url.replace("{s}", self.subdomains[(x + y) % len(self.subdomains)])
+        url = url.replace("{r}", "")
+        return url.replace("{z}", str(z)).replace("{x}", str(x)).replace("{y}", str(y))
+
+    def _key(self, z, x, y):
+        return f"{self.url}|{z}/{x}/{y}"
+
+    def tile(self, z, x, y):
+        """Returns a tile from the cache, fetching it upstream unless offline.
+
+        Args:
+            z (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            bytes: The tile contents, or None if the tile is not available.
+        """
+        data = self.cache.get(self._key(z, x, y))
+        if data is None and not self.offline:
+            with self._lock:
+                self._requested += 1
+            try:
+                data = self._submit(z, x, y).result()
+            finally:
+                with self._lock:
+                    self._requested -= 1
+        return data
+
+    def _submit(self, z, x, y):
+        from .common import get_http_executor
+
+        key = self._key(z, x, y)
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = get_http_executor().submit(self._fetch, z, x, y)
+                self._pending[key] = future
+        return future
+
+    def _fetch(self, z, x, y):
+        from .common import get_client
+
+        key = self._key(z, x, y)
+        try:
+            with self._lock:
+                self.upstream_requests += 1
+            response = get_client().get(self.upstream_url(z, x, y))
+            if response.status_code != 200:
+                return None
+            self.cache.put(key, response.content)
+            return response.content
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def prefetch(self, bounds, zoom, max_tiles=256):
+        """Fetches the tiles around a viewport and at the next zoom level in the background.
+
+        The tiles replace those queued for the previous viewport, and are
+        fetched one at a time, only while no requested tile is waiting, so
+        they never delay the tiles the browser asks for.
+
+        Args:
+            bounds (tuple): The ((south, west), (north, east)) bounds of the viewport.
+            zoom (int): The current zoom level.
+            max_tiles (int, optional): The maximum number of tiles to queue. Defaults to 256.
+
+        Returns:
+            int: The number of tiles queued.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self.offline:
+            return 0
+        zoom = int(round(zoom))
+        tiles = tiles_in_bounds(bounds, zoom, ring=1) + tiles_in_bounds(bounds, zoom + 1)
+        tiles = [tile for tile in tiles if self._key(*tile) not in self.cache][:max_tiles]
+        with self._lock:
+            self._prefetch_keys.clear()
+            self._prefetch_keys.extend(tiles)
+            if self._prefetching or not tiles:
+                return len(tiles)
+            self._prefetching = True
+            if self._prefetch_executor is None:
+                self._prefetch_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix="thinkgreen-prefetch"
+                )
+            executor = self._prefetch_executor
+        executor.submit(self._run_prefetch)
+        return len(tiles)
+
+    def _run_prefetch(self):
+        """Fetches the queued tiles in order until a requested tile is waiting."""
+        while True:
+            with self._lock:
+                if self._requested or not self._prefetch_keys or self.offline:
+                    # The next viewport change queues its tiles and resumes prefetching.
+                    self._prefetching = False
+                    return
+                tile = self._prefetch_keys.popleft()
+            if self._key(*tile) not in self.cache:
+                # Errors are raised when the tile is requested.
+                self._submit(*tile).exception()
+
+    def serve(self):
+        """Registers the proxy with the shared tile server.
+
+        Returns:
+            str: The XYZ URL template of the proxied tiles.
+        """
+        def handler(segments, query):
+            tile = parse_tile(segments)
+            if tile is None:
+                return None
+            data = self.tile(*tile)
+            if data is None:
+                return None
+            return data, _content_type(data)
+
+        self._prefix = f"proxy/{next(_proxy_ids)}"
+        return get_server().register(self._prefix, handler) + "/{z}/{x}/{y}"
+
+    def close(self):
+        """Unregisters the proxy from the shared tile server and stops prefetching."""
+        if self._prefix is not None:
+            get_server().unregister(self._prefix)
+            self._prefix = None
+        with self._lock:
+            self._prefetch_keys.clear()
+            executor, self._prefetch_executor = self._prefetch_executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
@@ -0,0 +1,420 @@
+"""A compact binary encoding of vector data with quantized, delta-encoded shared arcs.
+
+The format combines the ideas of TopoJSON and geobuf: coordinates are
+quantized to integers at a fixed decimal precision, lines and polygon rings
+are cut into arcs at the junctions where boundaries meet, each shared arc is
+stored once and referenced by index (negative indexes reverse it), and the
+arc coordinates are delta encoded as zigzag varints.
+
+Layout of an encoded buffer:
+
+- 4 bytes: the magic ``b"TGB1"``.
+- 4 bytes: the length of the header as a little-endian uint32.
+- The header, UTF-8 JSON: ``{"precision": int, "properties": [...], "ids": [...]}``.
+- A stream of zigzag varints: the number of arcs, then for each arc its
+  number of points followed by the x/y deltas of its points, then for each
+  feature a geometry type code followed by its parts (see ``_encode_geometry``).
+
+``decode`` reads the format back into GeoJSON, and ``decoder_js`` returns
+the equivalent JavaScript decoder used by the folium backend.
+"""
+
+import json
+import struct
+
+MAGIC = b"TGB1"
+
+GEOMETRY_TYPES = ["", "Point", "MultiPoint", "LineString", "MultiLineString", "Polygon", "MultiPolygon"]
+
+
+def zigzag(values):
+    """Maps signed integers to unsigned ones, small magnitudes to small values.
+
+    Args:
+        values (array-like): The signed integers.
+
+    Returns:
+        numpy.ndarray: The unsigned integers.
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def unzigzag(values):
+    """Inverts zigzag().
+
+    Args:
+        values (array-like): The unsigned integers.
+
+    Returns:
+        numpy.ndarray: The signed integers.
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.uint64)
+    return (values >> np.uint64(1)).astype(np.int64) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def encode_varints(values):
+    """Encodes unsigned integers as LEB128 varints, 7 bits per byte.
+
+    Args:
+        values (array-like): The unsigned integers.
+
+    Returns:
+        bytes: The encoded integers.
+    """
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        nbytes += (values >> np.uint64(7 * k)) != 0
+    offsets = np.cumsum(nbytes) - nbytes
+
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max(initial=0))):
+        mask = nbytes > k
+        chunk = ((values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)).astype(np.uint8)
+        chunk[nbytes[mask] > k + 1] |= 0x80
+        out[offsets[mask] + k] = chunk
+    return out.tobytes()
+
+
+def decode_varints(buffer):
+    """Decodes a stream of LEB128 varints.
+
+    Args:
+        buffer (bytes): The encoded integers.
+
+    Returns:
+        numpy.ndarray: The unsigned integers.
+    """
+    import numpy as np
+
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    if not len(ends) or ends[-1] != len(data) - 1:
+        raise ValueError("Truncated varint stream.")
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shifts = (np.arange(len(data)) - np.repeat(starts, ends - starts + 1)) * 7
+    parts = (data & 0x7F).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def _features(data):
+    if hasattr(data, "__geo_interface__"):
+        data = data.__geo_interface__
+    if isinstance(data, list):
+        return data
+    if data.get("type") == "FeatureCollection":
+        return data["features"]
+    if data.get("type") == "Feature":
+        return [data]
+    return [{"type": "Feature", "geometry": data, "properties": {}}]
+
+
+class _Paths:
+    """Collects the quantized lines and rings of all geometries before cutting them into arcs."""
+
+    def __init__(self, scale):
+        self.scale = scale
+        self.paths = []
+        self.closed = []
+
+    def quantize(self, coords):
+        import numpy as np
+
+        points = np.round(np.asarray(coords, dtype="float64")[:, :2] * self.scale).astype(np.int64)
+        if len(points) > 1:
+            keep = np.ones(len(points), dtype=bool)
+            keep[1:] = np.any(points[1:] != points[:-1], axis=1)
+            points = points[keep]
+        return points
+
+    def add(self, coords, closed):
+        points = self.quantize(coords)
+        if closed and len(points) > 1 and (points[0] == points[-1]).all():
+            points = points[:-1]
+        self.paths.append(points)
+        self.closed.append(closed)
+        return len(self.paths) - 1
+
+    def arcs(self):
+        """Cuts the paths into deduplicated arcs.
+
+        Returns:
+            tuple: The list of arcs, and for each path the list of its arc references.
+        """
+        import numpy as np
+
+        if not self.paths:
+            return [], []
+
+        points = np.concatenate(self.paths)
+        keys = _pack(points)
+        lengths = np.array([len(p) for p in self.paths])
+        starts = np.cumsum(lengths) - lengths
+        index = np.arange(len(points))
+        position = index - np.repeat(starts, lengths)
+        length = np.repeat(lengths, lengths)
+        closed = np.repeat(np.array(self.closed), lengths)
+
+        # The neighbours of each point, wrapping around rings.
+        prev = np.where(position > 0, index - 1, np.where(closed, index + length - 1, index))
+        nxt = np.where(position < length - 1, index + 1, np.where(closed, index - length + 1, index))
+        lo = np.minimum(keys[prev], keys[nxt])
+        hi = np.maximum(keys[prev], keys[nxt])
+
+        # A junction is a point reached through different neighbours, or the end of a line.
+        unique = np.unique(np.stack([keys, lo, hi], axis=1), axis=0)
+        point_keys, counts = np.unique(unique[:, 0], return_counts=True)
+        junctions = point_keys[counts > 1]
+        line_ends = ~closed & ((position == 0) | (position == length - 1))
+        junctions = np.union1d(junctions, keys[line_ends])
+        is_junction = np.isin(keys, junctions)
+
+        arcs = []
+        lookup = {}
+
+        def reference(arc):
+            key = arc.tobytes()
+            if key in lookup:
+                return lookup[key]
+            reversed_key = arc[::-1].tobytes()
+            if reversed_key in lookup:
+                return ~lookup[reversed_key]
+            lookup[key] = len(arcs)
+            arcs.append(arc)
+            return lookup[key]
+
+        refs = []
+        for path, start, is_closed in zip(self.paths, starts, self.closed):
+            cuts = np.flatnonzero(is_junction[start : start + len(path)])
+            if not is_closed:
+                cuts = np.union1d(cuts, [0, len(path) - 1]) if len(path) else cuts
+                refs.append([reference(path[a : b + 1]) for a, b in zip(cuts[:-1], cuts[1:])])
+                continue
+            if not len(cuts):
+                # A ring without junctions starts at its smallest point, so duplicates match.
+                first = int(np.argmin(_pack(path)))
+                ring = np.roll(path, -first, axis=0)
+                refs.append([reference(np.concatenate([ring, ring[:1]]))])
+                continue
+            ring = np.roll(path, -cuts[0], axis=0)
+            ring = np.concatenate([ring, ring[:1]])
+            cuts = np.append(cuts - cuts[0], len(path))
+            refs.append([reference(ring[a : b + 1]) for a, b in zip(cuts[:-1], cuts[1:])])
+        return arcs, refs
+
+
+def _pack(points):
+    import numpy as np
+
+    offset = np.int64(2**31)
+    return ((points[:, 0] + offset).astype(np.uint64) << np.uint64(32)) | (
+        points[:, 1] + offset
+    ).astype(np.uint64)
+
+
+def _collect(geometry, paths):
+    """Registers the lines and rings of a geometry and returns its structure."""
+    if geometry is None:
+        return None
+    kind = geometry["type"]
+    coords = geometry["coordinates"] if kind != "GeometryCollection" else None
+    if kind == "Point":
+        return kind, paths.quantize([coords])[0]
+    if kind == "MultiPoint":
+        return kind, paths.quantize(coords) if len(coords) else None
+    if kind == "LineString":
+        return kind, paths.add(coords, closed=False)
+    if kind == "MultiLineString":
+        return kind, [paths.add(line, closed=False) for line in coords]
+    if kind == "Polygon":
+        return kind, [paths.add(ring, closed=True) for ring in coords]
+    if kind == "MultiPolygon":
+        return kind, [[paths.add(ring, closed=True) for ring in polygon] for polygon in coords]
+    raise ValueError(f"Unsupported geometry type: {kind}")
+
+
+def _encode_geometry(structure, refs, out):
+    """Appends the integers of one geometry to ``out``.
+
+    Points are stored as absolute x/y, multipoints as a count and deltas.
+    Lines are a count of arc references followed by the references, and
+    the other types nest counts the same way as their GeoJSON coordinates.
+    """
+    if structure is None:
+        out.append(0)
+        return
+    kind, parts = structure
+    out.append(GEOMETRY_TYPES.index(kind))
+
+    def line(path):
+        out.append(len(refs[path]))
+        out.extend(refs[path])
+
+    if kind == "Point":
+        out.extend(int(v) for v in parts)
+    elif kind == "MultiPoint":
+        if parts is None:
+            out.append(0)
+        else:
+            out.append(len(parts))
+            out.extend(_deltas(parts).ravel().tolist())
+    elif kind == "LineString":
+        line(parts)
+    elif kind in ("MultiLineString", "Polygon"):
+        out.append(len(parts))
+        for path in parts:
+            line(path)
+    else:
+        out.append(len(parts))
+        for polygon in parts:
+            out.append(len(polygon))
+            for path in polygon:
+                line(path)
+
+
+def _deltas(points):
+    import numpy as np
+
+    return np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+
+
+def encode(data, precision=5):
+    """Encodes vector data as a compact binary buffer with shared arcs.
+
+    Args:
+        data (dict | list | geopandas.GeoDataFrame): A GeoJSON FeatureCollection, Feature or geometry,
+            a list of features, or any object with a ``__geo_interface__``.
+        precision (int, optional): The number of decimal places kept in coordinates. Defaults to 5
+            (about 1 m in longitude/latitude).
+
+    Returns:
+        bytes: The encoded data.
+    """
+    import numpy as np
+
+    features = _features(data)
+    paths = _Paths(10**precision)
+    structures = [_collect(feature.get("geometry"), paths) for feature in features]
+    arcs, refs = paths.arcs()
+
+    pieces = [np.array([len(arcs)], dtype=np.int64)]
+    for arc in arcs:
+        pieces.append(np.array([len(arc)], dtype=np.int64))
+        pieces.append(_deltas(arc).ravel())
+    geometries = []
+    for structure in structures:
+        _encode_geometry(structure, refs, geometries)
+    pieces.append(np.array(geometries, dtype=np.int64))
+
+    header = {
+        "precision": precision,
+        "properties": [feature.get("properties") or {} for feature in features],
+    }
+    ids = [feature.get("id") for feature in features]
+    if any(i is not None for i in ids):
+        header["ids"] = ids
+    header = json.dumps(header, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+    body = encode_varints(zigzag(np.concatenate(pieces)))
+    return MAGIC + struct.pack("<I", len(header)) + header + body
+
+
+def _json_default(value):
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def decode(buffer):
+    """Decodes a buffer created by encode() into a GeoJSON FeatureCollection.
+
+    Args:
+        buffer (bytes): The encoded data.
+
+    Returns:
+        dict: The GeoJSON FeatureCollection.
+    """
+    import numpy as np
+
+    if buffer[:4] != MAGIC:
+        raise ValueError("Not a thinkgreen binary vector buffer.")
+    (length,) = struct.unpack("<I", buffer[4:8])
+    header = json.loads(buffer[8 : 8 + length].decode("utf-8"))
+    values = unzigzag(decode_varints(buffer[8 + length :]))
+    scale = 10 ** header["precision"]
+
+    pos = 1
+    arcs = []
+    for _ in range(int(values[0]) if len(values) else 0):
+        n = int(values[pos])
+        arcs.append(np.cumsum(values[pos + 1 : pos + 1 + 2 * n].reshape(n, 2), axis=0) / scale)
+        pos += 1 + 2 * n
+    values = values.tolist()
+
+    def read():
+        nonlocal pos
+        pos += 1
+        return values[pos - 1]
+
+    def line():
+        parts = []
+        for i in range(read()):
+            ref = read()
+            arc = arcs[ref] if ref >= 0 else arcs[~ref][::-1]
+            parts.append(arc if i == 0 else arc[1:])
+        return np.concatenate(parts).tolist() if parts else []
+
+    features = []
+    ids = header.get("ids")
+    for i, properties in enumerate(header["properties"]):
+        kind = GEOMETRY_TYPES[read()]
+        if not kind:
+            geometry = None
+        elif kind == "Point":
+            geometry = {"type": kind, "coordinates": [read() / scale, read() / scale]}
+        elif kind == "MultiPoint":
+            n = read()
+            deltas = np.array(values[pos : pos + 2 * n], dtype=np.int64).reshape(n, 2)
+            pos += 2 * n
+            geometry = {"type": kind, "coordinates": (np.cumsum(deltas, axis=0) / scale).tolist()}
+        elif kind == "LineString":
+            geometry = {"type": kind, "coordinates": line()}
+        elif kind in ("MultiLineString", "Polygon"):
+            geometry = {"type": kind, "coordinates": [line() for _ in range(read())]}
+        else:
+            geometry = {
+                "type": kind,
+                "coordinates": [[line() for _ in range(read())] for _ in range(read())],
+            }
+        feature = {"type": "Feature", "geometry": geometry, "properties": properties}
+        if ids is not None and ids[i] is not None:
+            feature["id"] = ids[i]
+        features.append(feature)
+
+    return {"type": "FeatureCollection", "features": features}
+
+
+def decoder_js():
+    """Returns the JavaScript decoder, which defines ``thinkgreenTopobuf.decode``.
+
+    ``thinkgreenTopobuf.decode`` accepts an ArrayBuffer, a Uint8Array or a
+    base64 string and returns a GeoJSON FeatureCollection.
+
+    Returns:
+        str: The JavaScript source.
+    """
+    import os
+
+    with open(os.path.join(os.path.dirname(__file__), "static", "topobuf.js")) as f:
+        return f.read()
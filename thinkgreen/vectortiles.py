@@ -0,0 +1,186 @@
+"""Cuts vector data into Mapbox Vector Tiles on demand."""
+
+import itertools
+
+from .cache import LRUCache
+from .tileserver import get_server, parse_tile, tile_bounds
+
+_ids = itertools.count(1)
+
+
+class VectorTileSource:
+    """Serves a GeoDataFrame as Mapbox Vector Tiles cut on demand.
+
+    Geometries are projected to Web Mercator and indexed once. Each requested
+    tile only touches the features intersecting it, which are clipped,
+    simplified to the tile resolution and encoded. Features smaller than a
+    screen pixel are dropped, and points are thinned to one per pixel, so
+    low-zoom tiles stay small. Encoded tiles are kept in an LRU cache
+    bounded in bytes.
+
+    Args:
+        data (str | geopandas.GeoDataFrame): The vector data or the path to a vector file.
+        name (str, optional): The name of the layer inside the tiles. Defaults to "layer".
+        columns (list, optional): The attribute columns to include. Defaults to all columns.
+        extent (int, optional): The tile coordinate extent. Defaults to 4096.
+        buffer (int, optional): The tile buffer in tile coordinates. Defaults to 64.
+        cache_bytes (int, optional): The size limit of the tile cache. Defaults to 64 MiB.
+        max_features (int, optional): The maximum number of features per tile. Defaults to 50000.
+    """
+
+    def __init__(
+        self,
+        data,
+        name="layer",
+        columns=None,
+        extent=4096,
+        buffer=64,
+        cache_bytes=64 * 1024 * 1024,
+        max_features=50000,
+    ):
+        import geopandas as gpd
+        import numpy as np
+        import shapely
+
+        if isinstance(data, str):
+            data = gpd.read_file(data, columns=columns)
+        if data.crs is None:
+            data = data.set_crs(epsg=4326)
+        data = data.to_crs(epsg=4326)
+        geometries = shapely.clip_by_rect(data.geometry.values, -180, -85.0511, 180, 85.0511)
+        data = data.set_geometry(geometries).to_crs(epsg=3857)
+
+        attrs = data.drop(columns=data.geometry.name)
+        if columns is not None:
+            attrs = attrs[[c for c in columns if c in attrs.columns]]
+
+        self.name = name
+        self.extent = extent
+        self.buffer = buffer
+        self.geometries = data.geometry.values
+        self.attrs = attrs.reset_index(drop=True)
+        self.max_features = max_features
+        self.bounds = shapely.bounds(self.geometries)
+        self.is_point = np.isin(shapely.get_type_id(self.geometries), (0, 4))
+        self.tree = shapely.STRtree(self.geometries)
+        self.cache = LRUCache(cache_bytes)
+        self._prefix = None
+
+    def tile(self, z, x, y):
+        """Returns the encoded tile at z/x/y.
+
+        Args:
+            z (int): The zoom level.
+            x (int): The tile column.
+            y (int): The tile row.
+
+        Returns:
+            bytes: The Mapbox Vector Tile, empty if no feature intersects the tile.
+        """
+        key = (z, x, y)
+        data = self.cache.get(key)
+        if data is None:
+            data = self._encode(z, x, y)
+            self.cache.put(key, data)
+        return data
+
+    def _encode(self, z, x, y):
+        import mapbox_vector_tile
+        import numpy as np
+        import shapely
+
+        bounds = tile_bounds(z, x, y)
+        pad = (bounds[2] - bounds[0]) * self.buffer / self.extent
+        clip = (bounds[0] - pad, bounds[1] - pad, bounds[2] + pad, bounds[3] + pad)
+
+        idx = self.tree.query(shapely.box(*clip))
+        if len(idx) == 0:
+            return b""
+        idx = self._thin(np.sort(idx), (bounds[2] - bounds[0]) / 256)
+
+        geometries = shapely.clip_by_rect(self.geometries[idx], *clip)
+        resolution = (bounds[2] - bounds[0]) / self.extent
+        geometries = shapely.simplify(geometries, resolution, preserve_topology=True)
+        keep = ~shapely.is_empty(geometries)
+        if not keep.any():
+            return b""
+
+        # Quantize to integer tile coordinates with y pointing down.
+        scale = self.extent / (bounds[2] - bounds[0])
+        origin = np.array([bounds[0], bounds[3]])
+        flip = np.array([scale, -scale])
+        geometries = shapely.transform(
+            geometries[keep], lambda c: np.round((c - origin) * flip)
+        )
+
+        records = self.attrs.iloc[idx[keep]].to_dict(orient="records")
+        features = [
+            {
+                "geometry": geometry,
+                "properties": {k: v for k, v in record.items() if _encodable(v)},
+            }
+            for geometry, record in zip(geometries, records)
+        ]
+        return mapbox_vector_tile.encode(
+            {"name": self.name, "features": features},
+            default_options={"y_coord_down": True, "extents": self.extent},
+        )
+
+    def _thin(self, idx, pixel):
+        """Drops the features of a tile that would not be visible on screen.
+
+        Args:
+            idx (numpy.ndarray): The indices of the candidate features.
+            pixel (float): The size of a screen pixel in meters.
+
+        Returns:
+            numpy.ndarray: The indices of the features to encode.
+        """
+        import numpy as np
+
+        bounds = self.bounds[idx]
+        size = np.maximum(bounds[:, 2] - bounds[:, 0], bounds[:, 3] - bounds[:, 1])
+        # Points, and multipoints within a pixel, are kept once per pixel rather than by size.
+        points = self.is_point[idx] & (size < pixel)
+        keep = ~points & (size >= pixel)
+
+        if points.any():
+            cells = np.floor(bounds[points, :2] / pixel).astype(np.int64)
+            _, first = np.unique(cells, axis=0, return_index=True)
+            keep[np.flatnonzero(points)[first]] = True
+
+        idx, size = idx[keep], size[keep]
+        if len(idx) > self.max_features:
+            largest = np.argsort(size, kind="stable")[::-1][: self.max_features]
+            idx = np.sort(idx[largest])
+        return idx
+
+    def serve(self):
+        """Registers the source with the shared tile server.
+
+        Returns:
+            str: The XYZ URL template of the tiles.
+        """
+        self._prefix = f"vt/{next(_ids)}"
+
+        def handler(segments, query):
+            tile = parse_tile(segments)
+            if tile is None:
+                return None
+            return self.tile(*tile), "application/x-protobuf"
+
+        url = get_server().register(self._prefix, handler)
+        return url + "/{z}/{x}/{y}.pbf"
+
+    def close(self):
+        """Unregisters the source from the shared tile server."""
+        if self._prefix is not None:
+            get_server().unregister(self._prefix)
+            self._prefix = None
+
+
+def _encodable(value):
+    """Checks whether a property value can be stored in a vector tile."""
+    if isinstance(value, float):
+        return value == value
+    return isinstance(value, (str, int, bool))